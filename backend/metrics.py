@@ -0,0 +1,161 @@
+# backend/metrics.py
+import bisect
+import contextvars
+import threading
+import time
+from django.db.backends.signals import connection_created
+
+# In-process metrics, exposed in the Prometheus text format on /metrics.
+# Each process keeps its own values (a scrape sees the worker that answers it),
+# so nothing outside the app is needed to collect them.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    """A Prometheus-style histogram with a fixed label set; observe() is one lock and a bisect"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Record a value for the labels, given in labelnames order"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, the last one for +Inf, then the sum
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labelvalues, values in series:
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, labelvalues))
+            prefix = f"{labels}," if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return '\n'.join(lines)
+
+
+class Gauge:
+    """A gauge whose values are read from a callback when /metrics is scraped"""
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def clear(self):
+        pass
+
+    def render(self):
+        """callback returns (labelvalues, value) pairs"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labelvalues, value in self.callback():
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, labelvalues))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name, method and status',
+    ['view', 'method', 'status']
+)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries per request by URL name',
+    ['view'], buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Time spent in database queries per request by URL name',
+    ['view']
+)
+MORALIS_REQUEST_DURATION = Histogram(
+    'moralis_request_duration_seconds',
+    'Moralis call latency by endpoint, chain and status (a call covering several chains counts for each)',
+    ['endpoint', 'chain', 'status']
+)
+
+METRICS = [REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION, MORALIS_REQUEST_DURATION]
+
+def register(metric):
+    """Add a metric defined elsewhere to /metrics"""
+    METRICS.append(metric)
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+
+def clear():
+    for metric in METRICS:
+        metric.clear()
+
+
+def observe_moralis_call(endpoint, chains, status, duration):
+    """Record one Moralis HTTP attempt; status is the response code or the exception class name"""
+    for chain in chains or ['all']:
+        MORALIS_REQUEST_DURATION.observe(duration, endpoint or 'other', chain, str(status))
+
+
+class QueryStats:
+    """
+    Database query count and time for the request being handled
+    Set queries to a list to also collect each (sql, duration) pair
+    """
+    __slots__ = ('count', 'duration', 'queries')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = None
+
+
+# Set by MetricsMiddleware for the duration of a request; context variables follow
+# the request into sync_to_async threads, so async views are counted too
+current_query_stats = contextvars.ContextVar('current_query_stats', default=None)
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request's QueryStats"""
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.count += 1
+        stats.duration += duration
+        if stats.queries is not None:
+            stats.queries.append((sql, duration))
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='backend.metrics.install_query_recorder')
@@ -23,13 +23,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.MetricsMiddleware',  # First, so request latency covers every other middleware
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this for static file serving
+    'backend.middleware.WhiteNoiseMiddleware',  # Add this for static file serving (async-capable wrapper)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Make sure this is high in the list
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'wallets.profiling.ProfilingMiddleware',  # After authentication, so session users are known
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +65,10 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # Loads the user through a short-lived cache, so staff and active checks are at
+        # most AUTH_USER_CACHE_TTL old; the wallet views build the user from token
+        # claims instead (ClaimsJWTAuthentication), without a query per request
+        "users.authentication.CachedUserJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -73,8 +78,14 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    # Tokens carry the email and is_staff claims ClaimsJWTAuthentication reads
+    "TOKEN_OBTAIN_SERIALIZER": "users.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.authentication.ClaimsTokenRefreshSerializer",
 }
 
+# Seconds a full user row stays cached for CachedUserJWTAuthentication
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
 USE_I18N = True
@@ -84,3 +95,98 @@ STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Bearer token Prometheus scrapes /metrics with; staff users can also read it with their access token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Functions listed in cProfile reports of X-Profile requests (staff only, stored as RequestProfile)
+PROFILING_STATS_LIMIT = int(os.environ.get('PROFILING_STATS_LIMIT', 50))
+
+# Moralis client
+# Maximum number of Moralis requests in flight at once during a wallet sync
+MORALIS_MAX_CONCURRENCY = int(os.environ.get('MORALIS_MAX_CONCURRENCY', 8))
+# Size of the keep-alive connection pool to Moralis (keep >= MORALIS_MAX_CONCURRENCY)
+MORALIS_POOL_SIZE = int(os.environ.get('MORALIS_POOL_SIZE', 20))
+MORALIS_CONNECT_TIMEOUT = float(os.environ.get('MORALIS_CONNECT_TIMEOUT', 3.05))
+MORALIS_READ_TIMEOUT = float(os.environ.get('MORALIS_READ_TIMEOUT', 15))
+# Retries for 429/5xx responses and connection errors, with jittered exponential backoff
+MORALIS_MAX_RETRIES = int(os.environ.get('MORALIS_MAX_RETRIES', 3))
+MORALIS_RETRY_BACKOFF = float(os.environ.get('MORALIS_RETRY_BACKOFF', 0.5))
+MORALIS_RETRY_MAX_DELAY = float(os.environ.get('MORALIS_RETRY_MAX_DELAY', 10))
+# Net worth response cache: 'local' (per process), 'django' (uses CACHES[MORALIS_CACHE_ALIAS])
+# or a dotted path to a custom backend class. A TTL of 0 disables caching.
+MORALIS_CACHE_BACKEND = os.environ.get('MORALIS_CACHE_BACKEND', 'local')
+MORALIS_CACHE_ALIAS = os.environ.get('MORALIS_CACHE_ALIAS', 'default')
+MORALIS_CACHE_TTL = int(os.environ.get('MORALIS_CACHE_TTL', 60))
+# Grace window after the TTL during which /sync/ gets stale data while one background refresh runs;
+# balances stored from it keep the entry's fetch time as synced_at. Adding wallets and the refresh
+# jobs always wait for fresh data
+MORALIS_CACHE_STALE_TTL = int(os.environ.get('MORALIS_CACHE_STALE_TTL', 300))
+MORALIS_CACHE_MAX_ENTRIES = int(os.environ.get('MORALIS_CACHE_MAX_ENTRIES', 10000))
+
+# Wallet sync job queue
+# When enabled, /api/wallets/sync/ queues SyncJobs for `manage.py sync_worker` instead of calling Moralis inline
+WALLET_SYNC_USE_QUEUE = os.environ.get('WALLET_SYNC_USE_QUEUE', 'False') == 'True'
+SYNC_JOB_BATCH_SIZE = int(os.environ.get('SYNC_JOB_BATCH_SIZE', 50))
+# Failed jobs retry with exponential backoff and are dead-lettered after this many attempts
+SYNC_JOB_MAX_ATTEMPTS = int(os.environ.get('SYNC_JOB_MAX_ATTEMPTS', 5))
+SYNC_JOB_RETRY_BACKOFF = int(os.environ.get('SYNC_JOB_RETRY_BACKOFF', 30))
+# Running jobs not finished within this many seconds are returned to the queue
+SYNC_JOB_STALE_AFTER = int(os.environ.get('SYNC_JOB_STALE_AFTER', 300))
+
+# Staleness-driven refresh (`manage.py refresh_stale_wallets`)
+# A wallet belongs to the first tier whose balance or follower threshold it meets,
+# and is refreshed once `interval` seconds have passed since synced_at
+WALLET_REFRESH_TIERS = [
+    {'name': 'hot', 'min_balance_usd': 100000, 'min_followers': 10, 'interval': 5 * 60},
+    {'name': 'warm', 'min_balance_usd': 1000, 'min_followers': 3, 'interval': 30 * 60},
+    {'name': 'cold', 'min_balance_usd': 0, 'min_followers': 0, 'interval': 6 * 60 * 60},
+]
+# Global Moralis call budget for the scheduler
+WALLET_REFRESH_CALLS_PER_MINUTE = int(os.environ.get('WALLET_REFRESH_CALLS_PER_MINUTE', 60))
+# /api/wallets/sync/ skips wallets synced within this many seconds
+WALLET_SYNC_FRESH_SECONDS = int(os.environ.get('WALLET_SYNC_FRESH_SECONDS', 60))
+# Largest batch accepted by /api/wallets/import/
+WALLET_IMPORT_MAX_ROWS = int(os.environ.get('WALLET_IMPORT_MAX_ROWS', 1000))
+# refresh_holdings skips wallets whose token holdings were refreshed within this many seconds
+WALLET_HOLDINGS_FRESH_SECONDS = int(os.environ.get('WALLET_HOLDINGS_FRESH_SECONDS', 3600))
+# refresh_token_prices re-fetches cached token prices older than this many seconds
+TOKEN_PRICE_FRESH_SECONDS = int(os.environ.get('TOKEN_PRICE_FRESH_SECONDS', 300))
+# Identical concurrent net worth lookups are always coalesced within a process.
+# Enable this (with MORALIS_CACHE_BACKEND='django' on a shared cache) to coalesce across processes too.
+MORALIS_SINGLEFLIGHT_CROSS_PROCESS = os.environ.get('MORALIS_SINGLEFLIGHT_CROSS_PROCESS', 'False') == 'True'
+MORALIS_SINGLEFLIGHT_POLL_INTERVAL = float(os.environ.get('MORALIS_SINGLEFLIGHT_POLL_INTERVAL', 0.05))
+# Client-side Moralis rate limiting. Every call spends its endpoint's compute units from a
+# token bucket refilled at MORALIS_COMPUTE_UNITS_PER_SECOND ('local' per process, or 'django'
+# to share the budget through the cache). Match these to your Moralis plan.
+MORALIS_RATE_LIMIT_BACKEND = os.environ.get('MORALIS_RATE_LIMIT_BACKEND', 'local')
+MORALIS_COMPUTE_UNITS_PER_SECOND = int(os.environ.get('MORALIS_COMPUTE_UNITS_PER_SECOND', 1000))
+MORALIS_ENDPOINT_COMPUTE_UNITS = {
+    'net-worth': 500,
+    'tokens': 100,
+    'token-prices': 100,
+}
+MORALIS_DEFAULT_COMPUTE_UNITS = 50
+# Maximum concurrent Moralis calls per chain
+MORALIS_PER_CHAIN_CONCURRENCY = int(os.environ.get('MORALIS_PER_CHAIN_CONCURRENCY', MORALIS_POOL_SIZE))
+# Seconds a call may wait for budget or a chain slot before failing with MoralisRateLimitError.
+# Throttled calls queue rather than fail within this window: at 500 CU per net worth call and
+# 1000 CU/s, a 20-address sync needs about 10s of budget, and failed calls drop wallets from it
+MORALIS_RATE_LIMIT_MAX_WAIT = float(os.environ.get('MORALIS_RATE_LIMIT_MAX_WAIT', 15.0))
+# Circuit breaker around Moralis: it opens when, over the last MORALIS_BREAKER_WINDOW seconds and
+# at least MORALIS_BREAKER_MIN_CALLS calls, the share of failed (5xx/connection error) calls reaches
+# MORALIS_BREAKER_ERROR_RATE or the share of calls slower than MORALIS_BREAKER_SLOW_CALL_SECONDS reaches
+# MORALIS_BREAKER_SLOW_CALL_RATE. While open, sync returns stored balances marked stale; after
+# MORALIS_BREAKER_OPEN_SECONDS, MORALIS_BREAKER_HALF_OPEN_CALLS probe calls decide whether it closes
+MORALIS_BREAKER_WINDOW = int(os.environ.get('MORALIS_BREAKER_WINDOW', 30))
+MORALIS_BREAKER_MIN_CALLS = int(os.environ.get('MORALIS_BREAKER_MIN_CALLS', 10))
+MORALIS_BREAKER_ERROR_RATE = float(os.environ.get('MORALIS_BREAKER_ERROR_RATE', 0.5))
+MORALIS_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('MORALIS_BREAKER_SLOW_CALL_SECONDS', 5.0))
+MORALIS_BREAKER_SLOW_CALL_RATE = float(os.environ.get('MORALIS_BREAKER_SLOW_CALL_RATE', 0.5))
+MORALIS_BREAKER_OPEN_SECONDS = int(os.environ.get('MORALIS_BREAKER_OPEN_SECONDS', 30))
+MORALIS_BREAKER_HALF_OPEN_CALLS = int(os.environ.get('MORALIS_BREAKER_HALF_OPEN_CALLS', 3))
+# Base URL of the Moralis API (override to point at a local stand-in for benchmarks)
+MORALIS_BASE_URL = os.environ.get('MORALIS_BASE_URL', 'https://deep-index.moralis.io/api/v2.2')
+# Pages (of up to 100 tokens) fetched per wallet and chain when refreshing token holdings
+MORALIS_TOKENS_MAX_PAGES = int(os.environ.get('MORALIS_TOKENS_MAX_PAGES', 5))
+# Tokens priced per Moralis call by refresh_token_prices (Moralis allows at most 25)
+MORALIS_PRICE_BATCH_SIZE = int(os.environ.get('MORALIS_PRICE_BATCH_SIZE', 25))
@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
+from .views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api/users/', include('users.urls')),
     path('api/wallets/', include('wallets.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
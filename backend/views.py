@@ -0,0 +1,30 @@
+# backend/views.py
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import CachedUserJWTAuthentication
+from . import metrics as app_metrics
+
+def metrics_allowed(request):
+    """Allow the METRICS_TOKEN bearer token (for scrapers) or a staff user's access token"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and hmac.compare_digest(header[7:].encode(), token.encode()):
+        return True
+    try:
+        auth = CachedUserJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return auth is not None and auth[0].is_staff
+
+
+def metrics(request):
+    """Request, database and Moralis metrics in the Prometheus text format"""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    if not metrics_allowed(request):
+        return JsonResponse({'detail': 'You do not have permission to access the metrics.'}, status=403)
+    response = HttpResponse(app_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,117 @@
+# users/authentication.py
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# Claims copied from the user into every token, enough for the wallet endpoints'
+# user checks without loading the user
+USER_CLAIMS = ('email', 'is_staff')
+
+def add_user_claims(token, user):
+    token['email'] = user.email
+    token['is_staff'] = user.is_staff
+    return token
+
+
+class UserCache:
+    """
+    Short-lived cache of full user rows for authentication, keyed by user id
+    Call invalidate() whenever a user is changed
+    """
+
+    @staticmethod
+    def key(user_id):
+        return f"auth:user:{user_id}"
+
+    @classmethod
+    def get(cls, user_id):
+        """Return the user with the given id from the cache or the database, or None"""
+        key = cls.key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+            if user is not None:
+                cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+        return user
+
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(cls.key(user_id))
+
+
+class CachedUserJWTAuthentication(JWTAuthentication):
+    """simplejwt authentication that loads the full user through UserCache"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = UserCache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+
+class ClaimsJWTAuthentication(CachedUserJWTAuthentication):
+    """
+    simplejwt authentication that builds the user from the token's claims, without a query
+    The user is a CustomUser instance with only id, email and is_staff loaded, so ORM
+    filters and foreign keys work; any other field is loaded from the database on first
+    access, so views that need the whole user should use CachedUserJWTAuthentication.
+    Tokens issued before the claims existed fall back to the cached lookup.
+    A deactivated or demoted user keeps their claims until their access token expires
+    (refreshing is refused), so it is only used on the wallet views; staff checks go
+    through the default CachedUserJWTAuthentication
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token or any(
+            claim not in validated_token for claim in USER_CLAIMS
+        ):
+            return super().get_user(validated_token)
+
+        User = get_user_model()
+        # simplejwt stores the id as a string
+        user_id = User._meta.get_field(api_settings.USER_ID_FIELD).to_python(validated_token[api_settings.USER_ID_CLAIM])
+        return User.from_db(
+            DEFAULT_DB_ALIAS,
+            [api_settings.USER_ID_FIELD, 'email', 'is_staff', 'is_active'],
+            [user_id, validated_token['email'], validated_token['is_staff'], True]
+        )
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's current claims"""
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = UserCache.get(self[api_settings.USER_ID_CLAIM])
+        if user is not None:
+            add_user_claims(access, user)
+        return access
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issues tokens with the user claims ClaimsJWTAuthentication reads"""
+    token_class = ClaimsRefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
@@ -2,6 +2,7 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from .authentication import CachedUserJWTAuthentication, UserCache
 from .serializers import UserRegistrationSerializer, UserSerializer
 
 class RegisterView(APIView):
@@ -25,6 +26,8 @@ class RegisterView(APIView):
 
 class UserDetailView(APIView):
     """Get authenticated user details or update user information"""
+    # Needs the whole user, not just the token claims
+    authentication_classes = [CachedUserJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -37,5 +40,6 @@ class UserDetailView(APIView):
         serializer = UserSerializer(request.user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            UserCache.invalidate(request.user.pk)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
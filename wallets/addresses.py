@@ -0,0 +1,19 @@
+# wallet/addresses.py
+
+# Canonical forms of wallet addresses and chain names, applied wherever they enter
+# the app so each wallet has exactly one row, one Moralis fetch and one cache key
+
+# Chains whose addresses are hex and case-insensitive (EIP-55 casing is only a checksum).
+# Every chain in MoralisService.CHAIN_MAPPING is EVM; addresses on other chains are kept as typed
+EVM_CHAINS = frozenset({'eth', 'bsc', 'polygon', 'avalanche', 'fantom', 'arbitrum', 'optimism'})
+
+def normalize_chain(chain):
+    return chain.strip().lower()
+
+
+def normalize_address(address, chain):
+    """Return the canonical form of an address on a chain: trimmed, and lowercased on EVM chains"""
+    address = address.strip()
+    if normalize_chain(chain) in EVM_CHAINS:
+        return address.lower()
+    return address
@@ -1,6 +1,8 @@
 # wallet/admin.py
+import json
 from django.contrib import admin
-from .models import Wallet, WalletUser
+from django.utils.html import format_html
+from .models import Wallet, WalletUser, PortfolioSummary, SyncJob, TokenHolding, RequestProfile
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
@@ -25,3 +27,52 @@ class WalletUserAdmin(admin.ModelAdmin):
     @admin.display(description='Chain')
     def wallet_chain(self, obj):
         return obj.wallet.chain
+
+@admin.register(PortfolioSummary)
+class PortfolioSummaryAdmin(admin.ModelAdmin):
+    """Admin configuration for PortfolioSummary model"""
+    list_display = ('user', 'total_usd', 'wallet_count', 'last_synced_at', 'updated_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('updated_at',)
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    """Admin configuration for SyncJob model"""
+    list_display = ('address', 'chain', 'status', 'attempts', 'available_at', 'created_at')
+    search_fields = ('address',)
+    list_filter = ('status', 'chain')
+    readonly_fields = ('created_at', 'locked_at')
+
+@admin.register(TokenHolding)
+class TokenHoldingAdmin(admin.ModelAdmin):
+    """Admin configuration for TokenHolding model"""
+    list_display = ('wallet', 'symbol', 'token_address', 'amount', 'decimals', 'usd_price', 'updated_at')
+    search_fields = ('wallet__address', 'token_address', 'symbol')
+    list_filter = ('wallet__chain',)
+    raw_id_fields = ('wallet',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Admin configuration for RequestProfile model (read-only)"""
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms', 'user')
+    search_fields = ('path', 'user__email')
+    list_filter = ('method', 'status_code', 'profiler')
+    exclude = ('stats', 'queries')
+    readonly_fields = (
+        'user', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+        'profiler', 'created_at', 'profile_report', 'sql_queries'
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Profile')
+    def profile_report(self, obj):
+        return format_html('<pre>{}</pre>', obj.stats)
+
+    @admin.display(description='SQL queries')
+    def sql_queries(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.queries, indent=2))
@@ -0,0 +1,203 @@
+# wallet/async_client.py
+import asyncio
+import json
+import logging
+import time
+import weakref
+from django.conf import settings
+import aiohttp
+from backend import metrics
+from .cache import NetWorthCache
+from .circuit import MoralisCircuitBreaker, MoralisUnavailable
+from .http import MoralisHttpClient
+from .ratelimit import MoralisRateLimiter, MoralisRateLimitError
+from .services import MoralisService
+
+logger = logging.getLogger(__name__)
+
+class AsyncMoralisService:
+    """
+    Async counterpart of MoralisService for the ASGI views
+    Uses one pooled aiohttp session per event loop, with the same timeouts,
+    retries, cache, rate limits and response handling as the sync client
+    """
+
+    _sessions = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_session(cls):
+        """Return the pooled session for the running event loop"""
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=getattr(settings, 'MORALIS_POOL_SIZE', 20)),
+                timeout=aiohttp.ClientTimeout(
+                    connect=getattr(settings, 'MORALIS_CONNECT_TIMEOUT', 3.05),
+                    sock_read=getattr(settings, 'MORALIS_READ_TIMEOUT', 15),
+                ),
+            )
+            cls._sessions[loop] = session
+        return session
+
+    @classmethod
+    async def close(cls):
+        """Close the running event loop's session, if it has one"""
+        session = cls._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    @classmethod
+    async def get_wallet_net_worth(cls, address, chain=None, chains=None):
+        """
+        Fetch wallet net worth from Moralis API, served from NetWorthCache when fresh
+        Returns tuple: (success_bool, data_or_error_message)
+        """
+        success, result, _ = await cls.get_wallet_net_worth_entry(address, chain, chains)
+        return success, result
+
+    @classmethod
+    async def get_wallet_net_worth_entry(cls, address, chain=None, chains=None, allow_stale=False):
+        """
+        Async version of MoralisService.get_wallet_net_worth_entry
+        Returns tuple: (success_bool, data_or_error_message, fetched_at timestamp or None)
+        """
+        return await NetWorthCache.aget_or_fetch(
+            address,
+            MoralisService.requested_chains(chain, chains),
+            lambda: cls._fetch_wallet_net_worth(address, chain, chains),
+            allow_stale=allow_stale
+        )
+
+    @classmethod
+    async def _fetch_wallet_net_worth(cls, address, chain=None, chains=None):
+        """Call the Moralis net worth endpoint directly, bypassing the cache"""
+        try:
+            api_url, headers, params = MoralisService.build_net_worth_request(address, chain, chains)
+            response, text = await cls.request(
+                'GET',
+                api_url,
+                endpoint='net-worth',
+                chains=params.get('chains'),
+                headers=headers,
+                # aiohttp doesn't expand list values, so repeat the key for each one
+                params=[
+                    (key, value)
+                    for key, values in params.items()
+                    for value in (values if isinstance(values, list) else [values])
+                ]
+            )
+            logger.debug(f"Moralis API response: {text}")
+            return MoralisService.parse_net_worth_response(response.status, text, lambda: json.loads(text), chain)
+        except (MoralisUnavailable, MoralisRateLimitError) as e:
+            # Expected during an outage or a burst, no traceback needed
+            error_msg = f"Error fetching wallet net worth: {str(e)}"
+            logger.warning(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Error fetching wallet net worth: {str(e)}"
+            logger.exception(error_msg)
+            return False, error_msg
+
+    @classmethod
+    async def request(cls, method, url, endpoint=None, chains=None, **kwargs):
+        """
+        Send a request, retrying 429/5xx responses and connection errors like MoralisHttpClient
+        Returns tuple (response, body_text); the response is already released to the pool
+        """
+        session = cls.get_session()
+        max_retries = getattr(settings, 'MORALIS_MAX_RETRIES', 3)
+
+        attempt = 0
+        while True:
+            MoralisCircuitBreaker.fail_fast()
+            MoralisHttpClient.increment('requests')
+            try:
+                if endpoint:
+                    async with MoralisRateLimiter.alimit(endpoint, chains):
+                        response, text = await cls._send(session, method, url, endpoint, chains, **kwargs)
+                else:
+                    response, text = await cls._send(session, method, url, endpoint, chains, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= max_retries:
+                    MoralisHttpClient.increment('errors')
+                    raise
+                delay = MoralisHttpClient.backoff_delay(attempt)
+                logger.warning(
+                    f"Moralis request failed ({e.__class__.__name__}), "
+                    f"retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+                )
+            else:
+                if response.status not in MoralisHttpClient.RETRY_STATUS_CODES or attempt >= max_retries:
+                    return response, text
+                delay = MoralisHttpClient.retry_after_delay(response)
+                if delay is None:
+                    delay = MoralisHttpClient.backoff_delay(attempt)
+                logger.warning(
+                    f"Moralis returned {response.status}, "
+                    f"retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+                )
+
+            MoralisHttpClient.increment('retries')
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _send(session, method, url, endpoint, chains, **kwargs):
+        MoralisCircuitBreaker.check()
+        started = time.perf_counter()
+        # Stays 'cancelled' if the task is cancelled (CancelledError isn't an Exception)
+        status = 'cancelled'
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                status = response.status
+                return response, await response.text()
+        except Exception as e:
+            status = e.__class__.__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            metrics.observe_moralis_call(endpoint, chains, status, duration)
+            if status == 'cancelled':
+                # A cancelled call says nothing about Moralis' health, so it isn't
+                # recorded; it only gives back its probe slot
+                MoralisCircuitBreaker.release()
+            else:
+                MoralisCircuitBreaker.record(MoralisCircuitBreaker.is_failure(status), duration)
+
+    @classmethod
+    async def fetch_net_worths(cls, wallets, max_workers=None, allow_stale=False):
+        """
+        Async version of WalletSyncService.fetch_net_worths: one call per address,
+        at most max_workers in flight, results yielded as each call completes
+        Yields tuple (wallet, success_bool, data_or_error_message, fetched_at)
+        """
+        wallets_by_address = {}
+        for wallet in wallets:
+            wallets_by_address.setdefault(wallet.address, []).append(wallet)
+        if not wallets_by_address:
+            return
+
+        semaphore = asyncio.Semaphore(max_workers or getattr(settings, 'MORALIS_MAX_CONCURRENCY', 8))
+
+        async def fetch(address, address_wallets):
+            async with semaphore:
+                try:
+                    if len(address_wallets) == 1:
+                        result = await cls.get_wallet_net_worth_entry(
+                            address, address_wallets[0].chain, allow_stale=allow_stale
+                        )
+                    else:
+                        result = await cls.get_wallet_net_worth_entry(
+                            address, chains=[wallet.chain for wallet in address_wallets], allow_stale=allow_stale
+                        )
+                except Exception as e:
+                    logger.exception(f"Unexpected error fetching wallet {address}: {str(e)}")
+                    result = (False, str(e), None)
+            return address_wallets, result
+
+        tasks = [fetch(address, address_wallets) for address, address_wallets in wallets_by_address.items()]
+        for next_done in asyncio.as_completed(tasks):
+            address_wallets, (success, result, fetched_at) = await next_done
+            for wallet in address_wallets:
+                yield wallet, success, result, fetched_at
@@ -0,0 +1,292 @@
+# wallet/async_views.py
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import ClaimsJWTAuthentication
+from .addresses import normalize_address, normalize_chain
+from .async_client import AsyncMoralisService
+from .circuit import MoralisCircuitBreaker
+from .conditional import etag_matches, wallet_list_etag
+from .models import Wallet, WalletUser
+from .portfolio import PortfolioService, format_balance
+from .queue import SyncQueue
+from .serializers import AddWalletSerializer, WalletSerializer
+from .services import MoralisService, WalletAlreadyAdded, WalletSyncService
+from . import streaming
+
+logger = logging.getLogger(__name__)
+
+# Async versions of WalletView for ASGI servers. Moralis calls are awaited on the
+# event loop instead of holding a worker thread each; reads use the async ORM and
+# multi-statement writes run in one sync_to_async call so they keep their transaction.
+
+def jwt_required(view):
+    """Authenticate the request with a simplejwt access token (claims only, no query), or answer 401"""
+    authenticator = ClaimsJWTAuthentication()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            auth = await sync_to_async(authenticator.authenticate)(request)
+        except AuthenticationFailed as e:
+            # Same body and header DRF sends for a rejected token
+            response = JsonResponse(e.detail if isinstance(e.detail, dict) else {'detail': e.detail}, status=401)
+            response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return response
+        if auth is None:
+            response = JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+            response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return response
+        request.user = auth[0]
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def parse_body(request):
+    """Return the JSON (or form) body of a request as a dict"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST.dict()
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+@jwt_required
+async def wallets_view(request):
+    """List the user's wallets (GET, with the same ETag handling as WalletView.get) or add a new one (POST)"""
+    if request.method == 'POST':
+        return await add_wallet(request)
+    rows = [
+        row async for row in Wallet.objects.filter(walletuser__user=request.user)
+        .order_by('id')
+        .values('id', 'address', 'balance_usd', 'chain')
+    ]
+    etag = wallet_list_etag(rows)
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(WalletSerializer.from_values(rows), safe=False)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+async def add_wallet(request):
+    """Add a new wallet for the authenticated user"""
+    data = parse_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+
+    serializer = AddWalletSerializer(data=data, context={'request': request})
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse({'errors': serializer.errors}, status=400)
+    address = serializer.validated_data['address']
+    chain = serializer.validated_data['chain']
+
+    # Fetch the requested chain and the address's other tracked chains in one call, like the sync view
+    other_wallets = await sync_to_async(WalletSyncService.other_chain_wallets)(address, chain)
+    success, result = await AsyncMoralisService.get_wallet_net_worth(
+        address, chains=[chain] + [wallet.chain for wallet in other_wallets]
+    )
+    if not success and MoralisCircuitBreaker.is_open():
+        response = JsonResponse({'error': 'Wallet data is temporarily unavailable, please try again later'}, status=503)
+        response['Retry-After'] = str(max(1, round(MoralisCircuitBreaker.retry_after())))
+        return response
+    if not success or not result or not isinstance(result, dict):
+        return JsonResponse({'error': result if result else 'Failed to retrieve wallet data'}, status=400)
+
+    balance_value = MoralisService.extract_chain_balance(result, chain)
+    if balance_value is None:
+        return JsonResponse({'error': f"No data found for chain: {chain}"}, status=400)
+
+    try:
+        wallet, created = await sync_to_async(store_wallet)(
+            request.user, address, chain, balance_value, result, other_wallets
+        )
+    except WalletAlreadyAdded:
+        return JsonResponse(
+            {'errors': {'non_field_errors': ["You have already added this wallet address for this blockchain."]}},
+            status=400
+        )
+    except Exception as e:
+        logger.exception(f"Error processing wallet: {str(e)}")
+        return JsonResponse({'error': f"Failed to process wallet: {str(e)}"}, status=500)
+
+    return JsonResponse(WalletSerializer(wallet).data, status=201 if created else 200)
+
+
+def store_wallet(user, address, chain, balance_value, data, other_wallets):
+    """Upsert and link the wallet, then refresh the address's other tracked chains"""
+    wallet, created = WalletSyncService.add_wallet(user, address, chain, balance_value)
+    WalletSyncService.update_other_chains(address, data, exclude_chain=chain, wallets=other_wallets)
+    return wallet, created
+
+
+@csrf_exempt
+@require_http_methods(['GET'])
+@jwt_required
+async def sync_wallets_view(request):
+    """Synchronize all wallets for the authenticated user (supports ?stream=ndjson|sse)"""
+    stream_format = streaming.stream_format_for(request)
+    if stream_format is False:
+        return JsonResponse({'error': f"Unsupported stream format: {request.GET.get('stream')}"}, status=400)
+
+    try:
+        fresh_cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'WALLET_SYNC_FRESH_SECONDS', 60))
+        stale_wallets = []
+        fresh_wallets = []
+        async for wallet in Wallet.objects.filter(walletuser__user=request.user):
+            if wallet.synced_at and wallet.synced_at >= fresh_cutoff:
+                fresh_wallets.append(wallet)
+            else:
+                stale_wallets.append(wallet)
+
+        if getattr(settings, 'WALLET_SYNC_USE_QUEUE', False):
+            wallets = stale_wallets + fresh_wallets
+            queued = await sync_to_async(SyncQueue.enqueue)(stale_wallets)
+            return JsonResponse({
+                'wallets': [
+                    {
+                        'address': wallet.address,
+                        'chain': wallet.chain,
+                        'balance_usd': format_balance(wallet.balance_usd),
+                        'synced_at': wallet.synced_at
+                    }
+                    for wallet in wallets
+                ],
+                'count': len(wallets),
+                'queued': queued
+            }, status=202)
+
+        # While Moralis is failing, answer with the stored balances instead of waiting on it
+        if stale_wallets and MoralisCircuitBreaker.is_open():
+            if stream_format:
+                return streaming.stream_response(
+                    stream_format, stored_frames(stream_format, fresh_wallets, stale_wallets)
+                )
+            wallets = WalletSyncService.stored_balances(fresh_wallets, stale_wallets)
+            return JsonResponse({'wallets': wallets, 'count': len(wallets), 'stale': True})
+
+        if stream_format:
+            return streaming.stream_response(stream_format, stream_sync(stream_format, fresh_wallets, stale_wallets))
+
+        results = [result async for result in AsyncMoralisService.fetch_net_worths(stale_wallets, allow_stale=True)]
+        updates, failures = WalletSyncService.collect_updates(results)
+        updated_wallets = await sync_to_async(WalletSyncService.save_balances)(updates)
+        for wallet, error in failures:
+            logger.warning(f"Failed to sync wallet {wallet.address} ({wallet.chain}): {error}")
+
+        synced_wallets = [
+            {
+                'address': wallet.address,
+                'chain': wallet.chain,
+                'balance_usd': format_balance(wallet.balance_usd)
+            }
+            for wallet in fresh_wallets + updated_wallets
+        ]
+        return JsonResponse({
+            'wallets': synced_wallets,
+            'count': len(synced_wallets)
+        })
+
+    except Exception as e:
+        logger.exception(f"Error during wallet synchronization: {str(e)}")
+        return JsonResponse({'error': f"Failed to synchronize wallets: {str(e)}"}, status=500)
+
+
+async def stream_sync(stream_format, fresh_wallets, stale_wallets):
+    """Async version of WalletView.stream_sync"""
+    updates = []
+    failures = []
+    try:
+        for wallet in fresh_wallets:
+            yield streaming.wallet_frame(stream_format, wallet, wallet.balance_usd, fresh=True)
+
+        async for result in AsyncMoralisService.fetch_net_worths(stale_wallets, allow_stale=True):
+            wallet_updates, wallet_failures = WalletSyncService.collect_updates([result])
+            # Recorded before the frames go out, so a disconnect while sending them keeps them
+            updates.extend(wallet_updates)
+            failures.extend(wallet_failures)
+            for wallet, balance_value, _ in wallet_updates:
+                yield streaming.wallet_frame(stream_format, wallet, balance_value)
+            for wallet, error in wallet_failures:
+                logger.warning(f"Failed to sync wallet {wallet.address} ({wallet.chain}): {error}")
+                yield streaming.error_frame(stream_format, wallet, error)
+
+        updated_wallets = await sync_to_async(WalletSyncService.save_balances)(updates)
+        # Already stored: a disconnect while the summary goes out has nothing left to save
+        updates = []
+        yield streaming.summary_frame(stream_format, len(fresh_wallets), len(updated_wallets), len(failures))
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client went away mid-stream (the generator is closed, or under ASGI
+        # its task cancelled): keep the balances fetched so far
+        await sync_to_async(WalletSyncService.save_balances)(updates)
+        raise
+    except Exception as e:
+        logger.exception(f"Error during wallet synchronization: {str(e)}")
+        yield streaming.frame(stream_format, 'error', {'error': f"Failed to synchronize wallets: {str(e)}"})
+
+
+async def stored_frames(stream_format, fresh_wallets, stale_wallets):
+    for stored_frame in streaming.stored_frames(stream_format, fresh_wallets, stale_wallets):
+        yield stored_frame
+
+
+@csrf_exempt
+@require_http_methods(['POST', 'DELETE'])
+@jwt_required
+async def remove_wallet_view(request):
+    """Remove a wallet for the authenticated user"""
+    try:
+        data = parse_body(request) or {}
+        address = data.get('address')
+        chain = data.get('chain')
+        if not address or not chain:
+            return JsonResponse(
+                {'error': 'Missing required fields: address and chain must be provided'},
+                status=400
+            )
+        chain = normalize_chain(str(chain))
+        address = normalize_address(str(address), chain)
+
+        link = await WalletUser.objects.select_related('wallet').filter(
+            user=request.user,
+            wallet__address=address,
+            wallet__chain=chain
+        ).afirst()
+        if link is None:
+            return JsonResponse(
+                {'error': f"Wallet with address {address} on chain {chain} not found in your portfolio"},
+                status=404
+            )
+
+        await sync_to_async(unlink_wallet)(request.user.id, link)
+        return JsonResponse({'message': f"Wallet {address} ({chain}) has been removed from your portfolio"})
+
+    except Exception as e:
+        logger.exception(f"Error removing wallet: {str(e)}")
+        return JsonResponse({'error': f"Failed to remove wallet: {str(e)}"}, status=500)
+
+
+def unlink_wallet(user_id, link):
+    """Delete the link and take the wallet out of the portfolio totals in one transaction"""
+    with transaction.atomic():
+        link.delete()
+        PortfolioService.link_removed(user_id, link.wallet)
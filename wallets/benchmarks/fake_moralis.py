@@ -0,0 +1,115 @@
+# wallet/benchmarks/fake_moralis.py
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeMoralisHandler(BaseHTTPRequestHandler):
+    """
+    Answers /wallets/<address>/net-worth like Moralis, after the server's latency
+    A share of requests (the server's error_rate) fail with a 500, and successful
+    bodies are padded up to the server's payload_size in bytes
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) < 3 or parts[-1] != 'net-worth' or parts[-3] != 'wallets':
+            self.respond(404, {'message': 'Not found'})
+            return
+
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self.respond(500, {'message': 'Internal server error'})
+            return
+
+        query = parse_qs(url.query)
+        chains = query.get('chains') or query.get('chains[]') or ['eth']
+        chain_data = [
+            {
+                'chain': chain,
+                'native_balance_formatted': '1.0',
+                'networth_usd': f"{random.uniform(1, 10000):.2f}",
+            }
+            for chain in chains
+        ]
+        body = {
+            'total_networth_usd': f"{sum(float(c['networth_usd']) for c in chain_data):.2f}",
+            'chains': chain_data,
+        }
+        padding = self.server.payload_size - len(json.dumps(body))
+        if padding > 0:
+            # Stands in for the extra fields a real response carries
+            body['padding'] = 'x' * padding
+        self.respond(200, body)
+
+    def respond(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMoralisServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Moralis net worth API, for benchmarks
+    Runs in a background thread; use as a context manager and point
+    MORALIS_BASE_URL at server.base_url
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.2, error_rate=0.0, payload_size=0, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeMoralisHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-moralis', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        return super().__exit__(*exc_info)
+
+
+def _serve(ready, **options):
+    with FakeMoralisServer(**options) as server:
+        ready.put(server.base_url)
+        server._thread.join()
+
+
+def start_in_process(latency=0.2, error_rate=0.0, payload_size=0):
+    """
+    Run a FakeMoralisServer in a child process, so its threads don't compete with
+    the code being measured. Returns tuple (process, base_url); terminate the process when done
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve,
+        args=(ready,),
+        kwargs={'latency': latency, 'error_rate': error_rate, 'payload_size': payload_size},
+        daemon=True
+    )
+    process.start()
+    return process, ready.get(timeout=10)
@@ -0,0 +1,119 @@
+# wallet/benchmarks/harness.py
+import os
+import statistics
+import tempfile
+import threading
+from contextlib import contextmanager
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test.utils import override_settings
+from users.authentication import ClaimsTokenObtainPairSerializer
+from wallets.cache import NetWorthCache
+from wallets.circuit import MoralisCircuitBreaker
+from wallets.http import MoralisHttpClient
+from wallets.models import Wallet, WalletUser
+from wallets.ratelimit import MoralisRateLimiter
+from . import fake_moralis
+
+# Shared setup for the benchmark management commands
+
+@contextmanager
+def benchmark_environment(latency=0.2, error_rate=0.0, payload_size=0, pool_size=10):
+    """
+    Run the block against a throwaway test database and a Moralis stand-in in a
+    child process, with caching, rate limiting and sync freshness switched off
+    so every request reaches the stand-in. Yields the stand-in's base URL
+    """
+    # Threads can't share an in-memory SQLite database, so use a temporary file
+    test_db = None
+    if connection.vendor == 'sqlite':
+        fd, test_db = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = test_db
+        # Production runs on PostgreSQL: queue SQLite writers instead of failing deferred
+        # transactions with "database is locked" when concurrent requests write
+        connection.settings_dict.setdefault('OPTIONS', {}).update({
+            'init_command': 'PRAGMA synchronous=OFF;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 30,
+        })
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    server, base_url = fake_moralis.start_in_process(
+        latency=latency, error_rate=error_rate, payload_size=payload_size
+    )
+
+    try:
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            MORALIS_API_KEY='benchmark',
+            MORALIS_BASE_URL=base_url,
+            MORALIS_CACHE_TTL=0,
+            MORALIS_CACHE_STALE_TTL=0,
+            MORALIS_COMPUTE_UNITS_PER_SECOND=10 ** 9,
+            MORALIS_PER_CHAIN_CONCURRENCY=10 ** 6,
+            MORALIS_POOL_SIZE=pool_size,
+            WALLET_SYNC_FRESH_SECONDS=0,
+            WALLET_SYNC_USE_QUEUE=False,
+        ):
+            MoralisHttpClient.reset()
+            MoralisRateLimiter.reset()
+            MoralisCircuitBreaker.reset()
+            NetWorthCache.clear()
+            yield base_url
+    finally:
+        server.terminate()
+        MoralisHttpClient.reset()
+        MoralisRateLimiter.reset()
+        MoralisCircuitBreaker.reset()
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if test_db and os.path.exists(test_db):
+            os.remove(test_db)
+
+
+def create_users(count, wallets_per_user):
+    """
+    Create users with their own wallets and return an access token for each, issued like
+    the login view's so ClaimsJWTAuthentication takes the claims path without a user query
+    """
+    User = get_user_model()
+    tokens = []
+    for i in range(count):
+        user = User.objects.create_user(username=f"bench{i}", email=f"bench{i}@example.com", password='bench')
+        wallets = Wallet.objects.bulk_create([
+            Wallet(address=f"0x{i:020x}{j:020x}", chain='eth', balance_usd='0')
+            for j in range(wallets_per_user)
+        ])
+        WalletUser.objects.bulk_create([WalletUser(user=user, wallet=wallet) for wallet in wallets])
+        tokens.append(str(ClaimsTokenObtainPairSerializer.get_token(user).access_token))
+    return tokens
+
+
+def percentiles(values, *points):
+    """Return the given percentiles (1-99) of a list of numbers"""
+    if not values:
+        return [None] * len(points)
+    quantiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return [quantiles[point - 1] for point in points]
+
+
+class ThreadSampler:
+    """Records the highest number of live threads while the block runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        def sample():
+            while not self._stop.wait(self.interval):
+                self.peak = max(self.peak, threading.active_count())
+
+        self._thread = threading.Thread(target=sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,306 @@
+# wallet/cache.py
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+class LocalMemoryBackend:
+    """In-process LRU store, fine for a single web process"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, timeout):
+        with self._lock:
+            self._entries[key] = (entry, time.time() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value, timeout):
+        """Set key only if it is missing; returns True if it was set"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > time.time():
+                return False
+            self._entries[key] = (value, time.time() + timeout)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Store backed by a Django cache alias, shared between processes"""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry, timeout):
+        self.cache.set(key, entry, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        # Only our own keys should go, so entries are left to expire
+        pass
+
+
+class NetWorthCache:
+    """
+    TTL cache for Moralis net worth responses, keyed on address and chain set
+    Entries younger than MORALIS_CACHE_TTL are served as-is. For a further
+    MORALIS_CACHE_STALE_TTL seconds, callers passing allow_stale=True get them
+    stale while a single background refresh runs; everyone else fetches again.
+    Every result comes with the time its data was fetched, so a balance stored
+    from it is stamped with the data's age rather than the time it was served
+    """
+
+    BACKENDS = {
+        'local': LocalMemoryBackend,
+        'django': DjangoCacheBackend,
+    }
+    KEY_PREFIX = 'moralis:net-worth'
+
+    _backend = None
+    _refresh_tasks = set()
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'stale': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    @classmethod
+    def get_backend(cls):
+        if cls._backend is None:
+            with cls._lock:
+                if cls._backend is None:
+                    cls._backend = cls._build_backend()
+        return cls._backend
+
+    @classmethod
+    def _build_backend(cls):
+        name = getattr(settings, 'MORALIS_CACHE_BACKEND', 'local')
+        if name == 'django':
+            return DjangoCacheBackend(getattr(settings, 'MORALIS_CACHE_ALIAS', 'default'))
+        if name == 'local':
+            return LocalMemoryBackend(getattr(settings, 'MORALIS_CACHE_MAX_ENTRIES', 10000))
+        # Anything else is a dotted path to a custom backend class
+        return import_string(name)()
+
+    @classmethod
+    def make_key(cls, address, chains=None):
+        """Build a cache key from the normalized address and the sorted chain set"""
+        chain_key = ','.join(sorted({c.lower() for c in chains})) if chains else 'all'
+        return f"{cls.KEY_PREFIX}:{address.strip().lower()}:{chain_key}"
+
+    @classmethod
+    def get_or_fetch(cls, address, chains, fetch, allow_stale=False):
+        """
+        Return the cached (True, data, fetched_at) for this address/chain set, or call fetch()
+        fetch must return tuple (success_bool, data_or_error_message); only successes are cached
+        fetched_at is the time.time() the data came from Moralis, None for failures
+        With allow_stale, an entry past the TTL is returned while it refreshes in the background
+        """
+        ttl = getattr(settings, 'MORALIS_CACHE_TTL', 60)
+        key = cls.make_key(address, chains)
+        if ttl <= 0:
+            return SingleFlight.do(key, lambda: cls._timed(fetch()))
+
+        backend = cls.get_backend()
+        entry = backend.get(key)
+
+        if entry is not None:
+            age = time.time() - entry['fetched_at']
+            if age < ttl:
+                cls._increment('hits')
+                return True, entry['data'], entry['fetched_at']
+
+            if allow_stale:
+                # Past the TTL but still inside the grace window: serve stale and refresh once
+                cls._increment('stale')
+                cls._refresh_in_background(key, fetch)
+                return True, entry['data'], entry['fetched_at']
+
+        cls._increment('misses')
+        # Identical lookups arriving while this one is in flight share its result
+        return SingleFlight.do(
+            key,
+            lambda: cls._fetch_and_store(key, fetch),
+            peek=lambda: cls.peek(key)
+        )
+
+    @classmethod
+    async def aget_or_fetch(cls, address, chains, afetch, allow_stale=False):
+        """
+        Async version of get_or_fetch() for the ASGI views
+        afetch is a coroutine function returning tuple (success_bool, data_or_error_message)
+        """
+        ttl = getattr(settings, 'MORALIS_CACHE_TTL', 60)
+        key = cls.make_key(address, chains)
+        if ttl <= 0:
+            async def timed_fetch():
+                return cls._timed(await afetch())
+
+            return await SingleFlight.ado(key, timed_fetch)
+
+        entry = await cls._call_backend('get', key)
+        if entry is not None:
+            age = time.time() - entry['fetched_at']
+            if age < ttl:
+                cls._increment('hits')
+                return True, entry['data'], entry['fetched_at']
+
+            if allow_stale:
+                cls._increment('stale')
+                if await cls._call_backend('add', f"{key}:refreshing", True, getattr(settings, 'MORALIS_READ_TIMEOUT', 15) * 2):
+                    task = asyncio.get_running_loop().create_task(cls._arefresh(key, afetch))
+                    # The loop only keeps weak references to tasks
+                    cls._refresh_tasks.add(task)
+                    task.add_done_callback(cls._refresh_tasks.discard)
+                return True, entry['data'], entry['fetched_at']
+
+        cls._increment('misses')
+
+        async def fetch_and_store():
+            success, result, fetched_at = cls._timed(await afetch())
+            if success:
+                await cls._call_backend('set', key, cls._entry(result, fetched_at), cls._entry_timeout())
+            return success, result, fetched_at
+
+        return await SingleFlight.ado(key, fetch_and_store)
+
+    @classmethod
+    async def _arefresh(cls, key, afetch):
+        try:
+            success, result = await afetch()
+            if success:
+                await cls._call_backend('set', key, cls._entry(result), cls._entry_timeout())
+                cls._increment('refreshes')
+            else:
+                cls._increment('refresh_errors')
+                logger.warning(f"Background refresh of {key} failed: {result}")
+        except Exception as e:
+            cls._increment('refresh_errors')
+            logger.exception(f"Background refresh of {key} failed: {str(e)}")
+        finally:
+            await cls._call_backend('delete', f"{key}:refreshing")
+
+    @classmethod
+    async def _call_backend(cls, method, *args):
+        """Call a backend method from async code, off the event loop unless it's in-process"""
+        backend = cls.get_backend()
+        if isinstance(backend, LocalMemoryBackend):
+            return getattr(backend, method)(*args)
+        return await sync_to_async(getattr(backend, method), thread_sensitive=False)(*args)
+
+    @classmethod
+    def _fetch_and_store(cls, key, fetch):
+        success, result, fetched_at = cls._timed(fetch())
+        if success:
+            cls.store(key, result, fetched_at)
+        return success, result, fetched_at
+
+    @classmethod
+    def peek(cls, key):
+        """Return (True, data, fetched_at) if a fresh entry exists for key, without touching the counters"""
+        entry = cls.get_backend().get(key)
+        if entry is None or time.time() - entry['fetched_at'] >= getattr(settings, 'MORALIS_CACHE_TTL', 60):
+            return None
+        return True, entry['data'], entry['fetched_at']
+
+    @classmethod
+    def store(cls, key, data, fetched_at=None):
+        cls.get_backend().set(key, cls._entry(data, fetched_at), cls._entry_timeout())
+
+    @staticmethod
+    def _timed(result):
+        """Add the fetch time to a fetch's (success_bool, data_or_error_message)"""
+        success, data = result
+        return success, data, time.time() if success else None
+
+    @staticmethod
+    def _entry(data, fetched_at=None):
+        return {'data': data, 'fetched_at': fetched_at or time.time()}
+
+    @staticmethod
+    def _entry_timeout():
+        """Entries are kept for the TTL plus the stale grace window"""
+        return getattr(settings, 'MORALIS_CACHE_TTL', 60) + getattr(settings, 'MORALIS_CACHE_STALE_TTL', 300)
+
+    @classmethod
+    def _refresh_in_background(cls, key, fetch):
+        """Start a refresh thread unless one is already running for this key"""
+        lock_key = f"{key}:refreshing"
+        backend = cls.get_backend()
+        if not backend.add(lock_key, True, getattr(settings, 'MORALIS_READ_TIMEOUT', 15) * 2):
+            return
+
+        def refresh():
+            try:
+                success, result = fetch()
+                if success:
+                    cls.store(key, result)
+                    cls._increment('refreshes')
+                else:
+                    cls._increment('refresh_errors')
+                    logger.warning(f"Background refresh of {key} failed: {result}")
+            except Exception as e:
+                cls._increment('refresh_errors')
+                logger.exception(f"Background refresh of {key} failed: {str(e)}")
+            finally:
+                backend.delete(lock_key)
+
+        threading.Thread(target=refresh, name='moralis-cache-refresh', daemon=True).start()
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return dict(cls._stats)
+
+    @classmethod
+    def clear(cls):
+        """Drop cached entries (local backend only) and reset the counters"""
+        cls.get_backend().clear()
+        with cls._lock:
+            cls._stats = {key: 0 for key in cls._stats}
+
+    @classmethod
+    def _increment(cls, counter):
+        with cls._lock:
+            cls._stats[counter] += 1
@@ -0,0 +1,221 @@
+# wallet/circuit.py
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+class MoralisUnavailable(Exception):
+    """Raised instead of calling Moralis while the circuit breaker is open"""
+
+
+class MoralisCircuitBreaker:
+    """
+    Process-wide circuit breaker in front of every Moralis call
+    Closed: calls go through and their outcome is recorded over a rolling window of
+    MORALIS_BREAKER_WINDOW seconds. Once the window holds MORALIS_BREAKER_MIN_CALLS calls
+    and either the error rate reaches MORALIS_BREAKER_ERROR_RATE or the share of calls slower
+    than MORALIS_BREAKER_SLOW_CALL_SECONDS reaches MORALIS_BREAKER_SLOW_CALL_RATE, it opens.
+    Open: calls fail at once with MoralisUnavailable for MORALIS_BREAKER_OPEN_SECONDS.
+    Half-open: up to MORALIS_BREAKER_HALF_OPEN_CALLS probe calls go through; if they all
+    succeed the breaker closes, and any failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _state = CLOSED
+    _opened_at = None
+    _calls = deque()
+    _failures = 0
+    _slow = 0
+    _probes_in_flight = 0
+    _probe_successes = 0
+    _lock = threading.Lock()
+    _stats = {'opened': 0, 'rejected': 0}
+
+    @classmethod
+    def allow(cls):
+        """
+        Return True if a call may go out now, reserving a probe slot when half-open
+        A caller that gets True must report the outcome with record(), or call release()
+        if the call was cancelled
+        """
+        with cls._lock:
+            cls._advance(time.monotonic())
+            if cls._state == cls.CLOSED:
+                return True
+            if cls._state == cls.HALF_OPEN and cls._probes_in_flight < cls._setting('HALF_OPEN_CALLS', 3):
+                cls._probes_in_flight += 1
+                return True
+            cls._stats['rejected'] += 1
+            return False
+
+    @classmethod
+    def check(cls):
+        """allow(), raising MoralisUnavailable instead of returning False"""
+        if not cls.allow():
+            cls._raise_unavailable()
+
+    @classmethod
+    def fail_fast(cls):
+        """
+        Raise MoralisUnavailable if the breaker is open, without reserving a probe slot
+        For callers about to spend rate limit budget on a call that check() would refuse
+        """
+        with cls._lock:
+            cls._advance(time.monotonic())
+            if cls._state != cls.OPEN:
+                return
+            cls._stats['rejected'] += 1
+        cls._raise_unavailable()
+
+    @classmethod
+    def record(cls, failed, duration):
+        """Record the outcome of a call that allow() let through"""
+        now = time.monotonic()
+        slow = duration >= cls._setting('SLOW_CALL_SECONDS', 5.0)
+        with cls._lock:
+            if cls._state == cls.HALF_OPEN:
+                cls._probes_in_flight = max(0, cls._probes_in_flight - 1)
+                if failed or slow:
+                    cls._open(now)
+                else:
+                    cls._probe_successes += 1
+                    if cls._probe_successes >= cls._setting('HALF_OPEN_CALLS', 3):
+                        logger.info("Moralis circuit breaker closed after successful probes")
+                        cls._close()
+                return
+            if cls._state == cls.OPEN:
+                # A call that started before the breaker opened
+                return
+
+            cls._calls.append((now, failed, slow))
+            cls._failures += failed
+            cls._slow += slow
+            cls._prune(now)
+            total = len(cls._calls)
+            if total < cls._setting('MIN_CALLS', 10):
+                return
+            if (
+                cls._failures / total >= cls._setting('ERROR_RATE', 0.5)
+                or cls._slow / total >= cls._setting('SLOW_CALL_RATE', 0.5)
+            ):
+                logger.warning(
+                    f"Moralis circuit breaker opened: {cls._failures} failed and "
+                    f"{cls._slow} slow of {total} calls in the last {cls._setting('WINDOW', 30)}s"
+                )
+                cls._open(now)
+
+    @classmethod
+    def release(cls):
+        """
+        Give back a probe slot reserved by allow() without recording an outcome,
+        for calls that were cancelled before Moralis answered
+        """
+        with cls._lock:
+            if cls._state == cls.HALF_OPEN:
+                cls._probes_in_flight = max(0, cls._probes_in_flight - 1)
+
+    @staticmethod
+    def is_failure(status):
+        """Connection errors, timeouts (an exception class name) and 5xx responses count as failures"""
+        return not isinstance(status, int) or status >= 500
+
+    @classmethod
+    def state(cls):
+        with cls._lock:
+            cls._advance(time.monotonic())
+            return cls._state
+
+    @classmethod
+    def is_open(cls):
+        """True while calls are being refused (probes may still go out when half-open)"""
+        return cls.state() == cls.OPEN
+
+    @classmethod
+    def retry_after(cls):
+        """Seconds until the breaker lets probe calls through, 0 unless open"""
+        with cls._lock:
+            if cls._state != cls.OPEN:
+                return 0.0
+            return max(0.0, cls._opened_at + cls._setting('OPEN_SECONDS', 30) - time.monotonic())
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            now = time.monotonic()
+            cls._advance(now)
+            cls._prune(now)
+            return {
+                'state': cls._state,
+                'window_calls': len(cls._calls),
+                'window_failures': cls._failures,
+                'window_slow_calls': cls._slow,
+                **cls._stats,
+            }
+
+    @classmethod
+    def reset(cls):
+        """Close the breaker and forget recorded calls and counters"""
+        with cls._lock:
+            cls._close()
+            cls._stats = {'opened': 0, 'rejected': 0}
+
+    @classmethod
+    def force_open(cls):
+        """Open the breaker now, e.g. during a known Moralis outage"""
+        with cls._lock:
+            cls._open(time.monotonic())
+
+    @classmethod
+    def _advance(cls, now):
+        if cls._state == cls.OPEN and now - cls._opened_at >= cls._setting('OPEN_SECONDS', 30):
+            cls._state = cls.HALF_OPEN
+            cls._probes_in_flight = 0
+            cls._probe_successes = 0
+
+    @classmethod
+    def _prune(cls, now):
+        cutoff = now - cls._setting('WINDOW', 30)
+        while cls._calls and cls._calls[0][0] < cutoff:
+            _, failed, slow = cls._calls.popleft()
+            cls._failures -= failed
+            cls._slow -= slow
+
+    @classmethod
+    def _open(cls, now):
+        cls._state = cls.OPEN
+        cls._opened_at = now
+        cls._stats['opened'] += 1
+
+    @classmethod
+    def _close(cls):
+        cls._state = cls.CLOSED
+        cls._opened_at = None
+        cls._calls = deque()
+        cls._failures = 0
+        cls._slow = 0
+        cls._probes_in_flight = 0
+        cls._probe_successes = 0
+
+    @classmethod
+    def _raise_unavailable(cls):
+        raise MoralisUnavailable(f"Moralis circuit breaker is open, retry in {cls.retry_after():.0f}s")
+
+    @staticmethod
+    def _setting(name, default):
+        return getattr(settings, f"MORALIS_BREAKER_{name}", default)
+
+
+metrics.register(metrics.Gauge(
+    'moralis_circuit_breaker_state', 'Moralis circuit breaker state (1 for the current one)', ['state'],
+    lambda: [
+        ((state,), int(MoralisCircuitBreaker.state() == state))
+        for state in (MoralisCircuitBreaker.CLOSED, MoralisCircuitBreaker.OPEN, MoralisCircuitBreaker.HALF_OPEN)
+    ]
+))
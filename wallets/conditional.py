@@ -0,0 +1,25 @@
+# wallet/conditional.py
+import hashlib
+from django.utils.http import parse_etags
+
+def weak_etag(*parts):
+    """Build a weak ETag from the string form of the given parts"""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request, etag):
+    """Weak If-None-Match comparison, as used for conditional GETs"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or any(candidate.removeprefix('W/') == etag.removeprefix('W/') for candidate in etags)
+
+
+def wallet_list_etag(rows):
+    """
+    ETag of a wallet listing: changes whenever a wallet is linked or unlinked, or any
+    listed balance changes, whether from a sync or a revaluation (which leaves synced_at alone)
+    """
+    return weak_etag(*(f"{row['id']}={row['balance_usd']}" for row in rows))
@@ -0,0 +1,104 @@
+# wallet/history.py
+import logging
+from datetime import timedelta
+from django.db.models import Avg, OuterRef, Subquery
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from .models import Wallet, WalletBalanceSnapshot
+from .portfolio import to_decimal
+
+logger = logging.getLogger(__name__)
+
+class BalanceHistoryService:
+    """Records wallet balance snapshots and serves downsampled portfolio history"""
+
+    INTERVALS = {
+        'hour': timedelta(hours=1),
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+    }
+    RANGES = {
+        '1d': (timedelta(days=1), 'hour'),
+        '7d': (timedelta(days=7), 'hour'),
+        '30d': (timedelta(days=30), 'day'),
+        '90d': (timedelta(days=90), 'day'),
+        '1y': (timedelta(days=365), 'day'),
+        '5y': (timedelta(days=5 * 365), 'week'),
+    }
+    MAX_POINTS = 2000
+
+    @classmethod
+    def record(cls, changes, recorded_at=None):
+        """
+        Insert snapshots for wallets whose balance actually changed, in one batched insert
+        changes is a list of (wallet, old_balance, new_balance) tuples; snapshots are
+        timestamped recorded_at, or each wallet's synced_at when not given
+        """
+        snapshots = []
+        for wallet, old_balance, new_balance in changes:
+            if old_balance is not None and to_decimal(old_balance) == to_decimal(new_balance):
+                continue
+            snapshots.append(WalletBalanceSnapshot(
+                wallet_id=wallet.id,
+                recorded_at=recorded_at or wallet.synced_at or timezone.now(),
+                balance_usd=to_decimal(new_balance),
+            ))
+        if snapshots:
+            WalletBalanceSnapshot.objects.bulk_create(snapshots)
+        return len(snapshots)
+
+    @classmethod
+    def portfolio_history(cls, user_id, start, interval, wallet_filter=None):
+        """
+        Return [(bucket_start, total_usd), ...] for the user's wallets from start until now
+        Each wallet is averaged per bucket in SQL; buckets without a snapshot carry
+        the wallet's previous value forward, since unchanged balances aren't stored
+        """
+        wallets = Wallet.objects.filter(walletuser__user_id=user_id)
+        if wallet_filter:
+            wallets = wallets.filter(**wallet_filter)
+
+        # Balance of every wallet as of the start of the range (one query)
+        before_start = WalletBalanceSnapshot.objects.filter(
+            wallet_id=OuterRef('pk'),
+            recorded_at__lt=start,
+        ).order_by('-recorded_at').values('balance_usd')[:1]
+        current = {
+            row['id']: to_decimal(row['opening_balance']) if row['opening_balance'] is not None else None
+            for row in wallets.annotate(opening_balance=Subquery(before_start)).values('id', 'opening_balance')
+        }
+
+        # Per-wallet average per bucket, downsampled in SQL (one query)
+        rows = (
+            WalletBalanceSnapshot.objects.filter(wallet_id__in=list(current.keys()), recorded_at__gte=start)
+            .annotate(bucket=Trunc('recorded_at', interval))
+            .values('bucket', 'wallet_id')
+            .annotate(balance=Avg('balance_usd'))
+            .order_by('bucket')
+        )
+        by_bucket = {}
+        for row in rows:
+            by_bucket.setdefault(row['bucket'], []).append((row['wallet_id'], to_decimal(row['balance'])))
+
+        points = []
+        bucket = cls.truncate(start, interval)
+        step = cls.INTERVALS[interval]
+        now = timezone.now()
+        while bucket <= now:
+            for wallet_id, balance in by_bucket.get(bucket, []):
+                current[wallet_id] = balance
+            total = sum((balance for balance in current.values() if balance is not None), to_decimal(0))
+            points.append((bucket, total))
+            bucket += step
+        return points
+
+    @staticmethod
+    def truncate(moment, interval):
+        """Truncate a datetime the same way Trunc() does in SQL (weeks start on Monday)"""
+        moment = moment.astimezone(timezone.get_current_timezone())
+        if interval == 'hour':
+            return moment.replace(minute=0, second=0, microsecond=0)
+        moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        if interval == 'week':
+            moment -= timedelta(days=moment.weekday())
+        return moment
@@ -0,0 +1,168 @@
+# wallet/holdings.py
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from .addresses import normalize_address
+from .models import TokenHolding
+from .portfolio import to_decimal
+from .services import MoralisService
+
+logger = logging.getLogger(__name__)
+
+def parse_decimal(value):
+    """Decimal from a Moralis number or numeric string, None if missing or malformed"""
+    if value is None or value == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+class HoldingsService:
+    """Stores per-token wallet balances from Moralis and serves the token breakdown of portfolios"""
+
+    @classmethod
+    def fetch_tokens(cls, wallets, max_workers=None):
+        """
+        Fetch the token balances of every wallet concurrently, with at most
+        max_workers (default settings.MORALIS_MAX_CONCURRENCY) calls in flight
+        Yields tuple (wallet, success_bool, tokens_or_error_message) as each call completes
+        """
+        wallets = list(wallets)
+        if not wallets:
+            return
+
+        max_workers = max_workers or getattr(settings, 'MORALIS_MAX_CONCURRENCY', 8)
+        max_workers = max(1, min(max_workers, len(wallets)))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='moralis-tokens') as executor:
+            futures = {
+                executor.submit(MoralisService.get_wallet_tokens, wallet.address, wallet.chain): wallet
+                for wallet in wallets
+            }
+            for future in as_completed(futures):
+                wallet = futures[future]
+                try:
+                    success, result = future.result()
+                except Exception as e:
+                    logger.exception(f"Unexpected error fetching tokens of wallet {wallet.address}: {str(e)}")
+                    success, result = False, str(e)
+                yield wallet, success, result
+
+    @classmethod
+    def refresh_holdings(cls, wallets, max_workers=None):
+        """
+        Fetch and store the token holdings of the given wallets
+        Returns tuple (stored_holding_count, failures) where failures is a list of (wallet, error_message)
+        """
+        holdings_by_wallet = {}
+        failures = []
+        for wallet, success, result in cls.fetch_tokens(wallets, max_workers):
+            if not success or not isinstance(result, list):
+                failures.append((wallet, str(result)))
+                continue
+            holdings_by_wallet[wallet] = cls.parse_tokens(wallet, result)
+        return cls.replace_holdings(holdings_by_wallet), failures
+
+    @staticmethod
+    def parse_tokens(wallet, tokens):
+        """Turn Moralis token balances into unsaved TokenHolding rows, skipping malformed entries"""
+        holdings = {}
+        for token in tokens:
+            amount = parse_decimal(token.get('balance'))
+            if not token.get('token_address') or amount is None:
+                continue
+            try:
+                decimals = int(token.get('decimals') or 0)
+            except (TypeError, ValueError):
+                continue
+            token_address = normalize_address(token['token_address'], wallet.chain)
+            holdings[token_address] = TokenHolding(
+                wallet=wallet,
+                token_address=token_address,
+                symbol=(token.get('symbol') or '')[:50],
+                amount=amount,
+                decimals=decimals,
+                usd_price=parse_decimal(token.get('usd_price')),
+            )
+        return list(holdings.values())
+
+    @staticmethod
+    def replace_holdings(holdings_by_wallet):
+        """
+        Replace the holdings of many wallets in one transaction: one bulk upsert for
+        every row, then one delete for the tokens the wallets no longer hold
+        holdings_by_wallet maps each wallet to its list of unsaved TokenHolding rows
+        Returns the number of holdings stored
+        """
+        if not holdings_by_wallet:
+            return 0
+
+        updated_at = timezone.now()
+        holdings = []
+        for wallet_holdings in holdings_by_wallet.values():
+            for holding in wallet_holdings:
+                holding.updated_at = updated_at
+                holdings.append(holding)
+        # Lock rows in a stable order so concurrent refreshes can't deadlock
+        holdings.sort(key=lambda holding: (holding.wallet_id, holding.token_address))
+
+        with transaction.atomic(savepoint=False):
+            TokenHolding.objects.bulk_create(
+                holdings,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['wallet', 'token_address'],
+                update_fields=['symbol', 'amount', 'decimals', 'usd_price', 'updated_at'],
+            )
+            # Rows this refresh didn't write are tokens that are gone
+            TokenHolding.objects.filter(
+                wallet_id__in=[wallet.id for wallet in holdings_by_wallet],
+                updated_at__lt=updated_at,
+            ).delete()
+        return len(holdings)
+
+    @staticmethod
+    def portfolio_breakdown(user_id, chain=None):
+        """
+        Return the user's holdings per token across all of their wallets, most valuable first
+        Amounts are summed in SQL with a single query; USD values use each token's stored price.
+        Each entry is a dict with chain, token_address, symbol, amount, usd_price, usd_value
+        (None without a price) and wallet_count
+        """
+        holdings = TokenHolding.objects.filter(wallet__walletuser__user_id=user_id)
+        if chain:
+            holdings = holdings.filter(wallet__chain=chain)
+        rows = (
+            holdings.values('wallet__chain', 'token_address')
+            .annotate(
+                symbol=Max('symbol'),
+                decimals=Max('decimals'),
+                total_amount=Sum('amount'),
+                price=Max('usd_price'),
+                wallet_count=Count('wallet_id'),
+            )
+            .order_by()
+        )
+
+        breakdown = []
+        for row in rows:
+            amount = parse_decimal(row['total_amount']) or Decimal(0)
+            amount = amount.scaleb(-row['decimals'])
+            price = parse_decimal(row['price'])
+            breakdown.append({
+                'chain': row['wallet__chain'],
+                'token_address': row['token_address'],
+                'symbol': row['symbol'],
+                'amount': amount,
+                'usd_price': price,
+                'usd_value': to_decimal(amount * price) if price is not None else None,
+                'wallet_count': row['wallet_count'],
+            })
+        breakdown.sort(key=lambda token: (token['usd_value'] is None, -(token['usd_value'] or 0)))
+        return breakdown
@@ -0,0 +1,191 @@
+# wallet/http.py
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from django.utils import timezone
+import requests
+from requests.adapters import HTTPAdapter
+from backend import metrics
+from .circuit import MoralisCircuitBreaker
+from .ratelimit import MoralisRateLimiter
+
+logger = logging.getLogger(__name__)
+
+class MoralisHttpClient:
+    """
+    Process-wide pooled HTTP client for Moralis
+    Keeps connections alive between calls, applies connect/read timeouts and
+    retries 429 and 5xx responses with jittered exponential backoff
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    _session = None
+    _adapter = None
+    _lock = threading.Lock()
+    _stats = {'requests': 0, 'retries': 0, 'errors': 0}
+
+    @classmethod
+    def get_session(cls):
+        """Return the shared session, creating it on first use"""
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    pool_size = getattr(settings, 'MORALIS_POOL_SIZE', 20)
+                    # Retries are handled here so they can honour Retry-After and be counted
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._adapter = adapter
+                    cls._session = session
+        return cls._session
+
+    @classmethod
+    def reset(cls):
+        """Close the shared session and clear the counters"""
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+            cls._session = None
+            cls._adapter = None
+            cls._stats = {'requests': 0, 'retries': 0, 'errors': 0}
+
+    @classmethod
+    def get(cls, url, endpoint=None, chains=None, **kwargs):
+        """
+        GET a Moralis URL through the pooled session
+        Returns the final response; raises requests.RequestException once retries are used up
+        """
+        return cls.request('GET', url, endpoint=endpoint, chains=chains, **kwargs)
+
+    @classmethod
+    def request(cls, method, url, endpoint=None, chains=None, **kwargs):
+        """
+        Send a request, retrying 429/5xx responses and connection errors
+        When endpoint is given every attempt goes through MoralisRateLimiter,
+        which raises MoralisRateLimitError if no budget is available in time.
+        Raises MoralisUnavailable while MoralisCircuitBreaker is open
+        """
+        session = cls.get_session()
+        kwargs.setdefault('timeout', (
+            getattr(settings, 'MORALIS_CONNECT_TIMEOUT', 3.05),
+            getattr(settings, 'MORALIS_READ_TIMEOUT', 15),
+        ))
+        max_retries = getattr(settings, 'MORALIS_MAX_RETRIES', 3)
+
+        attempt = 0
+        while True:
+            MoralisCircuitBreaker.fail_fast()
+            cls.increment('requests')
+            try:
+                if endpoint:
+                    with MoralisRateLimiter.limit(endpoint, chains):
+                        response = cls._send(session, method, url, endpoint, chains, **kwargs)
+                else:
+                    response = cls._send(session, method, url, endpoint, chains, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries:
+                    cls.increment('errors')
+                    raise
+                delay = cls.backoff_delay(attempt)
+                logger.warning(
+                    f"Moralis request failed ({e.__class__.__name__}), "
+                    f"retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+                )
+            else:
+                if response.status_code not in cls.RETRY_STATUS_CODES or attempt >= max_retries:
+                    cls._log_pool_usage()
+                    return response
+                delay = cls.retry_after_delay(response)
+                if delay is None:
+                    delay = cls.backoff_delay(attempt)
+                logger.warning(
+                    f"Moralis returned {response.status_code}, "
+                    f"retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+                )
+                response.close()
+
+            cls.increment('retries')
+            attempt += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def _send(session, method, url, endpoint, chains, **kwargs):
+        """Send one attempt and record its latency and outcome for /metrics and the circuit breaker"""
+        MoralisCircuitBreaker.check()
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            status = e.__class__.__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            metrics.observe_moralis_call(endpoint, chains, status, duration)
+            MoralisCircuitBreaker.record(MoralisCircuitBreaker.is_failure(status), duration)
+
+    @classmethod
+    def stats(cls):
+        """
+        Return request/retry counters and connection pool usage
+        A connections count well below the requests count means keep-alive is being reused
+        """
+        with cls._lock:
+            stats = dict(cls._stats)
+        connections = 0
+        pooled_requests = 0
+        if cls._adapter is not None:
+            for pool_key in list(cls._adapter.poolmanager.pools.keys()):
+                pool = cls._adapter.poolmanager.pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+        stats['connections_opened'] = connections
+        stats['pooled_requests'] = pooled_requests
+        return stats
+
+    @classmethod
+    def increment(cls, counter):
+        """Bump a counter; also used by the async client so both show up in stats()"""
+        with cls._lock:
+            cls._stats[counter] += 1
+
+    @staticmethod
+    def backoff_delay(attempt):
+        """Full-jitter exponential backoff, capped at MORALIS_RETRY_MAX_DELAY"""
+        base = getattr(settings, 'MORALIS_RETRY_BACKOFF', 0.5)
+        cap = getattr(settings, 'MORALIS_RETRY_MAX_DELAY', 10)
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    @staticmethod
+    def retry_after_delay(response):
+        """Parse a Retry-After header (seconds or HTTP date), capped at MORALIS_RETRY_MAX_DELAY"""
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+
+        cap = getattr(settings, 'MORALIS_RETRY_MAX_DELAY', 10)
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - timezone.now()).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(cap, max(0.0, delay))
+
+    @classmethod
+    def _log_pool_usage(cls):
+        if logger.isEnabledFor(logging.DEBUG):
+            stats = cls.stats()
+            logger.debug(
+                f"Moralis pool: {stats['connections_opened']} connections opened for "
+                f"{stats['pooled_requests']} requests, {stats['retries']} retries"
+            )
@@ -0,0 +1,170 @@
+# wallet/imports.py
+import csv
+import io
+import logging
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from .history import BalanceHistoryService
+from .models import Wallet, WalletUser
+from .portfolio import PortfolioService, to_decimal
+from .serializers import WalletAddressSerializer
+from .services import WalletSyncService
+
+logger = logging.getLogger(__name__)
+
+def rows_from_csv(text):
+    """
+    Read (address, chain) rows from CSV text
+    A header row naming the columns is optional; without one the first two columns are used
+    """
+    reader = csv.reader(io.StringIO(text.lstrip('\ufeff')))
+    rows = [row for row in reader if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    if 'address' in header and 'chain' in header:
+        address_index, chain_index = header.index('address'), header.index('chain')
+        rows = rows[1:]
+    else:
+        address_index, chain_index = 0, 1
+    return [
+        {
+            'address': row[address_index] if len(row) > address_index else '',
+            'chain': row[chain_index] if len(row) > chain_index else '',
+        }
+        for row in rows
+    ]
+
+
+class CSVParser(BaseParser):
+    """Parses a text/csv request body into a list of {address, chain} rows"""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        try:
+            return rows_from_csv(stream.read().decode(encoding))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ParseError(f"CSV parse error - {str(e)}")
+
+
+class WalletImportService:
+    """
+    Adds many wallets to a user's portfolio at once
+    Rows are validated and deduplicated up front, balances are fetched concurrently
+    (one Moralis call per address) and every write is batched, so the number of
+    queries doesn't grow with the number of rows
+    """
+
+    @classmethod
+    def import_wallets(cls, user, rows):
+        """
+        Import (address, chain) rows for the user
+        Returns a list with one result per input row, in input order, each with a
+        status of created, linked, exists, duplicate, invalid or error
+        """
+        results = [None] * len(rows)
+        pairs = {}
+        for index, row in enumerate(rows):
+            serializer = WalletAddressSerializer(data=row if isinstance(row, dict) else {})
+            if not serializer.is_valid():
+                results[index] = cls._result(row, 'invalid', errors=serializer.errors)
+                continue
+            pair = (serializer.validated_data['address'], serializer.validated_data['chain'])
+            if pair in pairs:
+                results[index] = cls._result(row, 'duplicate')
+                continue
+            pairs[pair] = index
+
+        if not pairs:
+            return results
+
+        # One query for the wallets that already exist, and whether this user follows them
+        existing = {}
+        linked = set()
+        candidates = Wallet.objects.filter(address__in={address for address, _ in pairs}).annotate(
+            linked=Exists(WalletUser.objects.filter(wallet=OuterRef('pk'), user=user))
+        )
+        for wallet in candidates:
+            pair = (wallet.address, wallet.chain)
+            if pair not in pairs:
+                continue
+            existing[pair] = wallet
+            if wallet.linked:
+                linked.add(pair)
+
+        to_fetch = []
+        for pair, index in pairs.items():
+            if pair in linked:
+                results[index] = cls._result({'address': pair[0], 'chain': pair[1]}, 'exists')
+            else:
+                to_fetch.append(existing.get(pair) or Wallet(address=pair[0], chain=pair[1]))
+
+        # Concurrent Moralis calls, grouped so each address costs one call
+        updates, failures = WalletSyncService.collect_updates(WalletSyncService.fetch_net_worths(to_fetch))
+        for wallet, error in failures:
+            results[pairs[(wallet.address, wallet.chain)]] = cls._result(
+                {'address': wallet.address, 'chain': wallet.chain}, 'error', error=error
+            )
+
+        new_wallets = [update for update in updates if update[0].pk is None]
+        existing_updates = [update for update in updates if update[0].pk is not None]
+
+        with transaction.atomic():
+            created = cls._create_wallets(new_wallets)
+            updated = WalletSyncService.save_balances(existing_updates)
+
+            wallets = created + updated
+            WalletUser.objects.bulk_create(
+                [WalletUser(user=user, wallet=wallet) for wallet in wallets],
+                ignore_conflicts=True
+            )
+            PortfolioService.links_added(user.id, wallets)
+
+        created_pairs = {(wallet.address, wallet.chain) for wallet in created}
+        for wallet in wallets:
+            pair = (wallet.address, wallet.chain)
+            results[pairs[pair]] = cls._result(
+                {'address': wallet.address, 'chain': wallet.chain},
+                'created' if pair in created_pairs else 'linked',
+                balance_usd=str(to_decimal(wallet.balance_usd))
+            )
+        return results
+
+    @staticmethod
+    def _create_wallets(new_wallets):
+        """
+        Insert new wallets with one bulk_create and read back their ids with one query
+        Wallets created concurrently by someone else are picked up as they are
+        """
+        if not new_wallets:
+            return []
+
+        synced_at = timezone.now()
+        Wallet.objects.bulk_create(
+            [
+                Wallet(address=wallet.address, chain=wallet.chain, balance_usd=balance, synced_at=synced_at)
+                for wallet, balance, _ in new_wallets
+            ],
+            ignore_conflicts=True
+        )
+        requested = {(wallet.address, wallet.chain) for wallet, _, _ in new_wallets}
+        created = [
+            wallet for wallet in Wallet.objects.filter(address__in={address for address, _ in requested})
+            if (wallet.address, wallet.chain) in requested
+        ]
+        BalanceHistoryService.record([(wallet, None, wallet.balance_usd) for wallet in created])
+        return created
+
+    @staticmethod
+    def _result(row, status, **extra):
+        return {
+            'address': row.get('address') if isinstance(row, dict) else None,
+            'chain': row.get('chain') if isinstance(row, dict) else None,
+            'status': status,
+            **extra,
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from wallets.async_client import AsyncMoralisService
+from wallets.benchmarks.harness import ThreadSampler, benchmark_environment, create_users, percentiles
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync (WSGI) and async (ASGI) wallet sync endpoints under concurrent load '
+        'against a local Moralis stand-in. Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--latency', type=float, default=0.2, help='Moralis stand-in latency in seconds')
+        parser.add_argument('--wallets', type=int, default=3, help='Wallets (distinct addresses) per user')
+
+    def handle(self, *args, **options):
+        with benchmark_environment(
+            latency=options['latency'],
+            pool_size=options['concurrency'] * options['wallets']
+        ):
+            tokens = create_users(options['concurrency'], options['wallets'])
+            sync_result = self.run_sync(tokens, options['requests'], options['concurrency'])
+            async_result = asyncio.run(self.run_async(tokens, options['requests'], options['concurrency']))
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}, "
+            f"{options['wallets']} wallets per user, Moralis latency {options['latency'] * 1000:.0f}ms"
+        )
+        self.report('sync (WSGI)', sync_result)
+        self.report('async (ASGI)', async_result)
+
+    def run_sync(self, tokens, total, concurrency):
+        """Drive /api/wallets/sync/ through the WSGI handler from a thread per concurrent request"""
+        def call(i):
+            started = time.perf_counter()
+            response = Client().get('/api/wallets/sync/', HTTP_AUTHORIZATION=f"Bearer {tokens[i % len(tokens)]}")
+            connections.close_all()
+            return time.perf_counter() - started, response.status_code
+
+        with ThreadSampler() as sampler:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(call, range(total)))
+            elapsed = time.perf_counter() - started
+        return results, elapsed, sampler.peak
+
+    async def run_async(self, tokens, total, concurrency):
+        """Drive /api/wallets/async/sync/ through the ASGI handler on a single event loop"""
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(i):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(
+                    '/api/wallets/async/sync/', headers={'Authorization': f"Bearer {tokens[i % len(tokens)]}"}
+                )
+                return time.perf_counter() - started, response.status_code
+
+        with ThreadSampler() as sampler:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(call(i) for i in range(total)))
+            elapsed = time.perf_counter() - started
+        await AsyncMoralisService.close()
+        return results, elapsed, sampler.peak
+
+    def report(self, label, result):
+        results, elapsed, peak_threads = result
+        p50, p95 = percentiles([latency for latency, _ in results], 50, 95)
+        errors = sum(1 for _, status_code in results if status_code != 200)
+        self.stdout.write(
+            f"{label:>13}: {len(results) / elapsed:7.1f} req/s  "
+            f"p50 {p50 * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  "
+            f"errors {errors}  peak threads {peak_threads}"
+        )
+
@@ -0,0 +1,172 @@
+import json
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from wallets.benchmarks.harness import benchmark_environment, create_users, percentiles
+
+# Endpoint scenarios, run in this order: remove takes back the wallets add created
+SCENARIOS = ['add', 'list', 'sync', 'remove']
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the add, list, sync and remove wallet endpoints under concurrent load against '
+        'a local Moralis stand-in, and write latency, throughput and queries per request to JSON. '
+        'Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+        parser.add_argument('--wallets', type=int, default=3, help='Wallets each user starts with')
+        parser.add_argument('--latency', type=float, default=0.05, help='Moralis stand-in latency in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of Moralis calls that fail (0-1)')
+        parser.add_argument('--payload-size', type=int, default=0, help='Moralis response size in bytes')
+        parser.add_argument(
+            '--endpoints', default=','.join(SCENARIOS),
+            help=f"Comma-separated endpoints to run, from {', '.join(SCENARIOS)}"
+        )
+        parser.add_argument('--output', help='Results file (default benchmark-<commit>.json)')
+        parser.add_argument('--baseline', help='Results file from an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError('--error-rate must be between 0 and 1')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        commit = self.git_commit()
+        config = {
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'wallets_per_user': options['wallets'],
+            'moralis_latency': options['latency'],
+            'moralis_error_rate': options['error_rate'],
+            'moralis_payload_size': options['payload_size'],
+        }
+        results = {
+            'commit': commit,
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'config': config,
+            'endpoints': {},
+        }
+
+        with benchmark_environment(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            payload_size=options['payload_size'],
+            pool_size=options['concurrency'] * max(options['wallets'], 1)
+        ):
+            tokens = create_users(options['concurrency'], options['wallets'])
+            for name in SCENARIOS:
+                if name in endpoints:
+                    results['endpoints'][name] = self.run(name, tokens, options['requests'], options['concurrency'])
+
+        output = options['output'] or f"benchmark-{commit[:12] if commit else 'local'}.json"
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(
+            f"{options['requests']} requests per endpoint, concurrency {options['concurrency']}, "
+            f"Moralis latency {options['latency'] * 1000:.0f}ms, error rate {options['error_rate']:.0%}"
+        )
+        for name, stats in results['endpoints'].items():
+            self.report(name, stats, (baseline or {}).get('endpoints', {}).get(name))
+        self.stdout.write(f"Results written to {output}")
+
+    def run(self, name, tokens, total, concurrency):
+        """Send `total` requests to one endpoint from `concurrency` threads and summarize them"""
+        def call(i):
+            token = tokens[i % len(tokens)]
+            queries = []
+            # Each thread has its own connection, so the wrapper only sees this request's queries
+            with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                started = time.perf_counter()
+                response = self.request(Client(), name, i, token)
+                latency = time.perf_counter() - started
+            connections.close_all()
+            return latency, response.status_code, len(queries)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(call, range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency * 1000 for latency, _, _ in samples]
+        query_counts = [count for _, _, count in samples]
+        p50, p95, p99 = percentiles(latencies, 50, 95, 99)
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, status_code, _ in samples if status_code >= 400),
+            'status_codes': dict(sorted(Counter(str(status_code) for _, status_code, _ in samples).items())),
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'p50': round(p50, 2),
+                'p95': round(p95, 2),
+                'p99': round(p99, 2),
+                'max': round(max(latencies), 2),
+            },
+            'queries_per_request': {
+                'mean': round(sum(query_counts) / len(query_counts), 2),
+                'max': max(query_counts),
+            },
+        }
+
+    def request(self, client, name, i, token):
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {token}"}
+        if name == 'add':
+            return client.post('/api/wallets/add/', self.new_wallet(i), content_type='application/json', **auth)
+        if name == 'list':
+            return client.get('/api/wallets/add/', **auth)
+        if name == 'sync':
+            return client.get('/api/wallets/sync/', **auth)
+        return client.post('/api/wallets/remove/', self.new_wallet(i), content_type='application/json', **auth)
+
+    @staticmethod
+    def new_wallet(i):
+        """The wallet request i adds (and later removes), distinct from the users' starting wallets"""
+        return {'address': f"0x{'f' * 8}{i:032x}", 'chain': 'eth'}
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip() or None
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def report(self, name, stats, baseline=None):
+        latency = stats['latency_ms']
+        line = (
+            f"{name:>6}: {stats['throughput_rps']:7.1f} req/s  p50 {latency['p50']:7.1f}ms  "
+            f"p95 {latency['p95']:7.1f}ms  p99 {latency['p99']:7.1f}ms  "
+            f"queries {stats['queries_per_request']['mean']:5.1f}  errors {stats['errors']}"
+        )
+        if baseline:
+            line += (
+                f"  (vs baseline: req/s {self.change(baseline['throughput_rps'], stats['throughput_rps'])}, "
+                f"p95 {self.change(baseline['latency_ms']['p95'], latency['p95'])}, "
+                f"queries {self.change(baseline['queries_per_request']['mean'], stats['queries_per_request']['mean'])})"
+            )
+        self.stdout.write(line)
+
+    @staticmethod
+    def change(before, after):
+        if not before:
+            return 'n/a'
+        return f"{(after - before) / before:+.0%}"
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from wallets.portfolio import PortfolioService
+
+class Command(BaseCommand):
+    help = 'Recompute portfolio summaries from wallet balances, to recover from drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids',
+                            help='Only rebuild these users (repeatable); default is every user')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = get_user_model().objects.order_by('id').values_list('id', flat=True).iterator()
+
+        batch_size = options['batch_size']
+        batch = []
+        rebuilt = 0
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                rebuilt += len(PortfolioService.rebuild(batch))
+                batch = []
+        if batch:
+            rebuilt += len(PortfolioService.rebuild(batch))
+
+        self.stdout.write(f"Rebuilt {rebuilt} portfolio summaries")
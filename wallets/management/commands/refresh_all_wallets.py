@@ -0,0 +1,82 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from wallets.queue import SyncQueue
+from wallets.scheduler import RefreshScheduler
+from wallets.services import WalletSyncService
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Refresh every followed wallet that is stale, once for all of its followers, '
+        'most followed and stalest first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Refresh wallets not synced for this many seconds '
+                                 '(default settings.WALLET_SYNC_FRESH_SECONDS)')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Wallets read from the cursor and refreshed together')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many wallets')
+
+    def handle(self, *args, **options):
+        stale_after = options['stale_after']
+        if stale_after is None:
+            stale_after = getattr(settings, 'WALLET_SYNC_FRESH_SECONDS', 60)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        batch_size = max(1, options['batch_size'])
+        use_queue = getattr(settings, 'WALLET_SYNC_USE_QUEUE', False)
+
+        per_user_calls = None if use_queue or options['limit'] else RefreshScheduler.per_user_call_count(cutoff)
+        started = time.monotonic()
+        totals = {'wallets': 0, 'updated': 0, 'failed': 0, 'calls': 0}
+
+        batch = []
+        # iterator() streams rows (a server-side cursor on PostgreSQL), so memory stays flat
+        for wallet in RefreshScheduler.stale_wallets_by_priority(cutoff).iterator(chunk_size=batch_size):
+            batch.append(wallet)
+            if len(batch) >= batch_size:
+                self.refresh_batch(batch, use_queue, totals)
+                batch = []
+            if options['limit'] and totals['wallets'] + len(batch) >= options['limit']:
+                break
+        if batch:
+            self.refresh_batch(batch, use_queue, totals)
+
+        elapsed = time.monotonic() - started
+        rate = totals['wallets'] / elapsed if elapsed else 0.0
+        if use_queue:
+            self.stdout.write(f"Queued {totals['wallets']} wallets in {elapsed:.1f}s ({rate:.1f} wallets/s)")
+            return
+
+        self.stdout.write(
+            f"Refreshed {totals['wallets']} wallets in {elapsed:.1f}s ({rate:.1f} wallets/s): "
+            f"{totals['updated']} updated, {totals['failed']} failed"
+        )
+        if options['limit']:
+            # A partial pass isn't comparable with syncing every follower's wallets
+            self.stdout.write(f"Moralis calls: {totals['calls']}")
+        else:
+            self.stdout.write(
+                f"Moralis calls: {totals['calls']}, against {per_user_calls} through per-user syncs "
+                f"({max(0, per_user_calls - totals['calls'])} saved)"
+            )
+
+    def refresh_batch(self, wallets, use_queue, totals):
+        """Refresh (or queue) one batch; wallets sharing an address cost one call"""
+        totals['wallets'] += len(wallets)
+        if use_queue:
+            SyncQueue.enqueue(wallets)
+            return
+
+        totals['calls'] += len({wallet.address for wallet in wallets})
+        updated, failures = WalletSyncService.refresh_wallets(wallets)
+        totals['updated'] += len(updated)
+        totals['failed'] += len(failures)
+        for wallet, error in failures:
+            logger.warning(f"Failed to refresh wallet {wallet.address} ({wallet.chain}): {error}")
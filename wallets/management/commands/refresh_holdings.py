@@ -0,0 +1,63 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from wallets.holdings import HoldingsService
+from wallets.models import TokenHolding, Wallet, WalletUser
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Refresh the per-token holdings of every followed wallet whose holdings are stale.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Refresh holdings not refreshed for this many seconds '
+                                 '(default settings.WALLET_HOLDINGS_FRESH_SECONDS)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Wallets fetched together and stored in one transaction')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many wallets')
+
+    def handle(self, *args, **options):
+        stale_after = options['stale_after']
+        if stale_after is None:
+            stale_after = getattr(settings, 'WALLET_HOLDINGS_FRESH_SECONDS', 3600)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        batch_size = max(1, options['batch_size'])
+
+        # Wallets with no token left have no rows either, so they are retried every pass
+        wallets = (
+            Wallet.objects.filter(Exists(WalletUser.objects.filter(wallet_id=OuterRef('pk'))))
+            .exclude(Exists(TokenHolding.objects.filter(wallet_id=OuterRef('pk'), updated_at__gte=cutoff)))
+            .order_by('id')
+        )
+        if options['limit']:
+            wallets = wallets[:options['limit']]
+
+        started = time.monotonic()
+        totals = {'wallets': 0, 'holdings': 0, 'failed': 0}
+        batch = []
+        for wallet in wallets.iterator(chunk_size=batch_size):
+            batch.append(wallet)
+            if len(batch) >= batch_size:
+                self.refresh_batch(batch, totals)
+                batch = []
+        if batch:
+            self.refresh_batch(batch, totals)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Refreshed holdings of {totals['wallets']} wallets in {elapsed:.1f}s: "
+            f"{totals['holdings']} holdings stored, {totals['failed']} wallets failed"
+        )
+
+    def refresh_batch(self, wallets, totals):
+        stored, failures = HoldingsService.refresh_holdings(wallets)
+        totals['wallets'] += len(wallets)
+        totals['holdings'] += stored
+        totals['failed'] += len(failures)
+        for wallet, error in failures:
+            logger.warning(f"Failed to refresh holdings of wallet {wallet.address} ({wallet.chain}): {error}")
@@ -0,0 +1,48 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from wallets.queue import SyncQueue
+from wallets.scheduler import RefreshScheduler
+from wallets.services import WalletSyncService
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Refresh wallets whose synced_at is older than their tier interval, within a Moralis call budget.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls-per-minute', type=int, default=None,
+                            help='Moralis call budget (default settings.WALLET_REFRESH_CALLS_PER_MINUTE)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, one refresh cycle per minute')
+
+    def handle(self, *args, **options):
+        budget = options['calls_per_minute'] or getattr(settings, 'WALLET_REFRESH_CALLS_PER_MINUTE', 60)
+
+        try:
+            while True:
+                started = time.monotonic()
+                self.run_cycle(budget)
+                if not options['loop']:
+                    break
+                time.sleep(max(0.0, 60 - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Refresh scheduler stopped')
+
+    def run_cycle(self, budget):
+        """Refresh (or queue, when the job queue is enabled) one budget's worth of due wallets"""
+        wallets = RefreshScheduler.select_due(budget)
+        if not wallets:
+            self.stdout.write('No wallets due for refresh')
+            return
+
+        if getattr(settings, 'WALLET_SYNC_USE_QUEUE', False):
+            SyncQueue.enqueue(wallets)
+            self.stdout.write(f"Queued {len(wallets)} due wallets")
+            return
+
+        updated, failures = WalletSyncService.refresh_wallets(wallets)
+        for wallet, error in failures:
+            logger.warning(f"Failed to refresh wallet {wallet.address} ({wallet.chain}): {error}")
+        self.stdout.write(f"Refreshed {len(updated)} of {len(wallets)} due wallets, {len(failures)} failed")
@@ -0,0 +1,47 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from wallets.prices import PriceService
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the cached prices of every held token that is stale, in batched Moralis calls, '
+        'then revalue wallets from their stored holdings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Refresh prices older than this many seconds '
+                                 '(default settings.TOKEN_PRICE_FRESH_SECONDS)')
+        parser.add_argument('--no-revalue', action='store_true',
+                            help='Only refresh prices, leave wallet balances alone')
+
+    def handle(self, *args, **options):
+        stale_after = options['stale_after']
+        if stale_after is None:
+            stale_after = getattr(settings, 'TOKEN_PRICE_FRESH_SECONDS', 300)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+
+        started = time.monotonic()
+        tokens = list(PriceService.stale_tokens(cutoff))
+        stored, calls, failures = PriceService.refresh_prices(tokens)
+        for chain, error in failures:
+            logger.warning(f"Failed to refresh token prices on {chain}: {error}")
+        self.stdout.write(
+            f"Refreshed {stored} of {len(tokens)} token prices with {calls} Moralis calls "
+            f"({len(failures)} failed) in {time.monotonic() - started:.1f}s"
+        )
+        if options['no_revalue']:
+            return
+
+        started = time.monotonic()
+        valued, updated = PriceService.revalue_wallets()
+        self.stdout.write(
+            f"Revalued {valued} wallets from stored holdings in {time.monotonic() - started:.1f}s: "
+            f"{updated} balances changed, no per-wallet Moralis calls"
+        )
@@ -0,0 +1,39 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from wallets.queue import SyncQueue
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Process queued wallet sync jobs. Run as many workers as needed, on any number of nodes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Jobs claimed per batch (default settings.SYNC_JOB_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        poll_interval = options['poll_interval']
+        self.stdout.write('Sync worker started')
+
+        try:
+            while True:
+                released = SyncQueue.release_stale()
+                if released:
+                    logger.warning(f"Released {released} stale sync jobs back to the queue")
+
+                succeeded, failed = SyncQueue.process_batch(batch_size)
+                if succeeded or failed:
+                    self.stdout.write(f"Processed batch: {succeeded} synced, {failed} failed")
+                    continue
+
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write('Sync worker stopped')
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0003_portfoliosummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('balance_usd', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('wallet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='wallets.wallet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['wallet', 'recorded_at', 'balance_usd'], name='snapshot_wallet_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,95 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+
+# Frozen copy of wallets.addresses.EVM_CHAINS as of this migration
+EVM_CHAINS = {'eth', 'bsc', 'polygon', 'avalanche', 'fantom', 'arbitrum', 'optimism'}
+
+def canonical(address, chain):
+    chain = chain.strip().lower()
+    address = address.strip()
+    return (address.lower() if chain in EVM_CHAINS else address), chain
+
+
+def merge_duplicate_wallets(apps, schema_editor):
+    """
+    Store every wallet in canonical form, merging rows that only differ in case or whitespace
+    The most recently synced row of each group is kept; links and history of the others
+    move to it, and the summaries of the users involved are recomputed
+    """
+    Wallet = apps.get_model('wallets', 'Wallet')
+    WalletUser = apps.get_model('wallets', 'WalletUser')
+    WalletBalanceSnapshot = apps.get_model('wallets', 'WalletBalanceSnapshot')
+    PortfolioSummary = apps.get_model('wallets', 'PortfolioSummary')
+    SyncJob = apps.get_model('wallets', 'SyncJob')
+
+    groups = defaultdict(list)
+    for wallet in Wallet.objects.order_by('id').iterator():
+        groups[canonical(wallet.address, wallet.chain)].append(wallet)
+
+    affected_users = set()
+    for (address, chain), wallets in groups.items():
+        keeper = max(wallets, key=lambda wallet: (wallet.synced_at, wallet.id))
+        duplicates = [wallet.id for wallet in wallets if wallet.id != keeper.id]
+        if duplicates:
+            followers = set(WalletUser.objects.filter(wallet_id=keeper.id).values_list('user_id', flat=True))
+            for link in WalletUser.objects.filter(wallet_id__in=duplicates).order_by('id'):
+                affected_users.add(link.user_id)
+                if link.user_id in followers:
+                    link.delete()
+                else:
+                    followers.add(link.user_id)
+                    WalletUser.objects.filter(id=link.id).update(wallet_id=keeper.id)
+            WalletBalanceSnapshot.objects.filter(wallet_id__in=duplicates).update(wallet_id=keeper.id)
+            Wallet.objects.filter(id__in=duplicates).delete()
+        if (keeper.address, keeper.chain) != (address, chain):
+            # update() rather than save(), which would bump the auto_now synced_at
+            Wallet.objects.filter(id=keeper.id).update(address=address, chain=chain)
+
+    # One active job per canonical wallet, like the unique_active_sync_job constraint
+    active = set()
+    renames = []
+    extra_jobs = []
+    for job in SyncJob.objects.order_by('id').iterator():
+        address, chain = canonical(job.address, job.chain)
+        if job.status in ('pending', 'running'):
+            if (address, chain) in active:
+                extra_jobs.append(job.id)
+                continue
+            active.add((address, chain))
+        if (job.address, job.chain) != (address, chain):
+            renames.append((job.id, address, chain))
+    SyncJob.objects.filter(id__in=extra_jobs).delete()
+    for job_id, address, chain in renames:
+        SyncJob.objects.filter(id=job_id).update(address=address, chain=chain)
+
+    # Same totals as PortfolioService.rebuild, for existing summaries
+    totals = defaultdict(lambda: {'total_usd': Decimal('0'), 'chain_totals': {}, 'wallet_count': 0, 'last_synced_at': None})
+    rows = (
+        WalletUser.objects.filter(user_id__in=affected_users)
+        .values('user_id', 'wallet__chain')
+        .annotate(total=Sum('wallet__balance_usd'), wallets=Count('id'), last_synced_at=Max('wallet__synced_at'))
+    )
+    for row in rows:
+        summary = totals[row['user_id']]
+        amount = Decimal(row['total'] or 0).quantize(Decimal('0.01'))
+        summary['total_usd'] += amount
+        summary['chain_totals'][row['wallet__chain']] = str(amount)
+        summary['wallet_count'] += row['wallets']
+        if row['last_synced_at'] and (summary['last_synced_at'] is None or row['last_synced_at'] > summary['last_synced_at']):
+            summary['last_synced_at'] = row['last_synced_at']
+    for user_id in affected_users:
+        PortfolioSummary.objects.filter(user_id=user_id).update(**totals[user_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0005_requestprofile'),
+    ]
+
+    operations = [
+        # Merging can't be undone; reversing leaves the canonical rows in place
+        migrations.RunPython(merge_duplicate_wallets, migrations.RunPython.noop),
+    ]
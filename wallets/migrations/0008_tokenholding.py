@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0007_wallet_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenHolding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_address', models.CharField(max_length=255)),
+                ('symbol', models.CharField(blank=True, max_length=50)),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=78)),
+                ('decimals', models.PositiveSmallIntegerField(default=18)),
+                ('usd_price', models.DecimalField(blank=True, decimal_places=10, max_digits=30, null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('wallet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to='wallets.wallet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'token_address'), name='unique_wallet_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0008_tokenholding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chain', models.CharField(max_length=50)),
+                ('token_address', models.CharField(max_length=255)),
+                ('usd_price', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tokenholding',
+            index=models.Index(fields=['token_address'], name='holding_token_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tokenprice',
+            constraint=models.UniqueConstraint(fields=('chain', 'token_address'), name='unique_chain_token'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class Wallet(models.Model):
     """
@@ -11,8 +12,13 @@ class Wallet(models.Model):
     synced_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        # Ensure each wallet address is unique per chain
+        # Ensure each wallet address is unique per chain (addresses are stored in
+        # the canonical form from wallets.addresses, so this also catches case variants)
         unique_together = ('address', 'chain')
+        indexes = [
+            # Per-chain scans by staleness; lookups by address use the unique index
+            models.Index(fields=['chain', 'synced_at'], name='wallet_chain_synced_idx'),
+        ]
     
     def __str__(self):
         return f"{self.address} ({self.chain})"
@@ -21,9 +27,157 @@ class WalletUser(models.Model):
     """
     Simple association between users and wallets
     """
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # The (user, wallet) unique index leads with user and covers the user joins,
+    # so user doesn't need its own index; wallet keeps one for follower lookups
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE)
     
     class Meta:
         # Each user can have a wallet address only once
         unique_together = ('user', 'wallet')
+
+class WalletBalanceSnapshot(models.Model):
+    """
+    Point-in-time wallet balance, recorded only when the balance changes
+    """
+    # The composite index below leads with wallet, so the FK doesn't need its own
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='snapshots', db_index=False)
+    recorded_at = models.DateTimeField(default=timezone.now)
+    balance_usd = models.DecimalField(max_digits=18, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # Covers range queries per wallet without touching the table
+            models.Index(fields=['wallet', 'recorded_at', 'balance_usd'], name='snapshot_wallet_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} @ {self.recorded_at}: {self.balance_usd}"
+
+class PortfolioSummary(models.Model):
+    """
+    Denormalized portfolio totals for one user, kept up to date incrementally
+    by PortfolioService whenever balances or wallet links change
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='portfolio_summary'
+    )
+    total_usd = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    # Subtotal per chain, stored as decimal strings: {"eth": "123.45", ...}
+    chain_totals = models.JSONField(default=dict, blank=True)
+    wallet_count = models.PositiveIntegerField(default=0)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Portfolio of user {self.user_id}: {self.total_usd} USD"
+
+class SyncJob(models.Model):
+    """
+    Queued Moralis refresh for one wallet address on one chain,
+    processed by the sync_worker management command
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    address = models.CharField(max_length=255)
+    chain = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Only one queued or running job per wallet, so repeated enqueues are no-ops
+            models.UniqueConstraint(
+                fields=['address', 'chain'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_sync_job',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='syncjob_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.address} ({self.chain}) [{self.status}]"
+
+class TokenHolding(models.Model):
+    """
+    Balance of one token in one wallet, with the token's last known USD price,
+    replaced wholesale by HoldingsService whenever the wallet's tokens are refreshed
+    """
+    # The (wallet, token_address) unique index leads with wallet, so the FK doesn't need its own
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='holdings', db_index=False)
+    # Contract address in canonical form (the native token uses Moralis' 0xeeee...eeee)
+    token_address = models.CharField(max_length=255)
+    symbol = models.CharField(max_length=50, blank=True)
+    # Raw balance in the token's smallest unit; the token amount is amount / 10 ** decimals
+    amount = models.DecimalField(max_digits=78, decimal_places=0)
+    decimals = models.PositiveSmallIntegerField(default=18)
+    usd_price = models.DecimalField(max_digits=30, decimal_places=10, null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'token_address'], name='unique_wallet_token'),
+        ]
+        indexes = [
+            # Copying refreshed prices onto every holding of a token
+            models.Index(fields=['token_address'], name='holding_token_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id}: {self.symbol or self.token_address}"
+
+class TokenPrice(models.Model):
+    """
+    Shared cache of the last known USD price of a token on a chain, refreshed in
+    batches by PriceService independently of the wallets holding the token
+    """
+    chain = models.CharField(max_length=50)
+    token_address = models.CharField(max_length=255)
+    usd_price = models.DecimalField(max_digits=30, decimal_places=10)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chain', 'token_address'], name='unique_chain_token'),
+        ]
+
+    def __str__(self):
+        return f"{self.token_address} ({self.chain}): {self.usd_price} USD"
+
+class RequestProfile(models.Model):
+    """
+    Profile of one request a staff user asked for with the X-Profile header,
+    recorded by wallets.profiling.ProfilingMiddleware
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    # cProfile or pyinstrument
+    profiler = models.CharField(max_length=20)
+    # Profiler report as text
+    stats = models.TextField(blank=True)
+    # [{"sql": ..., "ms": ...}, ...] in execution order
+    queries = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f}ms)"
@@ -0,0 +1,155 @@
+# wallet/portfolio.py
+import logging
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from .models import PortfolioSummary, WalletUser
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+def to_decimal(value):
+    """Convert a stored or Moralis balance value to a Decimal rounded to cents (None counts as 0)"""
+    if value is None or value == '':
+        return Decimal('0.00')
+    try:
+        return Decimal(str(value)).quantize(CENT)
+    except InvalidOperation:
+        return Decimal('0.00')
+
+
+def format_balance(value):
+    """A balance as the API returns it: a decimal string rounded to cents, None if unknown"""
+    return None if value is None else str(to_decimal(value))
+
+
+class PortfolioService:
+    """
+    Maintains PortfolioSummary rows incrementally
+    Users without a summary row are skipped on writes; their summary is
+    built in full the first time it is read
+    """
+
+    @classmethod
+    def apply_balance_changes(cls, changes):
+        """
+        Apply wallet balance changes to the summaries of every user following those wallets
+        changes is a list of (wallet, old_balance, new_balance) tuples; wallet.synced_at
+        is used as the new sync time
+        """
+        deltas = {}
+        for wallet, old_balance, new_balance in changes:
+            delta = to_decimal(new_balance) - to_decimal(old_balance)
+            deltas[wallet.id] = (wallet, delta)
+        if not deltas:
+            return
+
+        # No savepoint when nested: any error aborts the caller's transaction anyway
+        with transaction.atomic(savepoint=False):
+            followers = list(
+                WalletUser.objects.filter(wallet_id__in=deltas.keys()).values_list('user_id', 'wallet_id')
+            )
+            summaries = {
+                summary.user_id: summary
+                for summary in PortfolioSummary.objects.select_for_update().filter(
+                    user_id__in={user_id for user_id, _ in followers}
+                )
+            }
+            now = timezone.now()
+            for user_id, wallet_id in followers:
+                summary = summaries.get(user_id)
+                if summary is None:
+                    continue
+                wallet, delta = deltas[wallet_id]
+                cls._add(summary, wallet.chain, delta)
+                cls._touch(summary, wallet.synced_at)
+                summary.updated_at = now
+
+            if summaries:
+                PortfolioSummary.objects.bulk_update(
+                    summaries.values(), ['total_usd', 'chain_totals', 'last_synced_at', 'updated_at']
+                )
+
+    @classmethod
+    def link_added(cls, user_id, wallet):
+        """Add a newly linked wallet to the user's summary"""
+        cls._update_links(user_id, [wallet], sign=1)
+
+    @classmethod
+    def links_added(cls, user_id, wallets):
+        """Add many newly linked wallets to the user's summary with a single write"""
+        cls._update_links(user_id, wallets, sign=1)
+
+    @classmethod
+    def link_removed(cls, user_id, wallet):
+        """Remove an unlinked wallet from the user's summary"""
+        cls._update_links(user_id, [wallet], sign=-1)
+
+    @classmethod
+    def _update_links(cls, user_id, wallets, sign):
+        if not wallets:
+            return
+        with transaction.atomic(savepoint=False):
+            summary = PortfolioSummary.objects.select_for_update().filter(user_id=user_id).first()
+            if summary is None:
+                return
+            for wallet in wallets:
+                cls._add(summary, wallet.chain, sign * to_decimal(wallet.balance_usd))
+                summary.wallet_count = max(0, summary.wallet_count + sign)
+                if sign > 0:
+                    cls._touch(summary, wallet.synced_at)
+            summary.save(update_fields=['total_usd', 'chain_totals', 'wallet_count', 'last_synced_at', 'updated_at'])
+
+    @classmethod
+    def get_summary(cls, user_id):
+        """Return the user's summary, building it if it doesn't exist yet"""
+        summary = PortfolioSummary.objects.filter(user_id=user_id).first()
+        if summary is None:
+            summary = cls.rebuild([user_id])[0]
+        return summary
+
+    @classmethod
+    def rebuild(cls, user_ids):
+        """
+        Recompute summaries from scratch for the given users
+        Returns the rebuilt summaries
+        """
+        rows = (
+            WalletUser.objects.filter(user_id__in=user_ids)
+            .values('user_id', 'wallet__chain')
+            .annotate(
+                total=Sum('wallet__balance_usd'),
+                wallets=Count('id'),
+                last_synced_at=Max('wallet__synced_at'),
+            )
+        )
+
+        summaries = {user_id: PortfolioSummary(user_id=user_id) for user_id in user_ids}
+        for row in rows:
+            summary = summaries[row['user_id']]
+            cls._add(summary, row['wallet__chain'], to_decimal(row['total']))
+            summary.wallet_count += row['wallets']
+            cls._touch(summary, row['last_synced_at'])
+
+        with transaction.atomic(savepoint=False):
+            PortfolioSummary.objects.bulk_create(
+                summaries.values(),
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['total_usd', 'chain_totals', 'wallet_count', 'last_synced_at', 'updated_at'],
+            )
+        return list(summaries.values())
+
+    @staticmethod
+    def _add(summary, chain, amount):
+        summary.total_usd = to_decimal(summary.total_usd) + amount
+        chain_totals = dict(summary.chain_totals or {})
+        chain_totals[chain] = str(to_decimal(chain_totals.get(chain)) + amount)
+        summary.chain_totals = chain_totals
+
+    @staticmethod
+    def _touch(summary, synced_at):
+        if synced_at and (summary.last_synced_at is None or synced_at > summary.last_synced_at):
+            summary.last_synced_at = synced_at
@@ -0,0 +1,192 @@
+# wallet/prices.py
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+from .models import TokenHolding, TokenPrice, Wallet
+from .portfolio import to_decimal
+from .services import MoralisService, WalletSyncService
+
+logger = logging.getLogger(__name__)
+
+# Moralis lists a chain's native coin under this placeholder contract; it is priced
+# through the chain's wrapped native token, which has the same price
+NATIVE_TOKEN = '0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee'
+WRAPPED_NATIVE_TOKENS = {
+    'eth': '0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2',
+    'bsc': '0xbb4cdb9cbd36b01bd1cbaef60af814a3f6f0ee7c',
+    'polygon': '0x0d500b1d8e8ef31e21c99d1db9a6444d3adf1270',
+    'avalanche': '0xb31f66aa3c1e785363f0875a1b74e27b85fd66c7',
+    'fantom': '0x21be370d5312f44cb42ce377bc9b8a0cef1a4c83',
+    'arbitrum': '0x82af49447d8a07e3bd95bd0d56f35241523fbab1',
+    'optimism': '0x4200000000000000000000000000000000000006',
+}
+
+class PriceService:
+    """
+    Keeps the shared TokenPrice cache fresh with batched Moralis price calls, and revalues
+    wallets from their stored holdings, so a price move doesn't need a call per wallet
+    """
+
+    @staticmethod
+    def stale_tokens(cutoff):
+        """(chain, token_address) pairs held by some wallet whose cached price is missing or older than cutoff"""
+        fresh_price = TokenPrice.objects.filter(
+            chain=OuterRef('wallet__chain'),
+            token_address=OuterRef('token_address'),
+            updated_at__gte=cutoff,
+        )
+        return (
+            TokenHolding.objects.exclude(Exists(fresh_price))
+            .values_list('wallet__chain', 'token_address')
+            .distinct()
+            .order_by()
+        )
+
+    @classmethod
+    def refresh_prices(cls, tokens, max_workers=None):
+        """
+        Fetch prices for (chain, token_address) pairs, MORALIS_PRICE_BATCH_SIZE tokens per call
+        with at most max_workers (default settings.MORALIS_MAX_CONCURRENCY) calls in flight,
+        then store them with store_prices
+        Returns tuple (prices_stored, calls, failures) where failures is a list of (chain, error_message)
+        """
+        by_chain = defaultdict(list)
+        for chain, token_address in tokens:
+            by_chain[chain].append(token_address)
+        batch_size = max(1, getattr(settings, 'MORALIS_PRICE_BATCH_SIZE', 25))
+        batches = [
+            (chain, token_addresses[start:start + batch_size])
+            for chain, token_addresses in by_chain.items()
+            for start in range(0, len(token_addresses), batch_size)
+        ]
+        if not batches:
+            return 0, 0, []
+
+        max_workers = max_workers or getattr(settings, 'MORALIS_MAX_CONCURRENCY', 8)
+        max_workers = max(1, min(max_workers, len(batches)))
+        prices = {}
+        failures = []
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='moralis-prices') as executor:
+            futures = {
+                executor.submit(cls._fetch_batch, chain, token_addresses): chain
+                for chain, token_addresses in batches
+            }
+            for future in as_completed(futures):
+                chain = futures[future]
+                try:
+                    success, result = future.result()
+                except Exception as e:
+                    logger.exception(f"Unexpected error fetching token prices on {chain}: {str(e)}")
+                    success, result = False, str(e)
+                if success:
+                    prices.update(result)
+                else:
+                    failures.append((chain, str(result)))
+        return cls.store_prices(prices), len(batches), failures
+
+    @staticmethod
+    def _fetch_batch(chain, token_addresses):
+        """Price one batch; returns tuple (success_bool, {(chain, token_address): price} or error message)"""
+        wrapped = WRAPPED_NATIVE_TOKENS.get(chain)
+        requested = [
+            wrapped if token_address == NATIVE_TOKEN and wrapped else token_address
+            for token_address in token_addresses
+        ]
+        success, result = MoralisService.get_token_prices(chain, list(dict.fromkeys(requested)))
+        if not success:
+            return False, result
+        return True, {
+            (chain, token_address): result[requested_address]
+            for token_address, requested_address in zip(token_addresses, requested)
+            if requested_address in result
+        }
+
+    @staticmethod
+    def store_prices(prices):
+        """
+        Upsert {(chain, token_address): usd_price} into TokenPrice and copy the prices onto
+        the holdings of those tokens (one UPDATE per chain), in one transaction
+        Returns the number of prices stored
+        """
+        if not prices:
+            return 0
+
+        updated_at = timezone.now()
+        rows = [
+            TokenPrice(chain=chain, token_address=token_address, usd_price=usd_price, updated_at=updated_at)
+            for (chain, token_address), usd_price in sorted(prices.items())
+        ]
+        tokens_by_chain = defaultdict(list)
+        for chain, token_address in prices:
+            tokens_by_chain[chain].append(token_address)
+
+        with transaction.atomic(savepoint=False):
+            TokenPrice.objects.bulk_create(
+                rows,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['chain', 'token_address'],
+                update_fields=['usd_price', 'updated_at'],
+            )
+            # Holdings carry their token's latest price, so the breakdown and
+            # revaluation read a single table
+            for chain, token_addresses in tokens_by_chain.items():
+                latest_price = TokenPrice.objects.filter(
+                    chain=chain, token_address=OuterRef('token_address')
+                ).values('usd_price')[:1]
+                TokenHolding.objects.filter(
+                    wallet__chain=chain, token_address__in=token_addresses
+                ).update(usd_price=Subquery(latest_price))
+        return len(rows)
+
+    @classmethod
+    def revalue_wallets(cls, wallet_ids=None, batch_size=500):
+        """
+        Recompute the USD balance of wallets (every wallet with holdings by default) from
+        their stored holdings and prices, with no Moralis call. Changed balances are written
+        through WalletSyncService.save_balances one batch of wallets at a time, which keeps the
+        portfolio summaries and balance history in step; synced_at is left alone, since
+        the holdings themselves weren't fetched. Holdings without a price count as
+        zero, like in Moralis' net worth; wallets with no priced holding are left alone
+        Returns tuple (wallets_valued, wallets_updated)
+        """
+        holdings = TokenHolding.objects.all()
+        if wallet_ids is not None:
+            holdings = holdings.filter(wallet_id__in=wallet_ids)
+        rows = holdings.values_list('wallet_id', 'amount', 'decimals', 'usd_price').order_by('wallet_id')
+
+        totals = {'valued': 0, 'updated': 0}
+        values = {}
+        current_id = None
+        # Rows come grouped by wallet, so each wallet's value is final when the next one starts
+        for wallet_id, amount, decimals, usd_price in rows.iterator(chunk_size=2000):
+            if wallet_id != current_id:
+                if len(values) >= batch_size:
+                    cls._save_values(values, totals)
+                    values = {}
+                current_id = wallet_id
+            if usd_price is None:
+                continue
+            value = Decimal(str(amount)).scaleb(-decimals) * Decimal(str(usd_price))
+            values[wallet_id] = values.get(wallet_id, Decimal(0)) + value
+        cls._save_values(values, totals)
+        return totals['valued'], totals['updated']
+
+    @staticmethod
+    def _save_values(values, totals):
+        """Store the balances in {wallet_id: value} that differ from the stored ones"""
+        if not values:
+            return
+        updates = []
+        for wallet in Wallet.objects.filter(id__in=list(values)):
+            balance = to_decimal(values[wallet.id])
+            if wallet.balance_usd is None or to_decimal(wallet.balance_usd) != balance:
+                updates.append((wallet, balance))
+        WalletSyncService.save_balances(updates, synced=False)
+        totals['valued'] += len(values)
+        totals['updated'] += len(updates)
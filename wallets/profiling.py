@@ -0,0 +1,191 @@
+# wallet/profiling.py
+import cProfile
+import io
+import logging
+import pstats
+import time
+from urllib.parse import parse_qsl
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import CachedUserJWTAuthentication
+from backend import metrics
+from .models import RequestProfile
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+def profiling_requested(request):
+    """Cheap check for the X-Profile header or ?_profile=1, done before any authentication"""
+    if PROFILE_HEADER in request.META:
+        return True
+    query_string = request.META.get('QUERY_STRING', '')
+    # Only parse query strings that could carry the flag
+    if PROFILE_PARAM not in query_string:
+        return False
+    values = [value for key, value in parse_qsl(query_string, keep_blank_values=True) if key == PROFILE_PARAM]
+    return bool(values) and values[-1].lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def staff_user(request):
+    """Return the request's user if it is staff, from the session or a simplejwt access token"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            auth = CachedUserJWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        user = auth[0] if auth else None
+    return user if user is not None and user.is_staff else None
+
+
+class RequestProfiler:
+    """Runs a request under pyinstrument when it is installed, otherwise cProfile"""
+
+    def __init__(self, async_mode=False):
+        if SamplingProfiler is not None:
+            self.name = 'pyinstrument'
+            self._profiler = SamplingProfiler(async_mode='enabled' if async_mode else 'disabled')
+        else:
+            # cProfile only sees the thread it runs on; under ASGI that leaves out sync_to_async work
+            self.name = 'cProfile'
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.name == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.name == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self):
+        if self.name == 'pyinstrument':
+            return self._profiler.output_text(unicode=True, color=False)
+        output = io.StringIO()
+        limit = getattr(settings, 'PROFILING_STATS_LIMIT', 50)
+        pstats.Stats(self._profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests from staff users who send an X-Profile header (or ?_profile=1)
+    The profiler report and every SQL query with its timing are stored as a RequestProfile
+    for the admin, and a summary goes back in Server-Timing and X-Profile-* headers.
+    Requests without the flag only pay for the header check
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not profiling_requested(request):
+            return self.get_response(request)
+
+        user = staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        metrics.install_query_recorder(connection)
+        stats, token = self.collect_queries()
+        profiler = RequestProfiler()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+            duration = time.perf_counter() - started
+            queries = stats.queries
+            stats.queries = None
+            if token is not None:
+                metrics.current_query_stats.reset(token)
+        return self.finish(request, response, user, profiler, duration, queries)
+
+    async def __acall__(self, request):
+        if not profiling_requested(request):
+            return await self.get_response(request)
+
+        user = await sync_to_async(staff_user)(request)
+        if user is None:
+            return await self.get_response(request)
+
+        stats, token = self.collect_queries()
+        profiler = RequestProfiler(async_mode=True)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.stop()
+            duration = time.perf_counter() - started
+            queries = stats.queries
+            stats.queries = None
+            if token is not None:
+                metrics.current_query_stats.reset(token)
+        return await sync_to_async(self.finish)(request, response, user, profiler, duration, queries)
+
+    @staticmethod
+    def collect_queries():
+        """
+        Start collecting SQL on the request's QueryStats (set by MetricsMiddleware,
+        or here when it isn't installed). Returns tuple (stats, context variable token or None)
+        """
+        stats = metrics.current_query_stats.get()
+        token = None
+        if stats is None:
+            stats = metrics.QueryStats()
+            token = metrics.current_query_stats.set(stats)
+        stats.queries = []
+        return stats, token
+
+    @staticmethod
+    def finish(request, response, user, profiler, duration, queries):
+        """Store the profile and add the summary headers"""
+        query_ms = sum(query_duration for _, query_duration in queries) * 1000
+        try:
+            profile = RequestProfile.objects.create(
+                user=user,
+                method=request.method,
+                path=request.get_full_path(),
+                status_code=response.status_code,
+                duration_ms=duration * 1000,
+                query_count=len(queries),
+                query_ms=query_ms,
+                profiler=profiler.name,
+                stats=profiler.report(),
+                queries=[{'sql': sql, 'ms': round(query_duration * 1000, 3)} for sql, query_duration in queries],
+            )
+        except Exception as e:
+            logger.exception(f"Error storing request profile: {str(e)}")
+            profile = None
+
+        response['Server-Timing'] = (
+            f'total;dur={duration * 1000:.1f}, db;dur={query_ms:.1f};desc="{len(queries)} queries"'
+        )
+        response['X-Profile-Queries'] = str(len(queries))
+        response['X-Profile-Profiler'] = profiler.name
+        if profile is not None:
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
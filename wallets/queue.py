@@ -0,0 +1,114 @@
+# wallet/queue.py
+import logging
+import random
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import SyncJob, Wallet
+from .services import WalletSyncService
+
+logger = logging.getLogger(__name__)
+
+class SyncQueue:
+    """
+    Durable queue of wallet refreshes backed by the SyncJob table
+    Workers claim batches with SELECT ... FOR UPDATE SKIP LOCKED, so any
+    number of worker processes can share the queue safely
+    """
+
+    @classmethod
+    def enqueue(cls, wallets):
+        """
+        Queue a refresh for each wallet, skipping wallets that already have an active job
+        Returns the number of wallets submitted
+        """
+        jobs = [SyncJob(address=wallet.address, chain=wallet.chain) for wallet in wallets]
+        if jobs:
+            # The partial unique constraint turns duplicate enqueues into no-ops
+            SyncJob.objects.bulk_create(jobs, ignore_conflicts=True)
+        return len(jobs)
+
+    @classmethod
+    def claim(cls, batch_size=None):
+        """Claim up to batch_size due jobs, marking them running"""
+        batch_size = batch_size or getattr(settings, 'SYNC_JOB_BATCH_SIZE', 50)
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                SyncJob.objects.select_for_update(skip_locked=True)
+                .filter(status=SyncJob.STATUS_PENDING, available_at__lte=now)
+                .order_by('available_at')[:batch_size]
+            )
+            if jobs:
+                SyncJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                    status=SyncJob.STATUS_RUNNING,
+                    locked_at=now,
+                    attempts=F('attempts') + 1,
+                )
+        for job in jobs:
+            job.status = SyncJob.STATUS_RUNNING
+            job.locked_at = now
+            job.attempts += 1
+        return jobs
+
+    @classmethod
+    def process_batch(cls, batch_size=None):
+        """
+        Claim a batch of jobs and refresh their wallets with the concurrent Moralis client
+        Returns tuple (succeeded_count, failed_count)
+        """
+        jobs = cls.claim(batch_size)
+        if not jobs:
+            return 0, 0
+
+        jobs_by_key = {(job.address, job.chain): job for job in jobs}
+        wallets = Wallet.objects.filter(
+            reduce(or_, (Q(address=address, chain=chain) for address, chain in jobs_by_key))
+        )
+
+        errors = {}
+        try:
+            _, failures = WalletSyncService.refresh_wallets(wallets)
+            for wallet, error in failures:
+                errors[(wallet.address, wallet.chain)] = error
+        except Exception as e:
+            logger.exception(f"Error refreshing queued wallets: {str(e)}")
+            errors = {key: str(e) for key in jobs_by_key}
+
+        # Jobs whose wallet has since been deleted have nothing left to do
+        finished = [job.id for key, job in jobs_by_key.items() if key not in errors]
+        SyncJob.objects.filter(id__in=finished).delete()
+        for key, error in errors.items():
+            cls.fail(jobs_by_key[key], error)
+        return len(finished), len(errors)
+
+    @classmethod
+    def fail(cls, job, error):
+        """Reschedule a failed job with exponential backoff, or dead-letter it"""
+        max_attempts = getattr(settings, 'SYNC_JOB_MAX_ATTEMPTS', 5)
+        if job.attempts >= max_attempts:
+            logger.error(f"Sync job for {job.address} ({job.chain}) dead after {job.attempts} attempts: {error}")
+            job.status = SyncJob.STATUS_DEAD
+        else:
+            base = getattr(settings, 'SYNC_JOB_RETRY_BACKOFF', 30)
+            delay = base * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+            logger.warning(f"Sync job for {job.address} ({job.chain}) failed, retrying in {delay:.0f}s: {error}")
+            job.status = SyncJob.STATUS_PENDING
+            job.available_at = timezone.now() + timedelta(seconds=delay)
+        job.locked_at = None
+        job.last_error = error
+        job.save(update_fields=['status', 'available_at', 'locked_at', 'last_error'])
+
+    @classmethod
+    def release_stale(cls):
+        """Return jobs left running by a crashed worker to the queue"""
+        stale_after = getattr(settings, 'SYNC_JOB_STALE_AFTER', 300)
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        return SyncJob.objects.filter(status=SyncJob.STATUS_RUNNING, locked_at__lt=cutoff).update(
+            status=SyncJob.STATUS_PENDING,
+            locked_at=None,
+        )
@@ -0,0 +1,211 @@
+# wallet/ratelimit.py
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, ExitStack
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+class MoralisRateLimitError(Exception):
+    """Raised when a Moralis call can't get budget or a chain slot within the allowed wait"""
+
+
+class LocalTokenBucket:
+    """Thread-safe token bucket for a single process"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost, max_wait):
+        """
+        Take cost tokens, going into debt if needed
+        Returns the seconds to wait before the call may go out, or None if that exceeds max_wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            wait = max(0.0, (cost - self.tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self.tokens -= cost
+            return wait
+
+
+class CacheTokenBucket:
+    """
+    Budget shared by every process using the same Django cache
+    Approximates a token bucket with one-second windows of `rate` tokens
+    """
+
+    def __init__(self, rate, capacity, alias='default'):
+        self.rate = rate
+        self.capacity = capacity
+        self.alias = alias
+
+    def reserve(self, cost, max_wait):
+        store = caches[self.alias]
+        deadline = time.monotonic() + max_wait
+        while True:
+            now = time.time()
+            key = f"moralis:ratelimit:{int(now)}"
+            store.add(key, 0, 5)
+            try:
+                used = store.incr(key, cost)
+            except ValueError:
+                # The window expired between add and incr
+                continue
+            if used <= self.rate or used == cost:
+                return 0.0
+
+            store.decr(key, cost)
+            wait = 1 - (now % 1)
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+
+class MoralisRateLimiter:
+    """
+    Client-side limiter in front of every Moralis call
+    Each call spends the compute units of its endpoint from a token bucket
+    (MORALIS_COMPUTE_UNITS_PER_SECOND) and holds a slot in a per-chain
+    semaphore (MORALIS_PER_CHAIN_CONCURRENCY) while it runs. Budget is reserved first, so waiting for it doesn't hold a chain slot.
+    Calls that can't get both within MORALIS_RATE_LIMIT_MAX_WAIT seconds fail fast
+    with MoralisRateLimitError.
+    """
+
+    _bucket = None
+    _chain_semaphores = {}
+    _lock = threading.Lock()
+    _stats = {'calls': 0, 'throttled': 0, 'rejected': 0, 'compute_units': 0}
+
+    @classmethod
+    def get_bucket(cls):
+        if cls._bucket is None:
+            with cls._lock:
+                if cls._bucket is None:
+                    rate = getattr(settings, 'MORALIS_COMPUTE_UNITS_PER_SECOND', 1000)
+                    if getattr(settings, 'MORALIS_RATE_LIMIT_BACKEND', 'local') == 'django':
+                        cls._bucket = CacheTokenBucket(rate, rate, getattr(settings, 'MORALIS_CACHE_ALIAS', 'default'))
+                    else:
+                        cls._bucket = LocalTokenBucket(rate, rate)
+        return cls._bucket
+
+    @classmethod
+    def get_chain_semaphore(cls, chain):
+        with cls._lock:
+            if chain not in cls._chain_semaphores:
+                limit = getattr(settings, 'MORALIS_PER_CHAIN_CONCURRENCY', getattr(settings, 'MORALIS_POOL_SIZE', 20))
+                cls._chain_semaphores[chain] = threading.BoundedSemaphore(max(1, limit))
+            return cls._chain_semaphores[chain]
+
+    @classmethod
+    def cost_of(cls, endpoint):
+        costs = getattr(settings, 'MORALIS_ENDPOINT_COMPUTE_UNITS', {})
+        return costs.get(endpoint, getattr(settings, 'MORALIS_DEFAULT_COMPUTE_UNITS', 50))
+
+    @classmethod
+    @contextmanager
+    def limit(cls, endpoint, chains=None):
+        """Wait for compute-unit budget and a slot on every chain, then run the call"""
+        max_wait = getattr(settings, 'MORALIS_RATE_LIMIT_MAX_WAIT', 15.0)
+        started = time.monotonic()
+
+        cost = cls.cost_of(endpoint)
+        wait = cls.get_bucket().reserve(cost, max_wait)
+        if wait is None:
+            cls._increment('rejected')
+            raise MoralisRateLimitError(
+                f"Moralis compute unit budget exhausted for {endpoint} ({cost} CU), gave up after {max_wait}s"
+            )
+        if wait > 0:
+            cls._increment('throttled')
+            logger.info(f"Throttling Moralis {endpoint} call for {wait:.2f}s to stay within budget")
+            time.sleep(wait)
+
+        with ExitStack() as stack:
+            # Take chain slots in a fixed order so multi-chain calls can't deadlock each other
+            for chain in sorted(set(chains or [])):
+                remaining = max(0.0, max_wait - (time.monotonic() - started))
+                if not cls.get_chain_semaphore(chain).acquire(timeout=remaining):
+                    cls._increment('rejected')
+                    raise MoralisRateLimitError(
+                        f"Moralis concurrency limit reached for chain {chain}, gave up after {max_wait}s"
+                    )
+                stack.callback(cls.get_chain_semaphore(chain).release)
+
+            with cls._lock:
+                cls._stats['calls'] += 1
+                cls._stats['compute_units'] += cost
+            yield
+
+    @classmethod
+    @asynccontextmanager
+    async def alimit(cls, endpoint, chains=None):
+        """Async version of limit() that waits without blocking the event loop"""
+        max_wait = getattr(settings, 'MORALIS_RATE_LIMIT_MAX_WAIT', 15.0)
+        deadline = time.monotonic() + max_wait
+        acquired = []
+
+        cost = cls.cost_of(endpoint)
+        bucket = cls.get_bucket()
+        if isinstance(bucket, LocalTokenBucket):
+            wait = bucket.reserve(cost, max_wait)
+        else:
+            # The shared bucket talks to the cache and may sleep, so keep it off the loop
+            wait = await sync_to_async(bucket.reserve, thread_sensitive=False)(cost, max_wait)
+        if wait is None:
+            cls._increment('rejected')
+            raise MoralisRateLimitError(
+                f"Moralis compute unit budget exhausted for {endpoint} ({cost} CU), gave up after {max_wait}s"
+            )
+        if wait > 0:
+            cls._increment('throttled')
+            await asyncio.sleep(wait)
+
+        try:
+            # Chain slots are shared with threaded callers, so poll the same semaphores
+            for chain in sorted(set(chains or [])):
+                semaphore = cls.get_chain_semaphore(chain)
+                while not semaphore.acquire(blocking=False):
+                    if time.monotonic() >= deadline:
+                        cls._increment('rejected')
+                        raise MoralisRateLimitError(
+                            f"Moralis concurrency limit reached for chain {chain}, gave up after {max_wait}s"
+                        )
+                    await asyncio.sleep(0.01)
+                acquired.append(semaphore)
+
+            with cls._lock:
+                cls._stats['calls'] += 1
+                cls._stats['compute_units'] += cost
+            yield
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return dict(cls._stats)
+
+    @classmethod
+    def reset(cls):
+        """Drop the bucket and chain semaphores so they're rebuilt from current settings"""
+        with cls._lock:
+            cls._bucket = None
+            cls._chain_semaphores = {}
+
+    @classmethod
+    def _increment(cls, counter):
+        with cls._lock:
+            cls._stats[counter] += 1
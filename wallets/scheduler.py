@@ -0,0 +1,101 @@
+# wallet/scheduler.py
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, Count, DateTimeField, ExpressionWrapper, F, Q, When
+from django.utils import timezone
+from .models import Wallet, WalletUser
+
+logger = logging.getLogger(__name__)
+
+class RefreshScheduler:
+    """
+    Picks wallets that are due for a refresh based on Wallet.synced_at
+    Each wallet belongs to the first tier in settings.WALLET_REFRESH_TIERS whose
+    balance or follower threshold it meets, and is due once its tier interval has passed
+    """
+
+    @classmethod
+    def tiers(cls):
+        return getattr(settings, 'WALLET_REFRESH_TIERS', [
+            {'name': 'default', 'min_balance_usd': 0, 'min_followers': 0, 'interval': 60 * 60},
+        ])
+
+    @staticmethod
+    def _qualifies(tier):
+        """Condition for a wallet meeting a tier's balance or follower threshold"""
+        return (
+            Q(balance_usd__gte=tier.get('min_balance_usd', 0))
+            | Q(followers__gte=tier.get('min_followers', 0))
+        )
+
+    @classmethod
+    def due_wallets_query(cls, now=None):
+        """
+        Wallets with at least one follower whose tier interval has elapsed, most overdue first
+        Overdue is measured from when each wallet became due (synced_at plus its tier
+        interval), so a hot wallet isn't queued behind cold ones just because they were
+        synced longer ago
+        """
+        now = now or timezone.now()
+        due = Q()
+        higher_tiers = Q()
+        due_at = []
+        for index, tier in enumerate(cls.tiers()):
+            in_tier = cls._qualifies(tier)
+            if index:
+                in_tier &= ~higher_tiers
+            interval = timedelta(seconds=tier['interval'])
+            due |= in_tier & Q(synced_at__lt=now - interval)
+            due_at.append(When(in_tier, then=ExpressionWrapper(F('synced_at') + interval, output_field=DateTimeField())))
+            higher_tiers |= cls._qualifies(tier)
+
+        return (
+            Wallet.objects.annotate(followers=Count('walletuser'))
+            .filter(followers__gt=0)
+            .filter(due)
+            .annotate(due_at=Case(*due_at, output_field=DateTimeField()))
+            .order_by('due_at', 'id')
+        )
+
+    @classmethod
+    def select_due(cls, call_budget):
+        """
+        Return due wallets costing at most call_budget Moralis calls
+        Wallets sharing an address are fetched together, so the budget counts distinct addresses
+        """
+        selected = []
+        addresses = set()
+        for wallet in cls.due_wallets_query().iterator():
+            if wallet.address not in addresses:
+                if len(addresses) >= call_budget:
+                    break
+                addresses.add(wallet.address)
+            selected.append(wallet)
+        return selected
+
+    @staticmethod
+    def stale_wallets_by_priority(cutoff):
+        """
+        Every followed wallet synced before cutoff, once each however many users follow it,
+        most followed first and then stalest first
+        """
+        return (
+            Wallet.objects.filter(synced_at__lt=cutoff)
+            .annotate(followers=Count('walletuser'))
+            .filter(followers__gt=0)
+            .order_by('-followers', 'synced_at', 'id')
+        )
+
+    @staticmethod
+    def per_user_call_count(cutoff):
+        """
+        Moralis calls the same refresh would cost through each follower's /sync/:
+        one per distinct (user, address) pair, as each sync groups only its own wallets
+        """
+        return (
+            WalletUser.objects.filter(wallet__synced_at__lt=cutoff)
+            .values('user_id', 'wallet__address')
+            .distinct()
+            .count()
+        )
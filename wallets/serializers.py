@@ -1,45 +1,61 @@
 # wallet/serializers.py
 from rest_framework import serializers
-from .models import Wallet, WalletUser
+from .addresses import normalize_address, normalize_chain
+from .models import Wallet, PortfolioSummary
 
-class AddWalletSerializer(serializers.Serializer):
-    """Serializer for adding a new wallet"""
+class WalletAddressSerializer(serializers.Serializer):
+    """Field validation for an (address, chain) pair"""
     address = serializers.CharField(
         max_length=255, 
         min_length=26,  # Basic length validation
     )
     chain = serializers.CharField(max_length=50)
+
+    def validate(self, attrs):
+        """Canonicalize the pair, so differently cased copies of an address match the same wallet"""
+        attrs['chain'] = normalize_chain(attrs['chain'])
+        attrs['address'] = normalize_address(attrs['address'], attrs['chain'])
+        return attrs
+
+class AddWalletSerializer(WalletAddressSerializer):
+    """
+    Serializer for adding a new wallet
+    Duplicates aren't checked here: WalletSyncService.add_wallet relies on the
+    (user, wallet) unique constraint instead
+    """
     
     def validate(self, attrs):
-        """Validate that this wallet doesn't already exist for this user"""
+        """Validate that the request is authenticated"""
         request = self.context.get('request')
         
         # Check if request exists in context
         if not request or not hasattr(request, 'user'):
             raise serializers.ValidationError("Authentication required")
             
-        user = request.user
-        
-        # Check if wallet exists
-        try:
-            wallet = Wallet.objects.get(
-                address=attrs['address'],
-                chain=attrs['chain']
-            )
-            
-            # Check if user already has this wallet
-            if WalletUser.objects.filter(user=user, wallet=wallet).exists():
-                raise serializers.ValidationError(
-                    "You have already added this wallet address for this blockchain."
-                )
-        except Wallet.DoesNotExist:
-            # This is fine - it means the wallet doesn't exist yet
-            pass
-            
-        return attrs
+        return super().validate(attrs)
 
 class WalletSerializer(serializers.ModelSerializer):
     """Serializer for wallet data"""
     class Meta:
         model = Wallet
         fields = ['address', 'balance_usd', 'chain']
+
+    @classmethod
+    def from_values(cls, rows):
+        """Serialize values() rows with the wallet field names, skipping model instances"""
+        balance_field = cls().fields['balance_usd']
+        return [
+            {
+                'address': row['address'],
+                'balance_usd': balance_field.to_representation(row['balance_usd'])
+                if row['balance_usd'] is not None else None,
+                'chain': row['chain'],
+            }
+            for row in rows
+        ]
+
+class PortfolioSummarySerializer(serializers.ModelSerializer):
+    """Serializer for a user's portfolio totals"""
+    class Meta:
+        model = PortfolioSummary
+        fields = ['total_usd', 'chain_totals', 'wallet_count', 'last_synced_at']
@@ -1,11 +1,26 @@
 # wallet/services.py
-import requests
 import logging
-from decimal import Decimal
+from datetime import datetime, timezone as dt_timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .cache import NetWorthCache
+from .circuit import MoralisCircuitBreaker, MoralisUnavailable
+from .history import BalanceHistoryService
+from .http import MoralisHttpClient
+from .models import Wallet, WalletUser
+from .portfolio import PortfolioService, format_balance
+from .ratelimit import MoralisRateLimiter, MoralisRateLimitError
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+class WalletAlreadyAdded(Exception):
+    """Raised when a user adds a wallet that is already in their portfolio"""
+
+
 class MoralisService:
     """Service for interacting with Moralis API"""
     
@@ -21,61 +36,459 @@ class MoralisService:
     }
     
     @classmethod
-    def get_wallet_net_worth(cls, address, chain=None):
+    def get_wallet_net_worth(cls, address, chain=None, chains=None):
         """
-        Fetch wallet net worth from Moralis API
+        Fetch wallet net worth from Moralis API, served from NetWorthCache when fresh
         If chain is provided, will filter results for that specific chain
+        If chains is provided, a single call returns the breakdown for all of those chains
         Returns tuple: (success_bool, data_or_error_message)
         """
+        success, result, _ = cls.get_wallet_net_worth_entry(address, chain, chains)
+        return success, result
+
+    @classmethod
+    def get_wallet_net_worth_entry(cls, address, chain=None, chains=None, allow_stale=False):
+        """
+        get_wallet_net_worth, plus when the data was fetched from Moralis, for storing as synced_at
+        allow_stale serves entries past the cache TTL (refreshing them in the background)
+        Returns tuple: (success_bool, data_or_error_message, fetched_at timestamp or None)
+        """
+        return NetWorthCache.get_or_fetch(
+            address,
+            cls.requested_chains(chain, chains),
+            lambda: cls._fetch_wallet_net_worth(address, chain, chains),
+            allow_stale=allow_stale
+        )
+
+    @classmethod
+    def requested_chains(cls, chain=None, chains=None):
+        """Moralis chain identifiers a net worth call asks for (None means all chains)"""
+        if chain:
+            return cls.to_moralis_chains([chain])
+        if chains:
+            return cls.to_moralis_chains(chains)
+        return None
+
+    @classmethod
+    def _fetch_wallet_net_worth(cls, address, chain=None, chains=None):
+        """Call the Moralis net worth endpoint directly, bypassing the cache"""
         try:
             # Prepare the API call
-            api_url = f"https://deep-index.moralis.io/api/v2.2/wallets/{address}/net-worth"
-            headers = {
-                'accept': 'application/json',
-                'X-API-Key': settings.MORALIS_API_KEY
-            }
-            
-            # Add chain parameter if specified
-            params = {}
-            if chain:
-                # Convert chain name to Moralis chain ID if needed
-                moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
-                params['chains'] = [moralis_chain]
-                logger.info(f"Querying Moralis for wallet {address} on chain {moralis_chain}")
-            else:
-                logger.info(f"Querying Moralis for wallet {address} across all chains")
+            api_url, headers, params = cls.build_net_worth_request(address, chain, chains)
             
-            # Make the API call
-            response = requests.get(api_url, headers=headers, params=params)
+            # Make the API call through the pooled client (timeouts and retries included)
+            response = MoralisHttpClient.get(
+                api_url,
+                endpoint='net-worth',
+                chains=params.get('chains'),
+                headers=headers,
+                params=params
+            )
             
             # Log the full response for debugging
             logger.debug(f"Moralis API response: {response.text}")
             
-            # Handle response
-            if response.status_code == 200:
-                data = response.json()
+            return cls.parse_net_worth_response(response.status_code, response.text, response.json, chain)
                 
-                # If a specific chain was requested, filter the results
-                if chain and 'chains' in data:
-                    moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
-                    # Find the chain data in the response
-                    chain_data = None
-                    for c in data['chains']:
-                        if c.get('chain') == moralis_chain:
-                            chain_data = c
-                            break
-                    
-                    # If we couldn't find data for this chain, return an error
-                    if not chain_data:
-                        return False, f"No data found for chain: {chain} (Moralis chain ID: {moralis_chain})"
+        except (MoralisUnavailable, MoralisRateLimitError) as e:
+            # Expected during an outage or a burst, no traceback needed
+            error_msg = f"Error fetching wallet net worth: {str(e)}"
+            logger.warning(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Error fetching wallet net worth: {str(e)}"
+            logger.exception(error_msg)
+            return False, error_msg
+
+    @classmethod
+    def build_net_worth_request(cls, address, chain=None, chains=None):
+        """Return tuple (api_url, headers, params) for a net worth call"""
+        base_url = getattr(settings, 'MORALIS_BASE_URL', 'https://deep-index.moralis.io/api/v2.2')
+        api_url = f"{base_url}/wallets/{address}/net-worth"
+        headers = {
+            'accept': 'application/json',
+            'X-API-Key': settings.MORALIS_API_KEY
+        }
+        
+        # Add chain parameter if specified
+        params = {}
+        if chain:
+            # Convert chain name to Moralis chain ID if needed
+            moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
+            params['chains'] = [moralis_chain]
+            logger.info(f"Querying Moralis for wallet {address} on chain {moralis_chain}")
+        elif chains:
+            params['chains'] = cls.to_moralis_chains(chains)
+            logger.info(f"Querying Moralis for wallet {address} on chains {', '.join(params['chains'])}")
+        else:
+            logger.info(f"Querying Moralis for wallet {address} across all chains")
+        return api_url, headers, params
+
+    @classmethod
+    def parse_net_worth_response(cls, status_code, text, json, chain=None):
+        """
+        Turn a net worth HTTP response into tuple (success_bool, data_or_error_message)
+        json is a callable returning the decoded body
+        """
+        if status_code == 200:
+            data = json()
+            
+            # If a specific chain was requested, filter the results
+            if chain and 'chains' in data:
+                moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
+                # Find the chain data in the response
+                chain_data = None
+                for c in data['chains']:
+                    if c.get('chain') == moralis_chain:
+                        chain_data = c
+                        break
                 
-                return True, data
+                # If we couldn't find data for this chain, return an error
+                if not chain_data:
+                    return False, f"No data found for chain: {chain} (Moralis chain ID: {moralis_chain})"
+            
+            return True, data
+        else:
+            error_msg = f"Moralis API error: {status_code}, {text}"
+            logger.error(error_msg)
+            return False, error_msg
+
+    @classmethod
+    def get_wallet_tokens(cls, address, chain):
+        """
+        Fetch the ERC20 and native token balances of a wallet on one chain, following
+        the response cursor for up to MORALIS_TOKENS_MAX_PAGES pages (spam tokens excluded)
+        Returns tuple: (success_bool, list_of_token_dicts_or_error_message)
+        """
+        base_url = getattr(settings, 'MORALIS_BASE_URL', 'https://deep-index.moralis.io/api/v2.2')
+        api_url = f"{base_url}/wallets/{address}/tokens"
+        headers = {
+            'accept': 'application/json',
+            'X-API-Key': settings.MORALIS_API_KEY
+        }
+        moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
+        params = {'chain': moralis_chain, 'exclude_spam': 'true'}
+        tokens = []
+        try:
+            for _ in range(getattr(settings, 'MORALIS_TOKENS_MAX_PAGES', 5)):
+                response = MoralisHttpClient.get(
+                    api_url,
+                    endpoint='tokens',
+                    chains=[moralis_chain],
+                    headers=headers,
+                    params=params
+                )
+                if response.status_code != 200:
+                    error_msg = f"Moralis API error: {response.status_code}, {response.text}"
+                    logger.error(error_msg)
+                    return False, error_msg
+                data = response.json()
+                tokens.extend(token for token in data.get('result') or [] if isinstance(token, dict))
+                if not data.get('cursor'):
+                    break
+                params = {**params, 'cursor': data['cursor']}
             else:
+                logger.warning(f"Token list of {address} ({chain}) truncated at {len(tokens)} tokens")
+            return True, tokens
+        except (MoralisUnavailable, MoralisRateLimitError) as e:
+            error_msg = f"Error fetching wallet tokens: {str(e)}"
+            logger.warning(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Error fetching wallet tokens: {str(e)}"
+            logger.exception(error_msg)
+            return False, error_msg
+
+    @classmethod
+    def get_token_prices(cls, chain, token_addresses):
+        """
+        Fetch the USD prices of several ERC20 tokens on one chain with a single batched call
+        (Moralis accepts up to 25 tokens per call). Tokens Moralis has no price for are left out
+        Returns tuple: (success_bool, {token_address: Decimal price} or error message)
+        """
+        base_url = getattr(settings, 'MORALIS_BASE_URL', 'https://deep-index.moralis.io/api/v2.2')
+        headers = {
+            'accept': 'application/json',
+            'X-API-Key': settings.MORALIS_API_KEY
+        }
+        moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
+        try:
+            response = MoralisHttpClient.request(
+                'POST',
+                f"{base_url}/erc20/prices",
+                endpoint='token-prices',
+                chains=[moralis_chain],
+                headers=headers,
+                params={'chain': moralis_chain},
+                json={'tokens': [{'token_address': address} for address in token_addresses]}
+            )
+            if response.status_code != 200:
                 error_msg = f"Moralis API error: {response.status_code}, {response.text}"
                 logger.error(error_msg)
                 return False, error_msg
-                
+
+            prices = {}
+            for entry in response.json() or []:
+                if not isinstance(entry, dict) or entry.get('usdPrice') is None or not entry.get('tokenAddress'):
+                    continue
+                try:
+                    prices[entry['tokenAddress'].lower()] = Decimal(str(entry['usdPrice']))
+                except InvalidOperation:
+                    continue
+            return True, prices
+        except (MoralisUnavailable, MoralisRateLimitError) as e:
+            error_msg = f"Error fetching token prices: {str(e)}"
+            logger.warning(error_msg)
+            return False, error_msg
         except Exception as e:
-            error_msg = f"Error fetching wallet net worth: {str(e)}"
+            error_msg = f"Error fetching token prices: {str(e)}"
             logger.exception(error_msg)
             return False, error_msg
+
+    @classmethod
+    def stats(cls):
+        """Counters for the Moralis client, for monitoring"""
+        return {
+            'http': MoralisHttpClient.stats(),
+            'cache': NetWorthCache.stats(),
+            'singleflight': SingleFlight.stats(),
+            'rate_limit': MoralisRateLimiter.stats(),
+            'circuit_breaker': MoralisCircuitBreaker.stats(),
+        }
+
+    @classmethod
+    def to_moralis_chains(cls, chains):
+        """Convert chain names to a de-duplicated list of Moralis chain identifiers"""
+        moralis_chains = []
+        for chain in chains:
+            moralis_chain = cls.CHAIN_MAPPING.get(chain.lower(), chain)
+            if moralis_chain not in moralis_chains:
+                moralis_chains.append(moralis_chain)
+        return moralis_chains
+
+    @staticmethod
+    def extract_chain_balance(data, chain):
+        """
+        Pull the USD balance for a single chain out of a net worth response
+        Returns None if the response has no entry for that chain
+        """
+        chains = data.get('chains', []) if isinstance(data, dict) else []
+        if not isinstance(chains, list):
+            return None
+
+        chain_data = next((c for c in chains if isinstance(c, dict) and c.get('chain') == chain), None)
+        if not chain_data:
+            return None
+
+        balance_value = chain_data.get('balance_usd', 0)
+        if not balance_value and 'networth_usd' in chain_data:
+            balance_value = chain_data.get('networth_usd', 0)
+        return balance_value
+
+
+class WalletSyncService:
+    """Service for refreshing wallet balances from Moralis"""
+
+    @classmethod
+    def fetch_net_worths(cls, wallets, max_workers=None, allow_stale=False):
+        """
+        Fetch net worth for every wallet concurrently, with at most
+        max_workers (default settings.MORALIS_MAX_CONCURRENCY) calls in flight
+        Wallets sharing an address are fetched with one multi-chain call
+        allow_stale serves cache entries past their TTL while they refresh in the background
+        Yields tuple (wallet, success_bool, data_or_error_message, fetched_at) as each call completes
+        """
+        # Group wallets by address so every address costs a single Moralis call
+        wallets_by_address = {}
+        for wallet in wallets:
+            wallets_by_address.setdefault(wallet.address, []).append(wallet)
+
+        if not wallets_by_address:
+            return
+
+        max_workers = max_workers or getattr(settings, 'MORALIS_MAX_CONCURRENCY', 8)
+        max_workers = max(1, min(max_workers, len(wallets_by_address)))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='moralis-sync') as executor:
+            futures = {
+                executor.submit(cls._fetch_address, address, address_wallets, allow_stale): address
+                for address, address_wallets in wallets_by_address.items()
+            }
+            for future in as_completed(futures):
+                address = futures[future]
+                try:
+                    success, result, fetched_at = future.result()
+                except Exception as e:
+                    # Keep one failing address from aborting the rest of the sync
+                    logger.exception(f"Unexpected error fetching wallet {address}: {str(e)}")
+                    success, result, fetched_at = False, str(e), None
+                for wallet in wallets_by_address[address]:
+                    yield wallet, success, result, fetched_at
+
+    @classmethod
+    def refresh_wallets(cls, wallets, max_workers=None, allow_stale=False):
+        """
+        Fetch and store fresh balances for the given wallets (allow_stale as in fetch_net_worths)
+        Returns tuple (updated_wallets, failures) where failures is a list of (wallet, error_message)
+        """
+        updates, failures = cls.collect_updates(cls.fetch_net_worths(wallets, max_workers, allow_stale))
+        return cls.save_balances(updates), failures
+
+    @staticmethod
+    def stored_balances(fresh_wallets, stale_wallets):
+        """
+        The stored balances of all wallets, for answering a sync without calling Moralis
+        while its circuit breaker is open; stale wallets are marked as such
+        """
+        return [
+            {
+                'address': wallet.address,
+                'chain': wallet.chain,
+                'balance_usd': format_balance(wallet.balance_usd),
+                'synced_at': wallet.synced_at,
+                'stale': stale
+            }
+            for wallets, stale in ((fresh_wallets, False), (stale_wallets, True))
+            for wallet in wallets
+        ]
+
+    @staticmethod
+    def collect_updates(results):
+        """
+        Turn (wallet, success_bool, data_or_error_message, fetched_at) results into balance updates
+        Returns tuple (updates, failures) ready for save_balances
+        """
+        updates = []
+        failures = []
+        for wallet, success, result, fetched_at in results:
+            if not success or not isinstance(result, dict):
+                failures.append((wallet, str(result)))
+                continue
+
+            try:
+                balance_value = MoralisService.extract_chain_balance(result, wallet.chain)
+            except Exception as e:
+                logger.exception(f"Error processing wallet update: {str(e)}")
+                failures.append((wallet, str(e)))
+                continue
+
+            if balance_value is None:
+                failures.append((wallet, f"No data found for chain: {wallet.chain}"))
+                continue
+            updates.append((wallet, balance_value, datetime.fromtimestamp(fetched_at, tz=dt_timezone.utc)))
+        return updates, failures
+
+    @staticmethod
+    def _fetch_address(address, address_wallets, allow_stale=False):
+        """Fetch net worth for every chain tracked for one address"""
+        if len(address_wallets) == 1:
+            return MoralisService.get_wallet_net_worth_entry(
+                address, address_wallets[0].chain, allow_stale=allow_stale
+            )
+        return MoralisService.get_wallet_net_worth_entry(
+            address, chains=[wallet.chain for wallet in address_wallets], allow_stale=allow_stale
+        )
+
+    @classmethod
+    def other_chain_wallets(cls, address, chain):
+        """Already tracked wallets for this address on chains other than the given one"""
+        return list(Wallet.objects.filter(address=address).exclude(chain=chain))
+
+    @classmethod
+    def update_other_chains(cls, address, data, exclude_chain, wallets=None):
+        """
+        Update the balances of already tracked wallets for this address on other chains,
+        using the chain breakdown from a multi-chain net worth response
+        Pass wallets (from other_chain_wallets) to skip looking them up again
+        Returns the list of updated wallets
+        """
+        if wallets is None:
+            wallets = cls.other_chain_wallets(address, exclude_chain)
+        updates = []
+        for wallet in wallets:
+            balance_value = MoralisService.extract_chain_balance(data, wallet.chain)
+            if balance_value is not None:
+                updates.append((wallet, balance_value))
+        return cls.save_balances(updates)
+
+    @classmethod
+    def save_balances(cls, updates, synced=True):
+        """
+        Write new balances for many wallets in a single transaction
+        updates is a list of (wallet, balance_value) or (wallet, balance_value, fetched_at)
+        tuples; synced_at is set to fetched_at (when the data came from Moralis, possibly
+        from the cache) or to now, and data older than what is stored is not written
+        Pass synced=False for balances that didn't come from a Moralis sync (revaluations),
+        so synced_at keeps saying when the wallet was last fetched
+        Returns the list of synced wallets, with their stored balances where those were newer
+        """
+        if not updates:
+            return []
+
+        # synced_at is auto_now, which bulk_update doesn't apply, so set it explicitly
+        now = timezone.now()
+        with transaction.atomic(savepoint=False):
+            # Lock the rows (in id order, so concurrent syncs can't deadlock) and take the
+            # deltas from the stored balances: another sync of a shared wallet may have
+            # written since these instances were loaded
+            stored = {
+                wallet_id: (balance_usd, synced_at)
+                for wallet_id, balance_usd, synced_at in Wallet.objects.select_for_update()
+                .filter(id__in=[update[0].id for update in updates])
+                .order_by('id')
+                .values_list('id', 'balance_usd', 'synced_at')
+            }
+            synced_wallets = []
+            wallets = []
+            changes = []
+            for wallet, balance_value, *fetched_at in updates:
+                if wallet.id not in stored:
+                    # Deleted since it was loaded
+                    continue
+                stored_balance, stored_synced_at = stored[wallet.id]
+                synced_at = fetched_at[0] if fetched_at else now
+                if synced and stored_synced_at is not None and synced_at <= stored_synced_at:
+                    # A stale cache entry, or another sync stored newer data since: keep that
+                    wallet.balance_usd, wallet.synced_at = stored_balance, stored_synced_at
+                    synced_wallets.append(wallet)
+                    continue
+                changes.append((wallet, stored_balance, balance_value))
+                wallet.balance_usd = balance_value
+                if synced:
+                    wallet.synced_at = synced_at
+                wallets.append(wallet)
+                synced_wallets.append(wallet)
+
+            Wallet.objects.bulk_update(wallets, ['balance_usd', 'synced_at'] if synced else ['balance_usd'])
+            PortfolioService.apply_balance_changes(changes)
+            BalanceHistoryService.record(changes, recorded_at=now)
+        return synced_wallets
+
+    @classmethod
+    def add_wallet(cls, user, address, chain, balance_value):
+        """
+        Create or update the wallet and link it to the user in one transaction
+        The wallet is upserted on its (address, chain) constraint and duplicates are
+        caught by the (user, wallet) constraint, so there's no separate existence check
+        Returns tuple (wallet, created); raises WalletAlreadyAdded for a duplicate
+        """
+        try:
+            with transaction.atomic():
+                # Current balance (and a row lock) for the portfolio deltas and history
+                previous = Wallet.objects.select_for_update().filter(address=address, chain=chain).first()
+                wallet = Wallet.objects.bulk_create(
+                    [Wallet(address=address, chain=chain, balance_usd=balance_value)],
+                    update_conflicts=True,
+                    unique_fields=['address', 'chain'],
+                    update_fields=['balance_usd', 'synced_at'],
+                )[0]
+                # Other followers' totals move by the balance change (before this user is linked)
+                if previous is not None:
+                    PortfolioService.apply_balance_changes([(wallet, previous.balance_usd, balance_value)])
+                # The only unique constraint that can fail in this block
+                WalletUser.objects.create(user=user, wallet=wallet)
+                BalanceHistoryService.record([(wallet, previous.balance_usd if previous else None, balance_value)])
+                PortfolioService.link_added(user.id, wallet)
+        except IntegrityError:
+            raise WalletAlreadyAdded(f"Wallet {address} ({chain}) is already in this portfolio")
+        return wallet, previous is None
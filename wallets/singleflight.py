@@ -0,0 +1,139 @@
+# wallet/singleflight.py
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """One in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the
+    function and everyone else arriving before it finishes gets the same result.
+    With MORALIS_SINGLEFLIGHT_CROSS_PROCESS enabled the leader also takes a lock
+    in the shared Django cache, so other processes wait for its result instead
+    of repeating the call.
+    """
+
+    _lock = threading.Lock()
+    _calls = {}
+    _async_calls = {}
+    _stats = {'calls': 0, 'coalesced': 0, 'cross_process_waits': 0}
+
+    @classmethod
+    def do(cls, key, fn, peek=None):
+        """
+        Run fn() once for all concurrent callers with the same key
+        peek, if given, returns the result published by another process (or None);
+        it is only used by the cross-process variant
+        """
+        with cls._lock:
+            call = cls._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                cls._calls[key] = call
+                cls._stats['calls'] += 1
+            else:
+                cls._stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if getattr(settings, 'MORALIS_SINGLEFLIGHT_CROSS_PROCESS', False):
+                call.result = cls._do_cross_process(key, fn, peek)
+            else:
+                call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with cls._lock:
+                cls._calls.pop(key, None)
+            call.done.set()
+
+    @classmethod
+    def _do_cross_process(cls, key, fn, peek):
+        """Hold a cache lock while calling fn, or wait for the process that holds it"""
+        store = caches[getattr(settings, 'MORALIS_CACHE_ALIAS', 'default')]
+        lock_key = f"singleflight:{key}"
+        lock_timeout = getattr(settings, 'MORALIS_READ_TIMEOUT', 15) * 2
+        poll_interval = getattr(settings, 'MORALIS_SINGLEFLIGHT_POLL_INTERVAL', 0.05)
+        deadline = time.monotonic() + lock_timeout
+
+        while True:
+            if store.add(lock_key, True, lock_timeout):
+                try:
+                    return fn()
+                finally:
+                    store.delete(lock_key)
+
+            # Another process is making this call: wait for its result to be published
+            with cls._lock:
+                cls._stats['cross_process_waits'] += 1
+            time.sleep(poll_interval)
+            if peek is not None:
+                result = peek()
+                if result is not None:
+                    return result
+            if time.monotonic() >= deadline:
+                logger.warning(f"Timed out waiting on another process for {key}, calling directly")
+                return fn()
+
+    @classmethod
+    async def ado(cls, key, afn):
+        """
+        Async version of do(): concurrent awaits of afn() with the same key on one
+        event loop share a single call (the cross-process lock isn't used here)
+        """
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        with cls._lock:
+            future = cls._async_calls.get(inflight_key)
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                cls._async_calls[inflight_key] = future
+                cls._stats['calls'] += 1
+            else:
+                cls._stats['coalesced'] += 1
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            result = await afn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            with cls._lock:
+                cls._async_calls.pop(inflight_key, None)
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return dict(cls._stats)
@@ -0,0 +1,106 @@
+# wallet/streaming.py
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from .portfolio import format_balance
+
+# Streaming formats for the sync endpoint, selected with ?stream=<format>
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+def frame(stream_format, event, data):
+    """Encode one event as an NDJSON line or an SSE message"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+    return json.dumps({'type': event, **data}, cls=DjangoJSONEncoder) + '\n'
+
+
+def wallet_frame(stream_format, wallet, balance_usd, fresh=False, stale=False):
+    data = {
+        'address': wallet.address,
+        'chain': wallet.chain,
+        'balance_usd': format_balance(balance_usd),
+        'fresh': fresh,
+    }
+    if stale:
+        # Stored balance sent while Moralis is unavailable
+        data.update(stale=True, synced_at=wallet.synced_at)
+    return frame(stream_format, 'wallet', data)
+
+
+def error_frame(stream_format, wallet, error):
+    return frame(stream_format, 'error', {
+        'address': wallet.address,
+        'chain': wallet.chain,
+        'error': error,
+    })
+
+
+def summary_frame(stream_format, fresh, updated, failed, stale=0):
+    data = {
+        'count': fresh + updated + stale,
+        'fresh': fresh,
+        'updated': updated,
+        'failed': failed,
+    }
+    if stale:
+        data['stale'] = stale
+    return frame(stream_format, 'summary', data)
+
+
+def stored_frames(stream_format, fresh_wallets, stale_wallets):
+    """Frames for the stored balances of all wallets, sent instead of syncing while Moralis is unavailable"""
+    frames = [wallet_frame(stream_format, wallet, wallet.balance_usd, fresh=True) for wallet in fresh_wallets]
+    frames += [wallet_frame(stream_format, wallet, wallet.balance_usd, stale=True) for wallet in stale_wallets]
+    frames.append(summary_frame(stream_format, len(fresh_wallets), 0, 0, stale=len(stale_wallets)))
+    return frames
+
+
+def stream_format_for(request):
+    """
+    Return the streaming format requested with ?stream=ndjson|sse (or an
+    Accept: text/event-stream header), None for a regular response, or False if unsupported
+    """
+    stream_format = request.GET.get('stream')
+    if stream_format is None:
+        return 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else None
+    return stream_format if stream_format in CONTENT_TYPES else False
+
+
+def stream_response(stream_format, frames):
+    """Wrap a (sync or async) iterator of frames in an unbuffered streaming response"""
+    response = StreamingHttpResponse(frames, content_type=CONTENT_TYPES[stream_format])
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from holding frames back until the response ends
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class StreamRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept streaming clients (EventSource always
+    sends Accept: text/event-stream); plain responses such as errors go out as a single frame
+    """
+    stream_format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        response = (renderer_context or {}).get('response')
+        event = 'error' if response is not None and response.status_code >= 400 else 'message'
+        return frame(self.stream_format, event, data if isinstance(data, dict) else {'data': data}).encode()
+
+
+class EventStreamRenderer(StreamRenderer):
+    media_type = CONTENT_TYPES['sse']
+    format = 'sse'
+    stream_format = 'sse'
+
+
+class NDJSONRenderer(StreamRenderer):
+    media_type = CONTENT_TYPES['ndjson']
+    format = 'ndjson'
+    stream_format = 'ndjson'
@@ -1,3 +1,1387 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from email.utils import format_datetime
+from unittest import mock
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from backend import metrics
+from users.authentication import USER_CLAIMS, UserCache
+from . import async_views
+from .async_client import AsyncMoralisService
+from .benchmarks.harness import create_users
+from .cache import NetWorthCache
+from .circuit import MoralisCircuitBreaker
+from .history import BalanceHistoryService
+from .holdings import HoldingsService
+from .http import MoralisHttpClient
+from .models import (
+    PortfolioSummary, RequestProfile, SyncJob, TokenHolding, TokenPrice, Wallet, WalletBalanceSnapshot, WalletUser,
+)
+from .portfolio import PortfolioService
+from .ratelimit import MoralisRateLimiter
+from .scheduler import RefreshScheduler
+from .prices import NATIVE_TOKEN, WRAPPED_NATIVE_TOKENS, PriceService
+from .queue import SyncQueue
+from .services import MoralisService, WalletSyncService
+from .singleflight import SingleFlight
 
-# Create your tests here.
+ADDRESS = '0x' + 'a' * 40
+
+
+def net_worth(*balances):
+    """A Moralis net worth response with the given (chain, balance) pairs"""
+    return True, {'chains': [{'chain': chain, 'networth_usd': balance} for chain, balance in balances]}
+
+
+def fetched_now(*balances):
+    """Side effect for MoralisService.get_wallet_net_worth_entry: the given balances, fetched just now"""
+    return lambda *args, **kwargs: (*net_worth(*balances), time.time())
+
+
+class AddWalletTests(TestCase):
+    """The add path upserts and links in one transaction with a fixed number of queries"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.other = User.objects.create_user(username='bob', email='bob@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        PortfolioService.get_summary(self.user.id)
+
+    def add(self, chain='eth'):
+        return self.client.post('/api/wallets/add/', {'address': ADDRESS, 'chain': chain}, format='json')
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '100.00')))
+    def test_add_new_wallet(self, _):
+        # look up the address on other chains, then begin, select wallet, upsert wallet,
+        # insert link, insert snapshot, lock summary, update summary, commit
+        with self.assertNumQueries(9):
+            response = self.add()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['balance_usd'], '100.00')
+        wallet = Wallet.objects.get(address=ADDRESS, chain='eth')
+        self.assertTrue(WalletUser.objects.filter(user=self.user, wallet=wallet).exists())
+        self.assertEqual(WalletBalanceSnapshot.objects.filter(wallet=wallet).count(), 1)
+        summary = PortfolioSummary.objects.get(user=self.user)
+        self.assertEqual(str(summary.total_usd), '100.00')
+        self.assertEqual(summary.wallet_count, 1)
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '150.00')))
+    def test_add_wallet_followed_by_another_user(self, _):
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        WalletUser.objects.create(user=self.other, wallet=wallet)
+        PortfolioService.get_summary(self.other.id)
+
+        # as above, plus finding the other followers and locking and updating their summaries
+        with self.assertNumQueries(12):
+            response = self.add()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(str(Wallet.objects.get(pk=wallet.pk).balance_usd), '150.00')
+        self.assertEqual(str(PortfolioSummary.objects.get(user=self.other).total_usd), '150.00')
+        self.assertEqual(str(PortfolioSummary.objects.get(user=self.user).total_usd), '150.00')
+
+    def test_fetches_only_the_requested_and_tracked_chains(self):
+        Wallet.objects.create(address=ADDRESS, chain='polygon', balance_usd='5.00')
+        Wallet.objects.create(address='0x' + 'b' * 40, chain='bsc', balance_usd='5.00')
+
+        with mock.patch.object(
+            MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '100.00'), ('polygon', '7.00'))
+        ) as get_net_worth:
+            response = self.add()
+
+        self.assertEqual(response.status_code, 201)
+        get_net_worth.assert_called_once_with(ADDRESS, chains=['eth', 'polygon'])
+        self.assertEqual(str(Wallet.objects.get(address=ADDRESS, chain='polygon').balance_usd), '7.00')
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '100.00')))
+    def test_duplicate_is_rejected_by_the_constraint(self, _):
+        self.add()
+        with mock.patch.object(MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '250.00'))):
+            response = self.add()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.data['errors'])
+        self.assertEqual(WalletUser.objects.filter(user=self.user).count(), 1)
+        # The whole transaction is rolled back, balance and totals included
+        self.assertEqual(str(Wallet.objects.get(address=ADDRESS).balance_usd), '100.00')
+        summary = PortfolioSummary.objects.get(user=self.user)
+        self.assertEqual((str(summary.total_usd), summary.wallet_count), ('100.00', 1))
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth', return_value=net_worth(('eth', '100.00')))
+    def test_address_is_stored_in_canonical_form(self, _):
+        response = self.client.post('/api/wallets/add/', {'address': ADDRESS.upper().replace('0X', '0x'), 'chain': 'ETH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['address'], ADDRESS)
+
+        # A differently cased copy is the same wallet, for adding and removing alike
+        self.assertEqual(self.add().status_code, 400)
+        response = self.client.post('/api/wallets/remove/', {'address': ADDRESS.upper(), 'chain': 'eth'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Wallet.objects.count(), 1)
+
+
+def chain_net_worth(address, chain=None, chains=None, allow_stale=False):
+    """A Moralis net worth response of 10.00 on every chain asked for, fetched just now"""
+    return (*net_worth(*[(name, '10.00') for name in ([chain] if chain else chains)]), time.time())
+
+
+@mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=chain_net_worth)
+class ImportWalletTests(TestCase):
+    """Imports batch every write, so the query count doesn't grow with the number of rows"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        PortfolioService.get_summary(self.user.id)
+
+    def rows(self, count, start=0):
+        return [
+            {'address': '0x' + f"{index:040x}", 'chain': chain}
+            for index in range(start, start + count)
+            for chain in ('eth', 'polygon')
+        ]
+
+    def import_rows(self, rows):
+        return self.client.post('/api/wallets/import/', rows, format='json')
+
+    def test_query_count_does_not_grow_with_rows(self, _):
+        # existing lookup, then begin, bulk insert wallets, read back their ids, insert
+        # snapshots, insert links, lock summary, update summary, commit
+        with self.assertNumQueries(9):
+            small = self.import_rows(self.rows(5))
+        with self.assertNumQueries(9):
+            large = self.import_rows(self.rows(50, start=5))
+
+        self.assertEqual(small.json()['counts'], {'created': 10})
+        self.assertEqual(large.json()['counts'], {'created': 100})
+        summary = PortfolioSummary.objects.get(user=self.user)
+        self.assertEqual((str(summary.total_usd), summary.wallet_count), ('1100.00', 110))
+
+    def test_mixed_rows_get_one_status_each(self, _):
+        followed = Wallet.objects.create(address='0x' + 'b' * 40, chain='eth', balance_usd='1.00')
+        WalletUser.objects.create(user=self.user, wallet=followed)
+        Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='1.00')
+        rows = [
+            {'address': ADDRESS, 'chain': 'eth'},
+            {'address': ADDRESS.upper().replace('0X', '0x'), 'chain': 'eth'},
+            {'address': followed.address, 'chain': 'eth'},
+            {'address': 'not-an-address', 'chain': 'eth'},
+        ] + self.rows(2)
+
+        response = self.import_rows(rows)
+
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']],
+            ['linked', 'duplicate', 'exists', 'invalid', 'created', 'created', 'created', 'created']
+        )
+        self.assertEqual(str(Wallet.objects.get(address=ADDRESS).balance_usd), '10.00')
+        self.assertEqual(WalletUser.objects.filter(user=self.user).count(), 6)
+
+
+class SyncQueueTests(TestCase):
+    """Workers claim due jobs once, retry failures with backoff and dead-letter them in the end"""
+
+    def setUp(self):
+        self.wallets = [
+            Wallet.objects.create(address='0x' + f"{index:040x}", chain='eth', balance_usd='1.00')
+            for index in range(3)
+        ]
+        SyncQueue.enqueue(self.wallets)
+
+    def test_enqueue_skips_wallets_with_an_active_job(self):
+        SyncQueue.enqueue(self.wallets)
+        self.assertEqual(SyncJob.objects.count(), 3)
+
+    def test_claim_takes_due_pending_jobs_once(self):
+        SyncJob.objects.filter(address=self.wallets[2].address).update(
+            available_at=timezone.now() + timedelta(minutes=1)
+        )
+
+        jobs = SyncQueue.claim(batch_size=10)
+
+        self.assertEqual(sorted(job.address for job in jobs), [wallet.address for wallet in self.wallets[:2]])
+        self.assertEqual(
+            set(SyncJob.objects.filter(id__in=[job.id for job in jobs]).values_list('status', 'attempts')),
+            {(SyncJob.STATUS_RUNNING, 1)}
+        )
+        # Running jobs and jobs not yet due stay put for other workers
+        self.assertEqual(SyncQueue.claim(batch_size=10), [])
+
+    def test_claim_respects_the_batch_size(self):
+        self.assertEqual(len(SyncQueue.claim(batch_size=2)), 2)
+        self.assertEqual(len(SyncQueue.claim(batch_size=2)), 1)
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=fetched_now(('eth', '2.00')))
+    def test_finished_jobs_are_removed(self, _):
+        self.assertEqual(SyncQueue.process_batch(), (3, 0))
+        self.assertFalse(SyncJob.objects.exists())
+        self.assertEqual(str(Wallet.objects.get(pk=self.wallets[0].pk).balance_usd), '2.00')
+
+    @override_settings(SYNC_JOB_RETRY_BACKOFF=10)
+    @mock.patch('wallets.queue.random.uniform', return_value=1.0)
+    def test_failures_back_off_exponentially(self, _):
+        job = SyncJob.objects.get(address=self.wallets[0].address)
+        for attempts, delay in ((1, 10), (2, 20), (3, 40)):
+            job.attempts = attempts
+            before = timezone.now()
+            with self.assertLogs('wallets.queue', 'WARNING'):
+                SyncQueue.fail(job, 'boom')
+
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.last_error, job.locked_at), (SyncJob.STATUS_PENDING, 'boom', None))
+            self.assertGreaterEqual(job.available_at, before + timedelta(seconds=delay))
+            self.assertLessEqual(job.available_at, timezone.now() + timedelta(seconds=delay))
+
+    @override_settings(SYNC_JOB_MAX_ATTEMPTS=2)
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', return_value=(False, 'boom', None))
+    def test_jobs_are_dead_lettered_after_max_attempts(self, _):
+        with self.assertLogs('wallets.queue', 'WARNING'):
+            self.assertEqual(SyncQueue.process_batch(), (0, 3))
+        self.assertEqual(set(SyncJob.objects.values_list('status', 'attempts')), {(SyncJob.STATUS_PENDING, 1)})
+
+        SyncJob.objects.update(available_at=timezone.now())
+        with self.assertLogs('wallets.queue', 'ERROR'):
+            self.assertEqual(SyncQueue.process_batch(), (0, 3))
+        self.assertEqual(set(SyncJob.objects.values_list('status', 'attempts')), {(SyncJob.STATUS_DEAD, 2)})
+
+        # Dead jobs are never claimed again, and don't block a fresh enqueue
+        self.assertEqual(SyncQueue.claim(), [])
+        SyncQueue.enqueue(self.wallets[:1])
+        self.assertEqual(SyncJob.objects.filter(status=SyncJob.STATUS_PENDING).count(), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class SyncQueueConcurrencyTests(TransactionTestCase):
+    """A worker skips jobs another worker has locked instead of waiting for them"""
+
+    def test_claim_skips_locked_jobs(self):
+        wallets = [Wallet.objects.create(address='0x' + f"{index:040x}", chain='eth') for index in range(2)]
+        SyncQueue.enqueue(wallets)
+        locked = SyncJob.objects.get(address=wallets[0].address)
+        claimed = []
+
+        def claim_elsewhere():
+            try:
+                claimed.extend(SyncQueue.claim(batch_size=10))
+            finally:
+                connections.close_all()
+
+        with transaction.atomic():
+            SyncJob.objects.select_for_update().get(pk=locked.pk)
+            worker = threading.Thread(target=claim_elsewhere)
+            worker.start()
+            worker.join(timeout=10)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual([job.address for job in claimed], [wallets[1].address])
+
+
+class SyncResponseTests(TestCase):
+    """Sync returns every balance as a cents string, whether it was fresh or just fetched"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for address, synced_ago in ((ADDRESS, timedelta(0)), ('0x' + 'b' * 40, timedelta(hours=1))):
+            wallet = Wallet.objects.create(address=address, chain='eth', balance_usd='100.00')
+            Wallet.objects.filter(id=wallet.id).update(synced_at=timezone.now() - synced_ago)
+            WalletUser.objects.create(user=self.user, wallet=wallet)
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=fetched_now(('eth', '123.456')))
+    def test_fresh_and_updated_balances_have_one_format(self, _):
+        response = self.client.get('/api/wallets/sync/')
+        self.assertEqual([wallet['balance_usd'] for wallet in response.json()['wallets']], ['100.00', '123.46'])
+
+    @override_settings(WALLET_SYNC_USE_QUEUE=True)
+    def test_queued_sync_balances_are_strings(self):
+        response = self.client.get('/api/wallets/sync/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([wallet['balance_usd'] for wallet in response.json()['wallets']], ['100.00', '100.00'])
+
+
+class SyncQueryCountTests(TestCase):
+    """Syncing costs the same number of queries however many wallets are stale"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        PortfolioSummary.objects.create(user=self.user)
+        response = self.client.post('/api/users/token/', {'email': 'alice@example.com', 'password': 'pw'})
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {response.data['access']}"}
+
+    def add_stale_wallets(self, count):
+        wallets = [Wallet.objects.create(address='0x' + f"{index:040x}", chain='eth', balance_usd='1.00') for index in range(count)]
+        Wallet.objects.filter(id__in=[wallet.id for wallet in wallets]).update(synced_at=timezone.now() - timedelta(hours=1))
+        WalletUser.objects.bulk_create(WalletUser(user=self.user, wallet=wallet) for wallet in wallets)
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=fetched_now(('eth', '2.00')))
+    def test_query_count_does_not_grow_with_the_wallet_count(self, _):
+        for count in (3, 30):
+            Wallet.objects.all().delete()
+            self.add_stale_wallets(count)
+            with self.subTest(wallets=count), self.assertNumQueries(7):
+                response = self.client.get('/api/wallets/sync/', **self.auth)
+            self.assertEqual(len(response.json()['wallets']), count)
+            self.assertEqual({wallet['balance_usd'] for wallet in response.json()['wallets']}, {'2.00'})
+
+
+class StreamingSyncTests(TestCase):
+    """Streamed syncs send one frame per wallet and keep what was fetched if the client leaves"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.fresh = Wallet.objects.create(address='0x' + 'c' * 40, chain='eth', balance_usd='5.00')
+        self.stale = []
+        for address in (ADDRESS, '0x' + 'b' * 40):
+            wallet = Wallet.objects.create(address=address, chain='eth', balance_usd='1.00')
+            Wallet.objects.filter(id=wallet.id).update(synced_at=timezone.now() - timedelta(hours=1))
+            self.stale.append(wallet)
+        for wallet in [self.fresh] + self.stale:
+            WalletUser.objects.create(user=self.user, wallet=wallet)
+
+    def fetched(self, wallets):
+        """Moralis results for the stale wallets, in a fixed order"""
+        by_address = {wallet.address: wallet for wallet in wallets}
+        return [
+            (by_address[wallet.address], *net_worth(('eth', balance)), time.time())
+            for wallet, balance in zip(self.stale, ('10.00', '20.00'))
+        ]
+
+    def fake_fetch(self, wallets, max_workers=None, allow_stale=False):
+        yield from self.fetched(wallets)
+
+    async def fake_afetch(self, wallets, allow_stale=False):
+        for result in self.fetched(wallets):
+            yield result
+
+    def stream(self, stream_format):
+        with mock.patch.object(WalletSyncService, 'fetch_net_worths', self.fake_fetch):
+            response = self.client.get(f'/api/wallets/sync/?stream={stream_format}')
+            return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_frames(self):
+        response, body = self.stream('ndjson')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        frames = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(
+            [(frame['type'], frame.get('balance_usd'), frame.get('fresh')) for frame in frames],
+            [('wallet', '5.00', True), ('wallet', '10.00', False), ('wallet', '20.00', False), ('summary', None, 1)]
+        )
+        self.assertEqual(frames[-1], {'type': 'summary', 'count': 3, 'fresh': 1, 'updated': 2, 'failed': 0})
+        self.assertEqual(str(Wallet.objects.get(pk=self.stale[1].pk).balance_usd), '20.00')
+
+    def test_sse_frames(self):
+        response, body = self.stream('sse')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = [message.split('\n') for message in body.split('\n\n') if message]
+        self.assertEqual([event for event, _ in messages], ['event: wallet'] * 3 + ['event: summary'])
+        self.assertEqual(json.loads(messages[1][1].removeprefix('data: '))['balance_usd'], '10.00')
+        self.assertEqual(
+            json.loads(messages[-1][1].removeprefix('data: ')),
+            {'count': 3, 'fresh': 1, 'updated': 2, 'failed': 0}
+        )
+
+    def test_unsupported_format_is_rejected(self):
+        self.assertEqual(self.client.get('/api/wallets/sync/?stream=xml').status_code, 400)
+
+    def test_disconnect_keeps_fetched_balances(self):
+        with mock.patch.object(WalletSyncService, 'fetch_net_worths', self.fake_fetch):
+            response = self.client.get('/api/wallets/sync/?stream=ndjson')
+            frames = iter(response.streaming_content)
+            next(frames)
+            next(frames)
+            response.close()
+
+        self.assertEqual(str(Wallet.objects.get(pk=self.stale[0].pk).balance_usd), '10.00')
+        self.assertEqual(str(Wallet.objects.get(pk=self.stale[1].pk).balance_usd), '1.00')
+
+    def test_async_disconnect_keeps_fetched_balances(self):
+        async def sync_then_leave():
+            frames = async_views.stream_sync('ndjson', [self.fresh], list(self.stale))
+            await frames.__anext__()
+            await frames.__anext__()
+            await frames.aclose()
+
+        with mock.patch.object(AsyncMoralisService, 'fetch_net_worths', self.fake_afetch):
+            async_to_sync(sync_then_leave)()
+
+        self.assertEqual(str(Wallet.objects.get(pk=self.stale[0].pk).balance_usd), '10.00')
+        self.assertEqual(str(Wallet.objects.get(pk=self.stale[1].pk).balance_usd), '1.00')
+
+    def test_disconnect_during_the_summary_saves_once(self):
+        with mock.patch.object(WalletSyncService, 'fetch_net_worths', self.fake_fetch), \
+                mock.patch.object(WalletSyncService, 'save_balances', wraps=WalletSyncService.save_balances) as save:
+            response = self.client.get('/api/wallets/sync/?stream=ndjson')
+            frames = list(itertools.islice(response.streaming_content, 4))
+            response.close()
+
+        self.assertEqual(json.loads(frames[-1])['type'], 'summary')
+        self.assertEqual(len([call for call in save.call_args_list if call.args[0]]), 1)
+
+    def test_async_disconnect_during_the_summary_saves_once(self):
+        async def sync_then_leave():
+            frames = async_views.stream_sync('ndjson', [self.fresh], list(self.stale))
+            for _ in range(4):
+                last = await frames.__anext__()
+            await frames.aclose()
+            return last
+
+        with mock.patch.object(AsyncMoralisService, 'fetch_net_worths', self.fake_afetch), \
+                mock.patch.object(WalletSyncService, 'save_balances', wraps=WalletSyncService.save_balances) as save:
+            summary = async_to_sync(sync_then_leave)()
+
+        self.assertEqual(json.loads(summary)['type'], 'summary')
+        self.assertEqual(len([call for call in save.call_args_list if call.args[0]]), 1)
+
+
+class ConditionalGetTests(TestCase):
+    """Wallet listings answer 304 until a wallet or its balance changes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='1.00')
+        WalletUser.objects.create(user=self.user, wallet=self.wallet)
+
+    def list_wallets(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get('/api/wallets/add/', headers=headers)
+
+    def test_matching_etag_answers_304(self):
+        etag = self.list_wallets()['ETag']
+
+        response = self.list_wallets(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        # Weak comparison: the strong form of the same tag matches too
+        self.assertEqual(self.list_wallets(etag.removeprefix('W/')).status_code, 304)
+
+    def test_etag_changes_after_a_balance_update(self):
+        etag = self.list_wallets()['ETag']
+        WalletSyncService.save_balances([(self.wallet, '2.00')])
+
+        response = self.list_wallets(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['balance_usd'], '2.00')
+
+    def test_etag_changes_after_a_revaluation(self):
+        etag = self.list_wallets()['ETag']
+        WalletSyncService.save_balances([(self.wallet, '3.00')], synced=False)
+
+        self.assertEqual(self.list_wallets(etag).status_code, 200)
+
+    def test_etag_changes_when_a_wallet_is_linked(self):
+        etag = self.list_wallets()['ETag']
+        other = Wallet.objects.create(address='0x' + 'b' * 40, chain='eth', balance_usd='1.00')
+        WalletUser.objects.create(user=self.user, wallet=other)
+
+        self.assertEqual(self.list_wallets(etag).status_code, 200)
+
+    def test_supported_chains_answer_304(self):
+        etag = self.client.get('/api/wallets/supported_chains/')['ETag']
+        self.assertEqual(self.client.get('/api/wallets/supported_chains/', headers={'If-None-Match': etag}).status_code, 304)
+
+
+class SaveBalancesTests(TestCase):
+    """Portfolio deltas come from the stored balance, not the caller's copy of the wallet"""
+
+    def test_overlapping_syncs_of_a_shared_wallet_keep_totals_exact(self):
+        users = [get_user_model().objects.create_user(email=f'{name}@example.com', password='pw') for name in ('alice', 'bob')]
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        for user in users:
+            WalletUser.objects.create(user=user, wallet=wallet)
+            PortfolioService.get_summary(user.id)
+
+        # Both followers' syncs loaded the wallet before either wrote
+        first, second = Wallet.objects.get(), Wallet.objects.get()
+        WalletSyncService.save_balances([(first, '150.00')])
+        WalletSyncService.save_balances([(second, '200.00')])
+
+        for user in users:
+            self.assertEqual(str(PortfolioSummary.objects.get(user=user).total_usd), '200.00')
+        self.assertEqual(
+            list(WalletBalanceSnapshot.objects.order_by('id').values_list('balance_usd', flat=True)),
+            [Decimal('150.00'), Decimal('200.00')]
+        )
+
+
+@override_settings(WALLET_REFRESH_TIERS=[
+    {'name': 'hot', 'min_balance_usd': 100000, 'min_followers': 10, 'interval': 5 * 60},
+    {'name': 'cold', 'min_balance_usd': 0, 'min_followers': 0, 'interval': 6 * 60 * 60},
+])
+class CanonicalAddressMigrationTests(TransactionTestCase):
+    """0006 merges wallets that only differ in case or whitespace into one canonical row"""
+
+    migrate_from = [('wallets', '0005_requestprofile')]
+    migrate_to = [('wallets', '0006_canonical_addresses')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.addCleanup(self.migrate_to_latest)
+        self.executor.migrate(self.migrate_from)
+        self.executor.loader.build_graph()
+        self.apps = self.executor.loader.project_state(self.migrate_from).apps
+
+    def migrate_to_latest(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.migrate_to)
+        return self.executor.loader.project_state(self.migrate_to).apps
+
+    def test_duplicates_merge_into_the_most_recently_synced_row(self):
+        Wallet = self.apps.get_model('wallets', 'Wallet')
+        WalletUser = self.apps.get_model('wallets', 'WalletUser')
+        WalletBalanceSnapshot = self.apps.get_model('wallets', 'WalletBalanceSnapshot')
+        PortfolioSummary = self.apps.get_model('wallets', 'PortfolioSummary')
+        alice = get_user_model().objects.create_user(username='alice', email='alice@example.com', password='x')
+        bob = get_user_model().objects.create_user(username='bob', email='bob@example.com', password='x')
+
+        now = timezone.now()
+        recent = Wallet.objects.create(address=' 0xABC ', chain='ETH', balance_usd=Decimal('100'))
+        older = Wallet.objects.create(address='0xabc', chain='eth', balance_usd=Decimal('90'))
+        other = Wallet.objects.create(address='0xdef', chain='polygon', balance_usd=Decimal('5'))
+        # auto_now would overwrite synced_at on save()
+        Wallet.objects.filter(pk=recent.pk).update(synced_at=now)
+        Wallet.objects.filter(pk=older.pk).update(synced_at=now - timedelta(hours=1))
+        Wallet.objects.filter(pk=other.pk).update(synced_at=now - timedelta(hours=2))
+        for user_id, wallet in ((alice.pk, recent), (alice.pk, older), (alice.pk, other), (bob.pk, older)):
+            WalletUser.objects.create(user_id=user_id, wallet_id=wallet.pk)
+        WalletBalanceSnapshot.objects.create(wallet_id=older.pk, balance_usd=Decimal('90'))
+        for user in (alice, bob):
+            PortfolioSummary.objects.create(user_id=user.pk, total_usd=Decimal('195'), wallet_count=3)
+
+        apps = self.migrate()
+        Wallet = apps.get_model('wallets', 'Wallet')
+        WalletUser = apps.get_model('wallets', 'WalletUser')
+        WalletBalanceSnapshot = apps.get_model('wallets', 'WalletBalanceSnapshot')
+        PortfolioSummary = apps.get_model('wallets', 'PortfolioSummary')
+
+        keeper = Wallet.objects.get(chain='eth')
+        self.assertEqual(keeper.pk, recent.pk)
+        self.assertEqual((keeper.address, keeper.balance_usd, keeper.synced_at), ('0xabc', Decimal('100'), now))
+        self.assertFalse(Wallet.objects.filter(pk=older.pk).exists())
+        self.assertEqual(
+            sorted(WalletUser.objects.values_list('user_id', 'wallet_id')),
+            sorted([(alice.pk, keeper.pk), (alice.pk, other.pk), (bob.pk, keeper.pk)]),
+        )
+        self.assertEqual(list(WalletBalanceSnapshot.objects.values_list('wallet_id', flat=True)), [keeper.pk])
+
+        summary = PortfolioSummary.objects.get(user_id=alice.pk)
+        self.assertEqual(summary.total_usd, Decimal('105.00'))
+        self.assertEqual(summary.chain_totals, {'eth': '100.00', 'polygon': '5.00'})
+        self.assertEqual((summary.wallet_count, summary.last_synced_at), (2, now))
+        summary = PortfolioSummary.objects.get(user_id=bob.pk)
+        self.assertEqual(summary.total_usd, Decimal('100.00'))
+        self.assertEqual(summary.chain_totals, {'eth': '100.00'})
+        self.assertEqual((summary.wallet_count, summary.last_synced_at), (1, now))
+
+
+class RefreshSchedulerTests(TestCase):
+    """Due wallets are picked by how long they have been due, not by how long ago they synced"""
+
+    def test_overdue_hot_wallet_goes_before_a_recently_due_cold_one(self):
+        user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        now = timezone.now()
+        for address, balance, synced_ago in (
+            (ADDRESS, '10.00', timedelta(hours=6, minutes=10)),
+            ('0x' + 'b' * 40, '500000.00', timedelta(minutes=30)),
+            ('0x' + 'c' * 40, '500000.00', timedelta(minutes=1)),
+        ):
+            wallet = Wallet.objects.create(address=address, chain='eth', balance_usd=balance)
+            Wallet.objects.filter(id=wallet.id).update(synced_at=now - synced_ago)
+            WalletUser.objects.create(user=user, wallet=wallet)
+
+        self.assertEqual(
+            [wallet.address for wallet in RefreshScheduler.due_wallets_query(now)],
+            ['0x' + 'b' * 40, ADDRESS]
+        )
+        self.assertEqual([wallet.address for wallet in RefreshScheduler.select_due(1)], ['0x' + 'b' * 40])
+
+
+class RefreshAllWalletsTests(TestCase):
+    """The global pass refreshes each stale followed wallet once, whoever follows it"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user(email='alice@example.com', password='pw')
+        self.bob = User.objects.create_user(email='bob@example.com', password='pw')
+        stale = timezone.now() - timedelta(hours=1)
+        self.shared = self.wallet(ADDRESS, 'eth', stale, self.alice, self.bob)
+        self.shared_polygon = self.wallet(ADDRESS, 'polygon', stale, self.alice)
+        self.other = self.wallet('0x' + 'b' * 40, 'eth', stale, self.alice)
+        self.fresh = self.wallet('0x' + 'c' * 40, 'eth', timezone.now(), self.alice)
+        self.unfollowed = self.wallet('0x' + 'd' * 40, 'eth', stale)
+        PortfolioService.get_summary(self.bob.id)
+        self.calls = []
+
+    def wallet(self, address, chain, synced_at, *followers):
+        wallet = Wallet.objects.create(address=address, chain=chain, balance_usd='1.00')
+        Wallet.objects.filter(id=wallet.id).update(synced_at=synced_at)
+        for user in followers:
+            WalletUser.objects.create(user=user, wallet=wallet)
+        return wallet
+
+    def fake_net_worth(self, address, chain=None, chains=None, allow_stale=False):
+        self.calls.append(address)
+        if address == self.other.address:
+            return False, 'boom', None
+        return (*net_worth(*[(name, '9.00') for name in ([chain] if chain else chains)]), time.time())
+
+    def refresh(self, *args):
+        out = io.StringIO()
+        with mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=self.fake_net_worth):
+            with self.assertLogs('wallets.management.commands.refresh_all_wallets', 'WARNING'):
+                call_command('refresh_all_wallets', '--stale-after=60', *args, stdout=out)
+        return out.getvalue()
+
+    def balances(self):
+        return {
+            (wallet.address, wallet.chain): str(wallet.balance_usd)
+            for wallet in Wallet.objects.all()
+        }
+
+    def test_each_distinct_wallet_is_refreshed_once(self):
+        output = self.refresh()
+
+        # Both chains of the shared address in one call, the failing address in another
+        self.assertEqual(sorted(self.calls), [ADDRESS, self.other.address])
+        self.assertIn('3 wallets', output)
+        self.assertIn('2 updated, 1 failed', output)
+        # alice and bob each sync the shared address, and alice the other one
+        self.assertIn('Moralis calls: 2, against 3 through per-user syncs (1 saved)', output)
+        self.assertEqual(self.balances(), {
+            (ADDRESS, 'eth'): '9.00',
+            (ADDRESS, 'polygon'): '9.00',
+            (self.other.address, 'eth'): '1.00',
+            (self.fresh.address, 'eth'): '1.00',
+            (self.unfollowed.address, 'eth'): '1.00',
+        })
+        self.assertEqual(str(PortfolioSummary.objects.get(user=self.bob).total_usd), '9.00')
+
+    def test_batches_are_refreshed_separately(self):
+        output = self.refresh('--batch-size=1')
+
+        # Without a shared batch the two chains of the shared address cost a call each
+        self.assertEqual(sorted(self.calls), [ADDRESS, ADDRESS, self.other.address])
+        self.assertIn('2 updated, 1 failed', output)
+
+    def test_limit_takes_the_most_followed_wallet_first(self):
+        with mock.patch.object(MoralisService, 'get_wallet_net_worth_entry', side_effect=self.fake_net_worth):
+            call_command('refresh_all_wallets', '--stale-after=60', '--limit=1', stdout=io.StringIO())
+
+        self.assertEqual(self.calls, [ADDRESS])
+        self.assertEqual(self.balances()[(ADDRESS, 'eth')], '9.00')
+        self.assertEqual(self.balances()[(ADDRESS, 'polygon')], '1.00')
+
+    @override_settings(WALLET_SYNC_USE_QUEUE=True)
+    def test_queue_mode_enqueues_instead_of_calling_moralis(self):
+        with mock.patch.object(MoralisService, 'get_wallet_net_worth_entry') as get_net_worth:
+            call_command('refresh_all_wallets', '--stale-after=60', stdout=io.StringIO())
+
+        get_net_worth.assert_not_called()
+        self.assertEqual(
+            set(SyncJob.objects.values_list('address', 'chain')),
+            {(ADDRESS, 'eth'), (ADDRESS, 'polygon'), (self.other.address, 'eth')}
+        )
+
+
+class BalanceHistoryTests(TestCase):
+    """History is validated, averaged per bucket in SQL and carries unchanged balances forward"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.wallets = [Wallet.objects.create(address=address, chain='eth') for address in (ADDRESS, '0x' + 'b' * 40)]
+        for wallet in self.wallets:
+            WalletUser.objects.create(user=self.user, wallet=wallet)
+
+    def snapshot(self, wallet, days_ago, balance, hour=1):
+        day = BalanceHistoryService.truncate(timezone.now() - timedelta(days=days_ago), 'day')
+        WalletBalanceSnapshot.objects.create(wallet=wallet, recorded_at=day + timedelta(hours=hour), balance_usd=balance)
+
+    def test_rejects_unknown_ranges_and_intervals(self):
+        for query in ('range=2d', 'range=7d&interval=minute', 'range=1y&interval=hour'):
+            self.assertEqual(self.client.get(f'/api/wallets/history/?{query}').status_code, 400, query)
+
+    def test_daily_points_average_and_carry_forward(self):
+        self.snapshot(self.wallets[1], 10, '50.00')
+        self.snapshot(self.wallets[0], 3, '100.00')
+        self.snapshot(self.wallets[0], 1, '150.00', hour=1)
+        self.snapshot(self.wallets[0], 1, '250.00', hour=2)
+
+        # Opening balances, then the per-bucket averages
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/wallets/history/?range=7d&interval=day')
+
+        balances = [point['balance_usd'] for point in response.data['points']]
+        self.assertEqual(len(balances), 8)
+        self.assertEqual(balances[:4], ['50.00'] * 4)
+        self.assertEqual(balances[4:], ['150.00', '150.00', '250.00', '250.00'])
+
+
+class ClaimsAuthenticationTests(TestCase):
+    """Wallet endpoints authenticate from token claims; the profile endpoint uses a cached user"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        response = self.client.post('/api/users/token/', {'email': 'alice@example.com', 'password': 'pw'})
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {response.data['access']}"}
+
+    def test_wallet_list_skips_the_user_lookup(self):
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        WalletUser.objects.create(user=self.user, wallet=wallet)
+
+        # Only the listing itself
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/wallets/add/', **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['address'] for row in response.json()], [ADDRESS])
+
+    def test_benchmark_tokens_carry_the_user_claims(self):
+        token = create_users(1, 1)[0]
+        self.assertEqual(
+            {claim: AccessToken(token)[claim] for claim in USER_CLAIMS},
+            {'email': 'bench0@example.com', 'is_staff': False}
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/wallets/add/', HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_checks_use_the_current_user_not_the_token_claims(self):
+        self.user.is_staff = True
+        self.user.save()
+        UserCache.invalidate(self.user.pk)
+        response = self.client.post('/api/users/token/', {'email': 'alice@example.com', 'password': 'pw'})
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {response.data['access']}"}
+        self.assertEqual(self.client.get('/api/wallets/moralis/status/', **auth).status_code, 200)
+
+        # Demoted with the staff claim still in a valid token
+        self.user.is_staff = False
+        self.user.save()
+        UserCache.invalidate(self.user.pk)
+        self.assertEqual(self.client.get('/api/wallets/moralis/status/', **auth).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', **auth).status_code, 403)
+        # Wallet endpoints still take the user from the claims
+        self.assertEqual(self.client.get('/api/wallets/add/', **auth).status_code, 200)
+
+    def test_profile_update_invalidates_the_cached_user(self):
+        self.client.get('/api/users/me/', **self.auth)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/', **self.auth)
+        self.assertEqual(response.data['email'], 'alice@example.com')
+
+        self.client.put('/api/users/me/', {'email': 'alice@example.org'}, content_type='application/json', **self.auth)
+        response = self.client.get('/api/users/me/', **self.auth)
+        self.assertEqual(response.data['email'], 'alice@example.org')
+
+
+class NetWorthCacheTests(TestCase):
+    """Sync serves stale entries stamped with their age while one background refresh runs"""
+
+    def setUp(self):
+        NetWorthCache.clear()
+        self.addCleanup(NetWorthCache.clear)
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.fetched_at = time.time() - 120
+        NetWorthCache.get_backend().set(
+            NetWorthCache.make_key(ADDRESS, ['eth']),
+            {'data': net_worth(('eth', '200.00'))[1], 'fetched_at': self.fetched_at},
+            300
+        )
+
+    def join_refreshes(self):
+        for thread in threading.enumerate():
+            if thread.name == 'moralis-cache-refresh':
+                thread.join(timeout=5)
+
+    @override_settings(MORALIS_CACHE_BACKEND='local', MORALIS_CACHE_TTL=60, MORALIS_CACHE_STALE_TTL=300)
+    def test_sync_serves_a_stale_entry_and_refreshes_it_once(self):
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        Wallet.objects.filter(id=wallet.id).update(synced_at=timezone.now() - timedelta(hours=1))
+        WalletUser.objects.create(user=self.user, wallet=wallet)
+        release = threading.Event()
+
+        def slow_fetch(*args):
+            release.wait(5)
+            return net_worth(('eth', '500.00'))
+
+        with mock.patch.object(MoralisService, '_fetch_wallet_net_worth', side_effect=slow_fetch) as fetch:
+            first = self.client.get('/api/wallets/sync/')
+            # Still stale (the stored balance is as old as the entry), and the refresh is still running
+            second = self.client.get('/api/wallets/sync/')
+            release.set()
+            self.join_refreshes()
+            third = self.client.get('/api/wallets/sync/')
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(
+            [response.data['wallets'][0]['balance_usd'] for response in (first, second, third)],
+            ['200.00', '200.00', '500.00']
+        )
+        self.assertEqual(NetWorthCache.stats()['stale'], 2)
+        self.assertEqual(NetWorthCache.stats()['refreshes'], 1)
+        # The stale balance was stamped with when it was fetched, and written once
+        self.assertEqual(WalletBalanceSnapshot.objects.filter(wallet=wallet).count(), 2)
+        self.assertGreater(Wallet.objects.get().synced_at, timezone.now() - timedelta(seconds=5))
+
+    @override_settings(MORALIS_CACHE_BACKEND='local', MORALIS_CACHE_TTL=60, MORALIS_CACHE_STALE_TTL=300)
+    def test_stale_balance_keeps_the_entry_age(self):
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        Wallet.objects.filter(id=wallet.id).update(synced_at=timezone.now() - timedelta(hours=1))
+        WalletUser.objects.create(user=self.user, wallet=wallet)
+
+        with mock.patch.object(MoralisService, '_fetch_wallet_net_worth', return_value=net_worth(('eth', '500.00'))):
+            self.client.get('/api/wallets/sync/')
+            self.join_refreshes()
+
+        wallet = Wallet.objects.get()
+        self.assertEqual(str(wallet.balance_usd), '200.00')
+        self.assertAlmostEqual(wallet.synced_at.timestamp(), self.fetched_at, places=3)
+
+    @override_settings(MORALIS_CACHE_BACKEND='local', MORALIS_CACHE_TTL=60, MORALIS_CACHE_STALE_TTL=300)
+    def test_add_refetches_instead_of_storing_a_stale_entry(self):
+        with mock.patch.object(MoralisService, '_fetch_wallet_net_worth', return_value=net_worth(('eth', '500.00'))) as fetch:
+            response = self.client.post('/api/wallets/add/', {'address': ADDRESS, 'chain': 'eth'}, format='json')
+
+        fetch.assert_called_once()
+        self.assertEqual(response.data['balance_usd'], '500.00')
+        self.assertEqual(NetWorthCache.stats()['stale'], 0)
+
+    @override_settings(MORALIS_CACHE_BACKEND='local', MORALIS_CACHE_TTL=60, MORALIS_CACHE_STALE_TTL=300)
+    def test_async_stale_reads_share_one_background_refresh(self):
+        calls = []
+
+        async def afetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return net_worth(('eth', '500.00'))
+
+        async def read_twice_then_wait():
+            results = await asyncio.gather(*[
+                NetWorthCache.aget_or_fetch(ADDRESS, ['eth'], afetch, allow_stale=True) for _ in range(2)
+            ])
+            for _ in range(100):
+                if NetWorthCache.stats()['refreshes']:
+                    break
+                await asyncio.sleep(0.01)
+            return results
+
+        results = async_to_sync(read_twice_then_wait)()
+
+        self.assertEqual([(data['chains'][0]['networth_usd'], fetched_at) for _, data, fetched_at in results],
+                         [('200.00', self.fetched_at)] * 2)
+        self.assertEqual(len(calls), 1)
+        success, data, fetched_at = NetWorthCache.get_or_fetch(ADDRESS, ['eth'], lambda: (False, 'unused'))
+        self.assertEqual(data['chains'][0]['networth_usd'], '500.00')
+        self.assertGreater(fetched_at, self.fetched_at)
+
+
+class SingleFlightTests(TestCase):
+    """Concurrent calls with the same key share one call of the function"""
+
+    def stat(self, name):
+        return SingleFlight.stats()[name]
+
+    def run_concurrently(self, fn, callers=5):
+        """Call SingleFlight.do from several threads, releasing fn once they all wait on it"""
+        release = threading.Event()
+        calls = []
+        outcomes = []
+        coalesced = self.stat('coalesced')
+
+        def leader_fn():
+            calls.append(1)
+            release.wait(timeout=5)
+            return fn()
+
+        def caller():
+            try:
+                outcomes.append(SingleFlight.do('flight', leader_fn))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.stat('coalesced') - coalesced < callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        return calls, outcomes
+
+    def test_concurrent_calls_share_the_result(self):
+        result = {'chains': []}
+        calls, outcomes = self.run_concurrently(lambda: result)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(outcomes), 5)
+        for outcome in outcomes:
+            self.assertIs(outcome, result)
+
+    def test_concurrent_calls_share_the_exception(self):
+        error = ValueError('moralis down')
+
+        def fail():
+            raise error
+
+        calls, outcomes = self.run_concurrently(fail)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(outcomes), 5)
+        for outcome in outcomes:
+            self.assertIs(outcome, error)
+
+    def test_async_calls_on_one_loop_share_the_result(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'chains': []}
+
+        async def run():
+            return await asyncio.gather(*(SingleFlight.ado('flight', fetch) for _ in range(5)))
+
+        results = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertIs(result, results[0])
+
+    @override_settings(MORALIS_SINGLEFLIGHT_CROSS_PROCESS=True, MORALIS_SINGLEFLIGHT_POLL_INTERVAL=0.001)
+    def test_waits_for_the_process_holding_the_lock(self):
+        # Another process is making this call
+        cache.add('singleflight:flight', True, 30)
+        self.addCleanup(cache.delete, 'singleflight:flight')
+        published = (True, {'chains': []}, time.time())
+        peek = mock.Mock(side_effect=[None, published])
+        fn = mock.Mock()
+        waits = self.stat('cross_process_waits')
+
+        self.assertIs(SingleFlight.do('flight', fn, peek=peek), published)
+
+        fn.assert_not_called()
+        self.assertEqual(peek.call_count, 2)
+        self.assertEqual(self.stat('cross_process_waits') - waits, 2)
+
+    @override_settings(
+        MORALIS_SINGLEFLIGHT_CROSS_PROCESS=True, MORALIS_SINGLEFLIGHT_POLL_INTERVAL=0.001, MORALIS_READ_TIMEOUT=0.01,
+    )
+    def test_calls_directly_when_the_lock_holder_never_publishes(self):
+        cache.add('singleflight:flight', True, 30)
+        self.addCleanup(cache.delete, 'singleflight:flight')
+        fn = mock.Mock(return_value=(True, {'chains': []}))
+
+        with self.assertLogs('wallets.singleflight', 'WARNING'):
+            self.assertEqual(SingleFlight.do('flight', fn, peek=lambda: None), (True, {'chains': []}))
+
+        fn.assert_called_once_with()
+
+
+class MoralisHttpRetryTests(TestCase):
+    """The pooled client retries 429/5xx and connection errors, honouring Retry-After"""
+
+    def setUp(self):
+        for component in (MoralisHttpClient, MoralisCircuitBreaker):
+            component.reset()
+            self.addCleanup(component.reset)
+        self.session = mock.Mock()
+        patcher = mock.patch.object(MoralisHttpClient, 'get_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('wallets.http.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, *responses):
+        self.session.request.side_effect = [
+            response if isinstance(response, Exception)
+            else mock.Mock(status_code=response[0], headers=response[1] if len(response) > 1 else {})
+            for response in responses
+        ]
+
+    def slept(self):
+        return [call.args[0] for call in self.sleep.call_args_list]
+
+    def counters(self):
+        stats = MoralisHttpClient.stats()
+        return stats['requests'], stats['retries'], stats['errors']
+
+    def test_429_waits_for_retry_after_seconds(self):
+        self.respond((429, {'Retry-After': '2'}), (200,))
+
+        response = MoralisHttpClient.get('https://moralis.test')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.slept(), [2.0])
+        self.assertEqual(self.counters(), (2, 1, 0))
+
+    def test_retry_after_http_date(self):
+        retry_at = format_datetime(timezone.now() + timedelta(seconds=5), usegmt=True)
+        self.respond((503, {'Retry-After': retry_at}), (200,))
+
+        MoralisHttpClient.get('https://moralis.test')
+
+        [delay] = self.slept()
+        self.assertAlmostEqual(delay, 5, delta=1.5)
+
+    @override_settings(MORALIS_RETRY_MAX_DELAY=10)
+    def test_retry_after_is_capped(self):
+        self.respond((429, {'Retry-After': '120'}), (200,))
+        MoralisHttpClient.get('https://moralis.test')
+        self.assertEqual(self.slept(), [10])
+
+    @override_settings(MORALIS_MAX_RETRIES=2, MORALIS_RETRY_BACKOFF=0.5)
+    def test_5xx_gives_up_after_max_retries(self):
+        self.respond((503,), (502,), (500,))
+
+        with self.assertLogs('wallets.http', 'WARNING'):
+            response = MoralisHttpClient.get('https://moralis.test')
+
+        # The last response is returned as is once retries are used up
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.session.request.call_count, 3)
+        delays = self.slept()
+        self.assertEqual(len(delays), 2)
+        for attempt, delay in enumerate(delays):
+            self.assertLessEqual(delay, 0.5 * 2 ** attempt)
+        self.assertEqual(self.counters(), (3, 2, 0))
+
+    @override_settings(MORALIS_MAX_RETRIES=2)
+    def test_connection_error_is_raised_after_the_last_retry(self):
+        self.respond(requests.ConnectionError('refused'), requests.Timeout('slow'), requests.ConnectionError('refused'))
+
+        with self.assertLogs('wallets.http', 'WARNING'), self.assertRaises(requests.ConnectionError):
+            MoralisHttpClient.get('https://moralis.test')
+
+        self.assertEqual(self.session.request.call_count, 3)
+        self.assertEqual(self.counters(), (3, 2, 1))
+
+    @override_settings(MORALIS_MAX_RETRIES=2)
+    def test_connection_error_then_success(self):
+        self.respond(requests.ConnectionError('refused'), (200,))
+
+        with self.assertLogs('wallets.http', 'WARNING'):
+            response = MoralisHttpClient.get('https://moralis.test')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(), (2, 1, 0))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Staff requests flagged with X-Profile or ?_profile=1 are profiled and stored"""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = get_user_model().objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        get_user_model().objects.create_user(email='alice@example.com', password='pw')
+
+    def auth(self, email):
+        response = self.client.post('/api/users/token/', {'email': email, 'password': 'pw'})
+        return {'HTTP_AUTHORIZATION': f"Bearer {response.data['access']}"}
+
+    def test_non_staff_requests_are_not_profiled(self):
+        response = self.client.get('/api/wallets/add/', HTTP_X_PROFILE='1', **self.auth('alice@example.com'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertNotIn('Server-Timing', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_request_is_profiled(self):
+        response = self.client.get('/api/wallets/add/', HTTP_X_PROFILE='1', **self.auth('staff@example.com'))
+
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual((profile.user, profile.path, profile.status_code), (self.staff, '/api/wallets/add/', 200))
+        self.assertGreater(profile.query_count, 0)
+        self.assertEqual(len(profile.queries), profile.query_count)
+        self.assertIn('wallets_wallet', profile.queries[0]['sql'])
+        self.assertEqual(response['X-Profile-Queries'], str(profile.query_count))
+
+    def test_profile_query_parameter_must_be_truthy(self):
+        auth = self.auth('staff@example.com')
+        for query, profiled in (('_profile=1', True), ('_profile=0', False), ('_profile=', False), ('no_profile=1', False)):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/wallets/add/?{query}', **auth)
+                self.assertEqual('X-Profile-Id' in response, profiled)
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsEndpointTests(TestCase):
+    """/metrics is open to the scrape token and staff, and renders cumulative histograms"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+        get_user_model().objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        get_user_model().objects.create_user(email='alice@example.com', password='pw')
+
+    def bearer(self, email):
+        response = self.client.post('/api/users/token/', {'email': email, 'password': 'pw'})
+        return f"Bearer {response.data['access']}"
+
+    def test_access(self):
+        for authorization, status_code in (
+            ('Bearer scrape-secret', 200),
+            (self.bearer('staff@example.com'), 200),
+            (self.bearer('alice@example.com'), 403),
+            ('Bearer wrong-secret', 403),
+            (None, 403),
+        ):
+            with self.subTest(authorization=authorization):
+                headers = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+                self.assertEqual(self.client.get('/metrics', **headers).status_code, status_code)
+
+    def test_histogram_exposition(self):
+        for duration in (0.003, 0.05, 0.05, 20):
+            metrics.observe_moralis_call('net_worth', ['eth'], 200, duration)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE moralis_request_duration_seconds histogram', lines)
+        labels = 'endpoint="net_worth",chain="eth",status="200"'
+        buckets = [line for line in lines if line.startswith(f'moralis_request_duration_seconds_bucket{{{labels},')]
+        # Buckets are cumulative, upper bounds inclusive, ending with +Inf
+        self.assertEqual(buckets[:4], [
+            f'moralis_request_duration_seconds_bucket{{{labels},le="0.005"}} 1',
+            f'moralis_request_duration_seconds_bucket{{{labels},le="0.01"}} 1',
+            f'moralis_request_duration_seconds_bucket{{{labels},le="0.025"}} 1',
+            f'moralis_request_duration_seconds_bucket{{{labels},le="0.05"}} 3',
+        ])
+        self.assertEqual(buckets[-2:], [
+            f'moralis_request_duration_seconds_bucket{{{labels},le="10"}} 3',
+            f'moralis_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4',
+        ])
+        self.assertIn(f'moralis_request_duration_seconds_count{{{labels}}} 4', lines)
+        [total] = [line for line in lines if line.startswith(f'moralis_request_duration_seconds_sum{{{labels}}}')]
+        self.assertAlmostEqual(float(total.rsplit(' ', 1)[1]), 20.103)
+
+
+class RateLimiterTests(TestCase):
+    """Rate limiting queues calls instead of starving the sync fan-out, and rejections are quiet"""
+
+    def setUp(self):
+        MoralisRateLimiter.reset()
+        self.addCleanup(MoralisRateLimiter.reset)
+
+    @override_settings(MORALIS_PER_CHAIN_CONCURRENCY=1, MORALIS_POOL_SIZE=5, MORALIS_COMPUTE_UNITS_PER_SECOND=100000)
+    def test_chain_cap_of_one_serialises_calls_on_that_chain(self):
+        lock = threading.Lock()
+        in_flight = {'eth': 0, 'polygon': 0}
+        peaks = {'eth': 0, 'polygon': 0}
+
+        def call(chain):
+            with MoralisRateLimiter.limit('net-worth', chains=[chain]):
+                with lock:
+                    in_flight[chain] += 1
+                    peaks[chain] = max(peaks[chain], in_flight[chain])
+                time.sleep(0.05)
+                with lock:
+                    in_flight[chain] -= 1
+
+        threads = [threading.Thread(target=call, args=(chain,)) for chain in ['eth'] * 4 + ['polygon'] * 2]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(peaks, {'eth': 1, 'polygon': 1})
+        # The four eth calls ran one after another
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    @override_settings(MORALIS_COMPUTE_UNITS_PER_SECOND=100, MORALIS_RATE_LIMIT_MAX_WAIT=0, MORALIS_CACHE_TTL=0)
+    def test_budget_rejection_is_logged_without_a_traceback(self):
+        with self.assertLogs('wallets.services', 'WARNING') as logs:
+            success, error = MoralisService.get_wallet_net_worth(ADDRESS, 'eth')
+
+        self.assertFalse(success)
+        self.assertIn('compute unit budget exhausted', error)
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING'])
+        self.assertIsNone(logs.records[0].exc_info)
+
+
+class CircuitBreakerTests(TestCase):
+    """While the Moralis circuit breaker is open, sync serves stored balances without calling Moralis"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        wallet = Wallet.objects.create(address=ADDRESS, chain='eth', balance_usd='100.00')
+        Wallet.objects.filter(id=wallet.id).update(synced_at=timezone.now() - timedelta(hours=1))
+        WalletUser.objects.create(user=self.user, wallet=wallet)
+        MoralisCircuitBreaker.reset()
+        self.addCleanup(MoralisCircuitBreaker.reset)
+
+    @override_settings(MORALIS_BREAKER_MIN_CALLS=4, MORALIS_BREAKER_ERROR_RATE=0.5)
+    def test_breaker_opens_on_error_rate(self):
+        for failed in (False, True, False):
+            MoralisCircuitBreaker.record(failed, 0.1)
+        self.assertEqual(MoralisCircuitBreaker.state(), MoralisCircuitBreaker.CLOSED)
+        MoralisCircuitBreaker.record(True, 0.1)
+        self.assertEqual(MoralisCircuitBreaker.state(), MoralisCircuitBreaker.OPEN)
+        self.assertFalse(MoralisCircuitBreaker.allow())
+
+    @mock.patch.object(MoralisService, 'get_wallet_net_worth_entry')
+    def test_sync_returns_stored_balances_while_open(self, get_net_worth):
+        MoralisCircuitBreaker.force_open()
+
+        response = self.client.get('/api/wallets/sync/')
+
+        get_net_worth.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['stale'])
+        [wallet] = response.data['wallets']
+        self.assertEqual((wallet['address'], str(wallet['balance_usd']), wallet['stale']), (ADDRESS, '100.00', True))
+
+    @override_settings(MORALIS_BREAKER_OPEN_SECONDS=0, MORALIS_BREAKER_HALF_OPEN_CALLS=1)
+    def test_cancelled_probes_neither_close_nor_hold_the_breaker(self):
+        class CancelledRequest:
+            async def __aenter__(self):
+                raise asyncio.CancelledError
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+        session = mock.Mock()
+        session.request.return_value = CancelledRequest()
+
+        async def cancelled_call():
+            try:
+                await AsyncMoralisService._send(session, 'GET', 'https://moralis.test', 'net-worth', ['eth'])
+            except asyncio.CancelledError:
+                pass
+
+        MoralisCircuitBreaker.force_open()
+        self.assertEqual(MoralisCircuitBreaker.state(), MoralisCircuitBreaker.HALF_OPEN)
+        for _ in range(3):
+            async_to_sync(cancelled_call)()
+
+        # No probe outcome was recorded, and the probe slot is free again
+        self.assertEqual(MoralisCircuitBreaker.state(), MoralisCircuitBreaker.HALF_OPEN)
+        self.assertTrue(MoralisCircuitBreaker.allow())
+        MoralisCircuitBreaker.record(failed=False, duration=0.1)
+        self.assertEqual(MoralisCircuitBreaker.state(), MoralisCircuitBreaker.CLOSED)
+
+
+def token(address, symbol, balance, usd_price, decimals=18):
+    """A Moralis wallet token balance entry"""
+    return {'token_address': address, 'symbol': symbol, 'balance': balance, 'decimals': decimals, 'usd_price': usd_price}
+
+
+class HoldingsTests(TestCase):
+    """Token holdings are replaced per wallet and aggregated across a user's wallets in one query"""
+
+    USDC = '0x' + 'c' * 40
+    WETH = '0x' + 'e' * 40
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='alice@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.wallets = [Wallet.objects.create(address=address, chain='eth') for address in (ADDRESS, '0x' + 'b' * 40)]
+        for wallet in self.wallets:
+            WalletUser.objects.create(user=self.user, wallet=wallet)
+
+    def refresh(self, tokens):
+        with mock.patch.object(MoralisService, 'get_wallet_tokens', side_effect=lambda address, chain: (True, tokens[address])):
+            return HoldingsService.refresh_holdings(self.wallets)
+
+    def test_refresh_replaces_holdings(self):
+        self.refresh({
+            ADDRESS: [token('0x' + 'C' * 40, 'USDC', '1500000', 1.0, decimals=6), token(self.WETH, 'WETH', '10' + '0' * 17, 2000)],
+            self.wallets[1].address: [token(self.USDC, 'USDC', '500000', 1.0, decimals=6)],
+        })
+        self.assertEqual(TokenHolding.objects.count(), 3)
+
+        stored, failures = self.refresh({ADDRESS: [token(self.USDC, 'USDC', '2500000', 1.0, decimals=6)], self.wallets[1].address: []})
+
+        self.assertEqual((stored, failures), (1, []))
+        self.assertEqual(list(TokenHolding.objects.values_list('token_address', 'amount')), [(self.USDC, 2500000)])
+
+    def test_breakdown_aggregates_in_one_query(self):
+        self.refresh({
+            ADDRESS: [token(self.USDC, 'USDC', '1500000', 1.0, decimals=6), token(self.WETH, 'WETH', '10' + '0' * 17, 2000)],
+            self.wallets[1].address: [token(self.USDC, 'USDC', '500000', 1.0, decimals=6)],
+        })
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/wallets/breakdown/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['symbol'], row['amount'], row['usd_value'], row['wallet_count']) for row in response.data['tokens']],
+            [('WETH', '1', '2000.00', 1), ('USDC', '2', '2.00', 2)]
+        )
+        self.assertEqual(response.data['total_usd'], '2002.00')
+
+    @override_settings(MORALIS_PRICE_BATCH_SIZE=1)
+    def test_price_refresh_revalues_wallets_without_fetching_them(self):
+        PortfolioService.get_summary(self.user.id)
+        self.refresh({
+            ADDRESS: [token(self.USDC, 'USDC', '1500000', 1.0, decimals=6), token(NATIVE_TOKEN, 'ETH', '10' + '0' * 17, 2000)],
+            self.wallets[1].address: [token(self.USDC, 'USDC', '500000', 1.0, decimals=6)],
+        })
+        prices = {self.USDC: Decimal('0.5'), WRAPPED_NATIVE_TOKENS['eth']: Decimal('3000')}
+        synced_at = list(Wallet.objects.order_by('id').values_list('synced_at', flat=True))
+
+        with mock.patch.object(MoralisService, 'get_token_prices', side_effect=lambda chain, addresses: (
+            True, {address: prices[address] for address in addresses}
+        )) as get_prices, mock.patch.object(MoralisService, 'get_wallet_net_worth_entry') as get_net_worth:
+            stored, calls, failures = PriceService.refresh_prices(PriceService.stale_tokens(timezone.now()))
+            self.assertEqual(PriceService.revalue_wallets(), (2, 2))
+
+        get_net_worth.assert_not_called()
+        self.assertEqual((stored, calls, failures, get_prices.call_count), (2, 2, [], 2))
+        self.assertEqual(TokenPrice.objects.get(token_address=NATIVE_TOKEN).usd_price, Decimal('3000'))
+        self.assertEqual(
+            [str(wallet.balance_usd) for wallet in Wallet.objects.order_by('id')], ['3000.75', '0.25']
+        )
+        # Revaluation isn't a sync, so the wallets stay due for their next Moralis fetch
+        self.assertEqual(list(Wallet.objects.order_by('id').values_list('synced_at', flat=True)), synced_at)
+        self.assertEqual(WalletBalanceSnapshot.objects.count(), 2)
+        self.assertEqual(str(PortfolioSummary.objects.get(user=self.user).total_usd), '3001.00')
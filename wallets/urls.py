@@ -1,10 +1,18 @@
 # wallets/urls.py
 from os import name
 from django.urls import path
-from .views import WalletView, get_supported_chains
+from rest_framework.settings import api_settings
+from .views import (
+    WalletView, get_supported_chains, import_wallets, get_portfolio_summary, get_portfolio_breakdown,
+    get_balance_history, get_moralis_status
+)
+from .async_views import wallets_view, sync_wallets_view, remove_wallet_view
+from .streaming import EventStreamRenderer, NDJSONRenderer
 
 class WalletSyncView(WalletView):
     """API endpoint specifically for wallet synchronization"""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer, NDJSONRenderer]
+
     def get(self, request):
         """Override get method to call sync"""
         return self.sync(request)
@@ -27,4 +35,24 @@ urlpatterns = [
 
     # Endpoint for deleting a wallet (PUT)
     path('remove/', WalletDeleteView.as_view(), name='remove-wallet'),
+
+    # Endpoint for adding many wallets at once from JSON or CSV (POST)
+    path('import/', import_wallets, name='import-wallets'),
+
+    # Endpoint for the user's portfolio totals (GET)
+    path('summary/', get_portfolio_summary, name='portfolio-summary'),
+
+    # Endpoint for the user's holdings per token, from stored token balances (GET)
+    path('breakdown/', get_portfolio_breakdown, name='portfolio-breakdown'),
+
+    # Endpoint for the user's portfolio value over time (GET)
+    path('history/', get_balance_history, name='balance-history'),
+
+    # Endpoint for Moralis client counters, staff only (GET)
+    path('moralis/status/', get_moralis_status, name='moralis-status'),
+
+    # Async versions of add/list, sync and remove for ASGI servers
+    path('async/add/', wallets_view, name='async-add-wallet'),
+    path('async/sync/', sync_wallets_view, name='async-sync-wallets'),
+    path('async/remove/', remove_wallet_view, name='async-remove-wallet'),
 ]
@@ -1,18 +1,40 @@
 # wallet/views.py
+import csv
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, parser_classes, permission_classes
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .serializers import AddWalletSerializer, WalletSerializer
-from .services import MoralisService
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from users.authentication import ClaimsJWTAuthentication
+from .addresses import normalize_address, normalize_chain
+from .circuit import MoralisCircuitBreaker
+from .serializers import AddWalletSerializer, WalletSerializer, PortfolioSummarySerializer
+from .services import MoralisService, WalletAlreadyAdded, WalletSyncService
 from .models import Wallet, WalletUser
+from .history import BalanceHistoryService
+from .holdings import HoldingsService
+from .imports import CSVParser, WalletImportService, rows_from_csv
+from .portfolio import PortfolioService, format_balance
+from .queue import SyncQueue
+from .conditional import etag_matches, wallet_list_etag, weak_etag
+from . import streaming
 import logging
 
 logger = logging.getLogger(__name__)
 
 class WalletView(APIView):
     """API endpoint for wallet operations"""
+    # Wallet data only needs the user's id, so skip the user lookup; staff
+    # checks stay on the default, cached-lookup authentication
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
@@ -54,8 +76,20 @@ class WalletView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Step 3: Fetch wallet data from Moralis
-        success, result = MoralisService.get_wallet_net_worth(address, chain)
+        # Step 3: Fetch wallet data from Moralis in one call for the requested chain and the
+        # chains this address is already tracked on, so those balances are refreshed too;
+        # other chains would cost compute units for data nobody stores
+        other_wallets = WalletSyncService.other_chain_wallets(address, chain)
+        success, result = MoralisService.get_wallet_net_worth(
+            address, chains=[chain] + [wallet.chain for wallet in other_wallets]
+        )
+        
+        if not success and MoralisCircuitBreaker.is_open():
+            return Response(
+                {'error': 'Wallet data is temporarily unavailable, please try again later'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max(1, round(MoralisCircuitBreaker.retry_after())))}
+            )
         
         if not success or not result or not isinstance(result, dict):
             return Response(
@@ -88,21 +122,18 @@ class WalletView(APIView):
             if not balance_value and 'networth_usd' in chain_data:
                 balance_value = chain_data.get('networth_usd', 0)
             
-            # Create separate defaults dictionary to avoid type errors
-            defaults_dict = {balance_field: balance_value}
-            
-            # Create or update the wallet
-            wallet, created = Wallet.objects.update_or_create(
-                address=address,
-                chain=chain,
-                defaults=defaults_dict
-            )
+            # Upsert the wallet and link it to the user in one transaction;
+            # the (user, wallet) unique constraint rejects duplicates
+            try:
+                wallet, created = WalletSyncService.add_wallet(request.user, address, chain, balance_value)
+            except WalletAlreadyAdded:
+                return Response(
+                    {'errors': {'non_field_errors': ["You have already added this wallet address for this blockchain."]}},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Link the wallet to the user
-            WalletUser.objects.get_or_create(
-                user=request.user,
-                wallet=wallet
-            )
+            # Keep the extra chain data for wallets already tracked on this address
+            WalletSyncService.update_other_chains(address, result, exclude_chain=chain, wallets=other_wallets)
             
             # Return the wallet data
             return Response(
@@ -118,66 +149,81 @@ class WalletView(APIView):
             )
         
     def get(self, request):
-        """Get all wallets for the authenticated user"""
-        # Get all wallet IDs for this user
-        wallet_ids = WalletUser.objects.filter(user=request.user).values_list('wallet_id', flat=True)
-        
-        # Get the wallet objects
-        wallets = Wallet.objects.filter(id__in=wallet_ids)
+        """
+        Get all wallets for the authenticated user
+        Answers 304 when If-None-Match carries the ETag of an unchanged listing
+        """
+        # One join query that reads only the listed fields
+        rows = list(
+            Wallet.objects.filter(walletuser__user=request.user)
+            .order_by('id')
+            .values('id', 'address', 'balance_usd', 'chain')
+        )
         
-        # Serialize and return
-        serializer = WalletSerializer(wallets, many=True)
-        return Response(serializer.data)
+        etag = wallet_list_etag(rows)
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(WalletSerializer.from_values(rows))
+        response['ETag'] = etag
+        # Per-user data: clients may keep it but must revalidate every time
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ['Authorization'])
+        return response
 
     def sync(self, request):
-        """Synchronize all wallets for the authenticated user"""
+        """
+        Synchronize all wallets for the authenticated user
+        With ?stream=ndjson or ?stream=sse each wallet is sent as soon as its
+        Moralis call completes, followed by a summary frame
+        """
+        stream_format = streaming.stream_format_for(request)
+        if stream_format is False:
+            return Response(
+                {'error': f"Unsupported stream format: {request.query_params.get('stream')}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         try:
             # Get all wallets for this user
-            wallet_ids = WalletUser.objects.filter(user=request.user).values_list('wallet_id', flat=True)
-            wallets = Wallet.objects.filter(id__in=wallet_ids)
+            wallets = Wallet.objects.filter(walletuser__user=request.user)
             
-            # Track successfully synced wallets
-            synced_wallets = []
-            
-            # Process each wallet
+            # Wallets refreshed within the freshness window don't need another Moralis call
+            fresh_cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'WALLET_SYNC_FRESH_SECONDS', 60))
+            stale_wallets = []
+            fresh_wallets = []
             for wallet in wallets:
-                # Call Moralis to get updated data
-                success, result = MoralisService.get_wallet_net_worth(wallet.address, wallet.chain)
-                
-                if not success or not isinstance(result, dict):
-                    logger.warning(f"Failed to sync wallet {wallet.address} ({wallet.chain}): {result}")
-                    continue
-                    
-                # Process the result similar to your post method
-                try:
-                    chains = result.get('chains', [])
-                    
-                    # Find the relevant chain data
-                    chain_data = next((c for c in chains if isinstance(c, dict) and c.get('chain') == wallet.chain), None)
-                    
-                    if not chain_data:
-                        logger.warning(f"No data found for wallet {wallet.address} on chain {wallet.chain}")
-                        continue
-                    
-                    # Update the wallet balance
-                    balance_value = chain_data.get('balance_usd', 0)
-                    if not balance_value and 'networth_usd' in chain_data:
-                        balance_value = chain_data.get('networth_usd', 0)
-                    
-                    # Update the wallet
-                    wallet.balance_usd = balance_value
-                    wallet.save()
-                    
-                    # Add to synced wallets list
-                    synced_wallets.append({
-                        'address': wallet.address,
-                        'chain': wallet.chain,
-                        'balance_usd': wallet.balance_usd
-                    })
-                    
-                except Exception as e:
-                    logger.exception(f"Error processing wallet update: {str(e)}")
-                    continue
+                if wallet.synced_at and wallet.synced_at >= fresh_cutoff:
+                    fresh_wallets.append(wallet)
+                else:
+                    stale_wallets.append(wallet)
+            
+            # With the job queue enabled, hand the refresh to the sync workers
+            # and return the balances we already have
+            if getattr(settings, 'WALLET_SYNC_USE_QUEUE', False):
+                return self.enqueue_sync(stale_wallets + fresh_wallets, stale_wallets)
+            
+            # While Moralis is failing, answer with the stored balances instead of waiting on it
+            if stale_wallets and MoralisCircuitBreaker.is_open():
+                return self.stored_sync(stream_format, fresh_wallets, stale_wallets)
+            
+            if stream_format:
+                return self.stream_sync(stream_format, fresh_wallets, stale_wallets)
+            
+            # Fetch the stale wallets from Moralis concurrently and store them with a single bulk write;
+            # cache entries past their TTL are used (stamped with their age) while they refresh
+            updated_wallets, failures = WalletSyncService.refresh_wallets(stale_wallets, allow_stale=True)
+            for wallet, error in failures:
+                logger.warning(f"Failed to sync wallet {wallet.address} ({wallet.chain}): {error}")
+            
+            synced_wallets = [
+                {
+                    'address': wallet.address,
+                    'chain': wallet.chain,
+                    'balance_usd': format_balance(wallet.balance_usd)
+                }
+                for wallet in fresh_wallets + updated_wallets
+            ]
             
             # Return the updated wallets
             return Response({
@@ -192,6 +238,71 @@ class WalletView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def stream_sync(self, stream_format, fresh_wallets, stale_wallets):
+        """Stream fresh wallets right away, then each stale wallet as its Moralis call completes"""
+        def frames():
+            updates = []
+            failures = []
+            try:
+                for wallet in fresh_wallets:
+                    yield streaming.wallet_frame(stream_format, wallet, wallet.balance_usd, fresh=True)
+                
+                for result in WalletSyncService.fetch_net_worths(stale_wallets, allow_stale=True):
+                    wallet_updates, wallet_failures = WalletSyncService.collect_updates([result])
+                    # Recorded before the frames go out, so a disconnect while sending them keeps them
+                    updates.extend(wallet_updates)
+                    failures.extend(wallet_failures)
+                    for wallet, balance_value, _ in wallet_updates:
+                        yield streaming.wallet_frame(stream_format, wallet, balance_value)
+                    for wallet, error in wallet_failures:
+                        logger.warning(f"Failed to sync wallet {wallet.address} ({wallet.chain}): {error}")
+                        yield streaming.error_frame(stream_format, wallet, error)
+                
+                # Balances are stored with one bulk write once every call is done
+                updated_wallets = WalletSyncService.save_balances(updates)
+                # Already stored: a disconnect while the summary goes out has nothing left to save
+                updates = []
+                yield streaming.summary_frame(stream_format, len(fresh_wallets), len(updated_wallets), len(failures))
+            except GeneratorExit:
+                # The client went away mid-stream: keep the balances fetched so far
+                WalletSyncService.save_balances(updates)
+                raise
+            except Exception as e:
+                logger.exception(f"Error during wallet synchronization: {str(e)}")
+                yield streaming.frame(stream_format, 'error', {'error': f"Failed to synchronize wallets: {str(e)}"})
+        
+        return streaming.stream_response(stream_format, frames())
+
+    def stored_sync(self, stream_format, fresh_wallets, stale_wallets):
+        """Return the stored balances of all wallets, the stale ones marked as such"""
+        if stream_format:
+            return streaming.stream_response(
+                stream_format, streaming.stored_frames(stream_format, fresh_wallets, stale_wallets)
+            )
+        wallets = WalletSyncService.stored_balances(fresh_wallets, stale_wallets)
+        return Response({
+            'wallets': wallets,
+            'count': len(wallets),
+            'stale': True
+        })
+
+    def enqueue_sync(self, wallets, stale_wallets):
+        """Queue a refresh of the stale wallets and return the stored balances of all wallets"""
+        queued = SyncQueue.enqueue(stale_wallets)
+        return Response({
+            'wallets': [
+                {
+                    'address': wallet.address,
+                    'chain': wallet.chain,
+                    'balance_usd': format_balance(wallet.balance_usd),
+                    'synced_at': wallet.synced_at
+                }
+                for wallet in wallets
+            ],
+            'count': len(wallets),
+            'queued': queued
+        }, status=status.HTTP_202_ACCEPTED)
+
     def delete(self, request):
         """Remove a wallet for the authenticated user"""
         try:
@@ -205,20 +316,27 @@ class WalletView(APIView):
                     {'error': 'Missing required fields: address and chain must be provided'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            chain = normalize_chain(str(chain))
+            address = normalize_address(str(address), chain)
                 
-            # Find and delete the wallet-user relationship directly
-            deleted_count, _ = WalletUser.objects.filter(
+            # Find the wallet-user relationship
+            link = WalletUser.objects.select_related('wallet').filter(
                 user=request.user,
                 wallet__address=address,
                 wallet__chain=chain
-            ).delete()
+            ).first()
             
-            # Check if any records were deleted
-            if deleted_count == 0:
+            # Check if the wallet is in the user's portfolio
+            if link is None:
                 return Response(
                     {'error': f"Wallet with address {address} on chain {chain} not found in your portfolio"},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            
+            # Delete the relationship and take the wallet out of the portfolio totals
+            with transaction.atomic():
+                link.delete()
+                PortfolioService.link_removed(request.user.id, link.wallet)
                 
             # Return success message
             return Response(
@@ -233,13 +351,155 @@ class WalletView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+SUPPORTED_CHAINS_ETAG = weak_etag(sorted(MoralisService.CHAIN_MAPPING.items()))
+
 @api_view(['GET'])
-def get_supported_chains(_request):
+@authentication_classes([ClaimsJWTAuthentication])
+def get_supported_chains(request):
     """Return a list of supported blockchain networks"""
+    if etag_matches(request, SUPPORTED_CHAINS_ETAG):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response({
+            'supported_chains': [
+                {'id': chain_id, 'name': chain_name} 
+                for chain_name, chain_id in MoralisService.CHAIN_MAPPING.items()
+            ]
+        })
+    # The list only changes with a deploy
+    response['ETag'] = SUPPORTED_CHAINS_ETAG
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication])
+@parser_classes([JSONParser, CSVParser, MultiPartParser, FormParser])
+def import_wallets(request):
+    """
+    Add many wallets to the authenticated user's portfolio in one request
+    Accepts a JSON list of {address, chain} objects (bare or under "wallets"),
+    a text/csv body, or a CSV upload in the "file" field
+    """
+    if 'file' in request.FILES:
+        try:
+            rows = rows_from_csv(request.FILES['file'].read().decode('utf-8'))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({'error': f"Could not read CSV file: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+    elif isinstance(request.data, list):
+        rows = request.data
+    elif isinstance(request.data.get('wallets'), list):
+        rows = request.data['wallets']
+    else:
+        return Response(
+            {'error': 'Expected a list of {address, chain} objects or a CSV file'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    max_rows = getattr(settings, 'WALLET_IMPORT_MAX_ROWS', 1000)
+    if len(rows) > max_rows:
+        return Response(
+            {'error': f"Too many wallets: {len(rows)} (at most {max_rows} per import)"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        results = WalletImportService.import_wallets(request.user, rows)
+    except Exception as e:
+        logger.exception(f"Error importing wallets: {str(e)}")
+        return Response(
+            {'error': f"Failed to import wallets: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
     return Response({
-        'supported_chains': [
-            {'id': chain_id, 'name': chain_name} 
-            for chain_name, chain_id in MoralisService.CHAIN_MAPPING.items()
+        'results': results,
+        'counts': Counter(result['status'] for result in results)
+    })
+
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+def get_portfolio_summary(request):
+    """Return the authenticated user's portfolio totals"""
+    summary = PortfolioService.get_summary(request.user.id)
+    return Response(PortfolioSummarySerializer(summary).data)
+
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+def get_portfolio_breakdown(request):
+    """
+    Return the authenticated user's holdings per token across their wallets,
+    from the stored token balances (no Moralis call); optionally filtered by chain
+    """
+    chain = request.query_params.get('chain')
+    tokens = HoldingsService.portfolio_breakdown(request.user.id, normalize_chain(chain) if chain else None)
+    total = sum((token['usd_value'] for token in tokens if token['usd_value'] is not None), Decimal('0.00'))
+    return Response({
+        'tokens': [
+            {
+                **token,
+                # Plain notation without trailing zeros (1.5 rather than 1.500000000000000000)
+                'amount': f"{token['amount'].normalize():f}",
+                'usd_price': str(token['usd_price']) if token['usd_price'] is not None else None,
+                'usd_value': str(token['usd_value']) if token['usd_value'] is not None else None,
+            }
+            for token in tokens
+        ],
+        'count': len(tokens),
+        'total_usd': str(total)
+    })
+
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+def get_balance_history(request):
+    """
+    Return the authenticated user's portfolio value over time
+    Query params: range (1d, 7d, 30d, 90d, 1y, 5y), interval (hour, day, week),
+    and optionally address and chain to chart a single wallet
+    """
+    range_name = request.query_params.get('range', '30d')
+    if range_name not in BalanceHistoryService.RANGES:
+        return Response(
+            {'error': f"Unsupported range: {range_name}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    range_length, default_interval = BalanceHistoryService.RANGES[range_name]
+    
+    interval = request.query_params.get('interval', default_interval)
+    if interval not in BalanceHistoryService.INTERVALS:
+        return Response(
+            {'error': f"Unsupported interval: {interval}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if range_length / BalanceHistoryService.INTERVALS[interval] > BalanceHistoryService.MAX_POINTS:
+        return Response(
+            {'error': f"Interval {interval} is too fine for range {range_name}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    wallet_filter = None
+    address = request.query_params.get('address')
+    chain = request.query_params.get('chain')
+    if address and chain:
+        chain = normalize_chain(chain)
+        wallet_filter = {'address': normalize_address(address, chain), 'chain': chain}
+    
+    points = BalanceHistoryService.portfolio_history(
+        request.user.id,
+        timezone.now() - range_length,
+        interval,
+        wallet_filter
+    )
+    return Response({
+        'range': range_name,
+        'interval': interval,
+        'points': [
+            {'timestamp': timestamp, 'balance_usd': str(balance)}
+            for timestamp, balance in points
         ]
     })
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_moralis_status(_request):
+    """Return Moralis client counters (connection pool, retries, cache) for monitoring"""
+    return Response(MoralisService.stats())